@@ -2,6 +2,115 @@
 
 """
 CombatBot
+v4.3.26
+- -s: a fight search that runs out of its SEARCH_BUDGET is left to the
+  safety map again (no best-so-far plans; they lost fights the safety
+  map holds). My ants start from safety map moves that do not share a
+  square, so the search need not leave them to fix a collision
+v4.3.25
+- combat safety in one window over all ants of the players present
+  (window_safety): per fight windows and small_safety took longer than
+  one pass (0.45-0.5 ms against 0.55-0.7 ms per turn on the 4-player
+  logs, 1.6-1.8 ms against 3.5-4 ms on a 150x150 map); fights are only
+  clustered for the search (-s)
+v4.3.24
+- -w: the worker's fields correct this turn's prepared start fields
+  (their decay, faded and hidden squares, new threat kept) instead of
+  replacing them; a late worker leaves them as prepared. The worker
+  diffused last turn's sources, so it still lags a turn behind
+  clamps; the WORKER_ITERATIONS steps only bring them in locally.
+  The worker is closed when the game ends.
+- food: no cascade once the worker's fields are in use
+v4.3.23
+- on large maps (E_TILED_CELLS) the warm explore run is tiled
+  (DiffusionField.update): only tiles where squares faded, came back
+  into the dark, or changed clamps or blockers, and tiles still
+  settling, are stepped; unexplored squares behind the frontier are
+  blocked so their tiles rest
+v4.3.22
+- -e: the predicted attack scent of far enemies is added into the
+  scent field at their destinations (MovePredictor.occupancy)
+- init_options returns the arguments left over (compare_combat_safety)
+v4.3.21
+- the combat memo (-m) only holds search plans (-s): window_safety
+  hit it too rarely to pay for its keys; memo hit rate logged after
+  the searches
+v4.3.20
+- -s: a fight search that runs out of its SEARCH_BUDGET plays the best
+  moves it found so far (not memoised); only if those are the moves my
+  ants started from is the fight left to the safety map
+v4.3.19
+- fights of at most SMALL_FIGHT ants (1v1, 2v1) skip the combat window
+  and memo: small_safety reads which ants threaten which squares off 
+  their stamps for just the squares the fight can change
+- combat_clusters joins linked ants by union-find
+v4.3.18
+- hilldist_calc and the DistanceFields (sharing ants.neighbours) use
+  NeighbourTable.spread
+v4.3.17
+- -e/--predict: proj.predict.MovePredictor learns each enemy player's
+  moves from ants matched between turns; in combat safety enemies only
+  make moves with at least PREDICT_LIKELY probability, and the attack
+  scent of enemies away from my hills is shared out over their likely
+  squares
+v4.3.16
+- -m/--memo: combat memo (proj.combat.CombatCache) of window_safety
+  results and, with -s, search plans, by fight pattern up to rotation
+  and reflection; hit rate logged each turn; -f/--memo-file FILE keeps
+  it across games (saved every MEMO_SAVE_TURNS turns and at the end)
+- search moves are stay, then the neighbour table's directions
+v4.3.15
+- -s/--search: each fight with my ants in it (from combat_clusters) is
+  planned by proj.combat.CombatSearch within SEARCH_BUDGET ms; fights
+  that are larger than SEARCH_MAX_ANTS or run out of time use the
+  safety map as before; my ants start from the safety map's move
+v4.3.14
+- combat safety per fight: ants are clustered (combat_clusters) and
+  each fight between players is worked out in a window around it with
+  one attack layer per player in it (window_safety); no more 10-layer
+  attack and weakness fields
+v4.3.13
+- gen_combat_safety batched over all players: one bincount of every
+  ant's combat stamp, weakness as total minus own, and one minimum
+  scatter over every enemy's candidate moves; the loop version is kept
+  as gen_combat_safety_loops (compare_combat_safety.py checks the two)
+v4.3.12
+- -d/--distance food|explore (repeatable): that scent is an exact BFS
+  distance gradient (proj.distance) instead of a diffusion channel
+  - food: 50 * U_DISTANCE_DECAY**distance to the nearest food, within
+    U_DISTANCE_CUTOFF; ants do not soak it up as they do the diffusion
+  - explore: 3 * E_DISTANCE_DECAY**distance to unexplored squares
+v4.3.11
+- -w/--worker: a worker process (proj.worker) runs each turn's full
+  diffusion while the next turn is parsed and fought; the bot restarts
+  from those fields with WORKER_ITERATIONS steps (last turn's fields if
+  the worker is late)
+v4.3.10
+- -p/--precision: "single" keeps scents in float32 and combat counts in
+  int16 (default "double": float64 / int)
+v4.3.9
+- explore scent persists between turns: E_WARM_ITERATIONS steps from
+  last turn's field, in which visible squares fade (E_VISIBLE_DECAY)
+  and squares just out of sight restart at 1.0
+v4.3.8
+- on large maps (CASCADE_CELLS) food and explore scents start from a
+  coarse-grid run standing for CASCADE_ITERATIONS steps, so ants far
+  from food or frontier still see a gradient
+v4.3.7
+- diffusion stops early on convergence (DIFF_TOLERANCE) or DIFF_RESERVE
+  ms before the turn ends; iterations run and residuals are logged
+v4.3.6
+- food, explore and attack scents diffuse together (DiffusionStack);
+  diffuse_* only prepare their channel
+v4.3.5
+- diffusion through proj.diffusion.DiffusionField; stencils kept
+  between turns
+v4.3.4
+- gen_combat_safety stamps all ants of a player at once (*_many stamps)
+v4.3.3
+- hilldist_calc: array BFS over ants.neighbours table
+- movement uses ants.reservations instead of cell.unoccupied_next
+- gen_combat_safety uses ants.by_owner; skips absent players
 v4.3.2 (017)
 - fixed bug: a_scent inconsistency due to adding to empty value
 v4.3.1 (016)
@@ -71,12 +180,26 @@ from math import sqrt
 import numpy as np
 
 from proj.numAnts import Ants
-from proj.numLocation import or_stamp, increment_stamp, min_stamp
+from proj.numLocation import (or_stamp, increment_stamp_many, 
+                               min_stamp_many, mask_offsets, stamp_cells)
+from proj.diffusion import DiffusionField, DiffusionStack
+from proj.worker import DiffusionWorker
+from proj.distance import DistanceField
+from proj.combat import CombatSearch, CombatCache
+from proj.predict import MovePredictor
 from proj.constants import LAND, WATER, UNKNOWN, ME, FOOD, INF, SAFE, NEUTRAL, DIE
 
 class Settings:
     VISUALIZE = False
     LOGGING = False
+    SCENT_DTYPE = np.float64
+    COUNT_DTYPE = int
+    WORKER = False
+    DISTANCE = ()
+    SEARCH = False
+    MEMO = False
+    MEMO_FILE = None
+    PREDICT = False
 log = logging.getLogger(__name__)
 
 def init_options():
@@ -88,11 +211,48 @@ def init_options():
     parser.add_option("-v", "--visual", action="store_true", 
                       dest="visualize", default=False, 
                       help="Turns on custom visualization.")
+    parser.add_option("-p", "--precision", dest="precision",
+        type="choice", choices=("double", "single"), default="double",
+        help="single: float32 scent fields and int16 combat counts.")
+    parser.add_option("-w", "--worker", action="store_true",
+                      dest="worker", default=False,
+                      help="Diffuse in a worker process, one turn behind.")
+    parser.add_option("-d", "--distance", action="append", dest="distance",
+        type="choice", choices=("food", "explore"), default=[],
+        help="BFS distance gradient instead of diffusion for a scent.")
+    parser.add_option("-s", "--search", action="store_true", dest="search",
+                      default=False, 
+                      help="Plan fights by combat search (safety map if "
+                           "out of time).")
+    parser.add_option("-m", "--memo", action="store_true", dest="memo",
+                      default=False, 
+                      help="Look up search plans (-s) of fights seen "
+                           "before in a combat memo.")
+    parser.add_option("-f", "--memo-file", dest="memo_file", 
+                      metavar="FILE",
+                      help="Keep the combat memo in FILE across games "
+                           "(implies -m).")
+    parser.add_option("-e", "--predict", action="store_true", 
+                      dest="predict", default=False, 
+                      help="Learn enemy moves; combat only expects their "
+                           "likely ones.")
                      
     (options, args) = parser.parse_args()
     
     # setup visualizer
     Settings.VISUALIZE = options.visualize
+    
+    Settings.WORKER = options.worker
+    Settings.DISTANCE = tuple(options.distance)
+    Settings.SEARCH = options.search
+    Settings.MEMO = options.memo or options.memo_file is not None
+    Settings.MEMO_FILE = options.memo_file
+    Settings.PREDICT = options.predict
+    
+    # setup field types
+    if options.precision == "single":
+        Settings.SCENT_DTYPE = np.float32
+        Settings.COUNT_DTYPE = np.int16
 
     # setup logging
     level = {"DEBUG": logging.DEBUG,
@@ -108,6 +268,7 @@ def init_options():
             logging.basicConfig(filename=LOG_FILENAME,level=LOGLEVEL)
             
     log.info("\n\noptions: %s", options)
+    return args
 
 ##def regionalize(lset):
     ##land = set(loc for loc in lset if loc.terrain is LAND)
@@ -129,12 +290,53 @@ class MyBot(object):
         MyBot.U_DECAY = 0.95
         
         MyBot.E_FACTOR = 0.15
-        MyBot.E_ITERATIONS = 90
+        MyBot.E_ITERATIONS = 90 # first turn
+        MyBot.E_WARM_ITERATIONS = 30
+        MyBot.E_VISIBLE_DECAY = 0.5
+        # maps of at least E_TILED_CELLS squares: warm explore runs only
+        # step the tiles still changing
+        MyBot.E_TILED_CELLS = 20000
         
         MyBot.A_FACTOR = 0.2
         MyBot.COOP_FACTOR = 1.01
         MyBot.A_ITERATIONS = 40
         MyBot.A_DECAY = 0.9
+        
+        # iterations above are maxima: stop once no square changes by
+        # more than DIFF_TOLERANCE, or DIFF_RESERVE ms before turn ends
+        MyBot.DIFF_TOLERANCE = 1e-3
+        MyBot.DIFF_RESERVE = 150
+        
+        # maps of at least CASCADE_CELLS squares: food and explore scents
+        # start from DiffusionField.cascade
+        MyBot.CASCADE_CELLS = 20000
+        MyBot.CASCADE_ITERATIONS = 400
+        
+        # with a diffusion worker: steps run here on top of its fields
+        MyBot.WORKER_ITERATIONS = 10
+        
+        # scents from DistanceField (-d): per-square decay with distance
+        MyBot.U_DISTANCE_DECAY = 0.8
+        MyBot.U_DISTANCE_CUTOFF = 30
+        MyBot.E_DISTANCE_DECAY = 0.9
+        
+        # combat search (-s): ms per fight, largest fight searched, ms of
+        # the turn left unsearched; my losses count this much more
+        MyBot.SEARCH_BUDGET = 10
+        MyBot.SEARCH_MAX_ANTS = 30
+        MyBot.SEARCH_RESERVE = 150
+        MyBot.SEARCH_LOSS_WEIGHT = 1.1
+        
+        # combat memo (-m): fights kept; with a file (-f), saved every
+        # MEMO_SAVE_TURNS turns if MEMO_SAVE_RESERVE ms are left
+        MyBot.MEMO_SIZE = 4096
+        MyBot.MEMO_SAVE_TURNS = 50
+        MyBot.MEMO_SAVE_RESERVE = 200
+        
+        # enemy move prediction (-e): how fast what was seen fades, and
+        # the least probability of an enemy move combat still expects
+        MyBot.PREDICT_DECAY = 0.98
+        MyBot.PREDICT_LIKELY = 0.1
     
     # do_setup is run once at the start of the game
     # after the bot has received the game settings
@@ -145,18 +347,54 @@ class MyBot(object):
         if Settings.VISUALIZE:
             self.timer_cutoff = False
         
-        self.u_scent_field = np.zeros(ants.dimensions) # unified
-        self.e_scent_field = np.zeros(ants.dimensions) # exploration
-        self.a_scent_field = np.zeros(ants.dimensions) # attack
+        scent_dtype = Settings.SCENT_DTYPE
+        # unified, exploration and attack scents
+        self.u_scent_field = np.zeros(ants.dimensions, scent_dtype)
+        self.e_scent_field = np.zeros(ants.dimensions, scent_dtype)
+        self.e_visible = None # visible squares at the last explore run
+        self.e_gain = 0.0 # start field per last turn's field (use_worker)
+        self.a_scent_field = np.zeros(ants.dimensions, scent_dtype)
         self.enemy_seen = False
+        self.u_diffusion = DiffusionField(ants.dimensions, MyBot.DIFF_FACTOR,
+                                          scent_dtype)
+        self.e_diffusion = DiffusionField(ants.dimensions, MyBot.E_FACTOR,
+                                          scent_dtype)
+        self.a_diffusion = DiffusionField(ants.dimensions, MyBot.A_FACTOR,
+                                          scent_dtype)
+        self.diffusion = DiffusionStack(ants.dimensions, scent_dtype)
+        self.u_distance = DistanceField(ants.dimensions, ants.neighbours)
+        self.e_distance = DistanceField(ants.dimensions, ants.neighbours)
+        self.worker = None
+        if Settings.WORKER:
+            self.worker = DiffusionWorker(ants.dimensions, 
+                    [MyBot.DIFF_FACTOR, MyBot.E_FACTOR, MyBot.A_FACTOR],
+                    scent_dtype)
+            self.worker.start()
         
-        self.player_dimensions = (10, ants.rows, ants.cols)
-        self.attack_field = np.empty(self.player_dimensions, dtype=int)
-        self.weakness_field = np.empty(self.player_dimensions, dtype=int)
-        self.lowest_enemy_weakness = np.empty(ants.dimensions, dtype=int)
+        count_dtype = Settings.COUNT_DTYPE
+        self.lowest_enemy_weakness = np.empty(ants.dimensions, count_dtype)
+        # no enemy can attack: INF, or the largest count that fits
+        self.no_enemy = min(INF, np.iinfo(count_dtype).max)
         self.safety_field = np.empty(ants.dimensions, dtype=np.int8)
         self.soldiers = None
         self.normal_ants = None
+        self.fights = [] # (centres, owners) of fights with my ants in
+        self.combat_search = CombatSearch(ants.dimensions, ants.attackradius2,
+                                          MyBot.SEARCH_LOSS_WEIGHT)
+        self.predictor = None
+        if Settings.PREDICT:
+            self.predictor = MovePredictor(ants.dimensions, ants.neighbours,
+                                           MyBot.PREDICT_DECAY)
+        self.memo = None
+        if Settings.MEMO:
+            # plans only hold for the same attack range and scores
+            header = (ants.attackradius2, MyBot.SEARCH_LOSS_WEIGHT)
+            self.memo = CombatCache(MyBot.MEMO_SIZE, header)
+            if Settings.MEMO_FILE is not None:
+                loaded = self.memo.load(Settings.MEMO_FILE)
+                log.info("Combat memo: %s entries from %s", 
+                         len(self.memo.entries) if loaded else "no", 
+                         Settings.MEMO_FILE)
         
         # calculate rough combat influence after 1 move
         radius = int(sqrt(ants.attackradius2)) + 1 # 1 longer
@@ -168,6 +406,16 @@ class MyBot(object):
         or_stamp(approx_stamp, ants.attack_stamp, (radius+1, radius))
         or_stamp(approx_stamp, ants.attack_stamp, (radius-1, radius))
         self.approx_combat_stamp = approx_stamp
+        # combat windows hold the stamps of their ants' moves
+        self.combat_pad = max(radius, ants.attack_stamp.shape[0] // 2 + 1)
+        # ants further apart can not change each other's combat safety
+        self.combat_link = radius + ants.attack_stamp.shape[0] // 2 + 1
+        self.link_box = [offsets.ravel() for offsets in 
+                         np.indices((2 * self.combat_link + 1,) * 2) - 
+                         self.combat_link]
+        # ant numbers by square, -1 elsewhere (combat_clusters)
+        self.ant_grid = np.empty(ants.rows * ants.cols, dtype=int)
+        self.ant_grid.fill(-1)
         
         self.worst_time_used = 0.0 
         log.debug("%s ms left after bot setup", ants.setup_time_remaining())
@@ -177,26 +425,59 @@ class MyBot(object):
         log.info("= TURN {0} - do_turn - BEGINS =".format(ants.cur_turn))
         
         self.soldiers = set()
-        self.diffuse_attack(ants)
+        self.fights = []
+        if self.predictor is not None:
+            self.observe_enemies(ants)
+        attack = self.diffuse_attack(ants)
         self.normal_ants = ants.my_ants() - self.soldiers
         
-        self.diffuse_food(ants)
-        self.diffuse_explore(ants)
+        food = self.diffuse_food(ants)
+        explore = self.diffuse_explore(ants)
+        
+        # all scents diffuse together
+        dif_begin = time.time()
+        deadline = dif_begin + (ants.time_remaining() - 
+                                MyBot.DIFF_RESERVE) / 1000.0
+        # None for scents not diffused this turn
+        channels = [food, explore, attack]
+        if self.worker is not None:
+            self.use_worker(ants, channels, deadline)
+        fields = iter(self.diffusion.run([field for field in channels 
+                                          if field], deadline))
+        if food:
+            self.u_scent_field = next(fields)
+        if explore:
+            self.e_scent_field = next(fields)
+        if attack:
+            self.a_scent_field = next(fields)
+        dif_time = 1000*(time.time()-dif_begin)
+        log.info("Diffusion: %s ms", dif_time)
+        for name, field in (("Unified", food), ("Explore", explore),
+                            ("Attack", attack)):
+            if field:
+                log.info("%s: %s/%s iterations, residual %s", name, 
+                         field.ran, field.iterations, field.residual)
         
         scent_field = (self.u_scent_field + 
                        5.0 * self.e_scent_field + 
                        self.a_scent_field)
         safety = self.safety_field
+        reservations = ants.reservations
         
         # Movement
+        # - combat search
+        if Settings.SEARCH:
+            self.search_fights(ants, scent_field)
+        
         # - combat logic
         for ant_loc in sorted(self.soldiers):
-            if ant_loc.adj:
-                scent_field[ant_loc] = (sum(scent_field[a] 
-                                           for a in ant_loc.adj) / 
-                                        len(ant_loc.adj))
-                moves = [move for move in ant_loc.adj
-                                  if (move.unoccupied_next)] + [ant_loc]
+            adj = ant_loc.adj
+            if adj:
+                scent_field[ant_loc] = (sum(scent_field[a] for a in adj) / 
+                                        len(adj))
+                moves = [move for move, free in 
+                              zip(adj, reservations.free(adj)) 
+                                  if free] + [ant_loc]
                 moves.sort(reverse=True,
                        key=lambda a: (scent_field[a], a))           
                 neutral_moves = []
@@ -205,8 +486,7 @@ class MyBot(object):
                         if target != ant_loc:
                             direction = ant_loc.direction(target)[0]
                             ants.issue_order((ant_loc, direction))
-                            target.unoccupied_next = False
-                            ant_loc.unoccupied_next = True
+                            reservations.move(ant_loc, target)
                             #log.debug("%r to %r", ant_loc, target)
                         break
                     elif safety[target] == NEUTRAL:
@@ -214,8 +494,7 @@ class MyBot(object):
                             if target != ant_loc:
                                 direction = ant_loc.direction(target)[0]
                                 ants.issue_order((ant_loc, direction))
-                                target.unoccupied_next = False
-                                ant_loc.unoccupied_next = True
+                                reservations.move(ant_loc, target)
                             break
                         else:
                             neutral_moves.append(target)
@@ -225,21 +504,21 @@ class MyBot(object):
                         if target != ant_loc:
                             direction = ant_loc.direction(target)[0]
                             ants.issue_order((ant_loc, direction))
-                            target.unoccupied_next = False
-                            ant_loc.unoccupied_next = True
+                            reservations.move(ant_loc, target)
                         #log.debug("%r to %r", ant_loc, target)                        
                     else:
                         self.normal_ants.add(ant_loc)
         
         # - regular movement
         for ant_loc in sorted(self.normal_ants):
-            for target in sorted(ant_loc.adj, reverse=True,
+            adj = ant_loc.adj
+            free = dict(zip(adj, reservations.free(adj)))
+            for target in sorted(adj, reverse=True,
                                 key=lambda a: (scent_field[a], a)):
-                if target.unoccupied_next:
+                if free[target]:
                     direction = ant_loc.direction(target)[0]
                     ants.issue_order((ant_loc, direction))
-                    target.unoccupied_next = False
-                    ant_loc.unoccupied_next = True
+                    reservations.move(ant_loc, target)
                     #log.debug("%r to %r", ant_loc, target)
                     break
         
@@ -253,7 +532,6 @@ class MyBot(object):
                          "e_scent: {0}".format(5.0*self.e_scent_field[cell]),
                          "a_scent: {0}".format(self.a_scent_field[cell]),
                          "scent: {0}".format(scent_field[cell]),
-                         ##"weakness: {0}".format(self.weakness_field[0][cell]),
                          ##"best_enemy: {0}".format(self.lowest_enemy_weakness[cell]),
                          ##"safety_field: {0}".format(safety[cell]),
                         ]
@@ -280,15 +558,213 @@ class MyBot(object):
                         1000 * (time.time() - ants.turn_start_time) )
         ##log.debug("self.orders (to: from): %s", self.orders)
         log.info("Most used: %s ms", self.worst_time_used)
+        if (Settings.MEMO_FILE is not None and 
+                ants.cur_turn % MyBot.MEMO_SAVE_TURNS == 0 and
+                ants.time_remaining() > MyBot.MEMO_SAVE_RESERVE):
+            self.save_memo()
         ants.log_time("FINAL")
         
+    def observe_enemies(self, ants):
+        'let the predictor learn from the enemy ants seen this turn'
+        by_owner = ants.by_owner
+        enemies = [owner for owner in by_owner.present if owner != ME]
+        coords = np.concatenate([by_owner.coords[owner] 
+                                 for owner in enemies] or [np.empty((0, 2))])
+        cells = coords[:,0] * ants.cols + coords[:,1]
+        owners = np.repeat(enemies, [by_owner.counts[owner] 
+                                     for owner in enemies])
+        self.predictor.observe(cells.astype(int), owners, ants.visible_field)
+        log.info("Predict: %s moves seen; stay, %s: %s", 
+                 self.predictor.matched, ants.neighbours.directions,
+                 ["%s: %s" % (owner, np.round(
+                                 self.predictor.tendencies(owner), 2))
+                  for owner in enemies])
+    
+    def predict_moves(self, ants, cells, owners):
+        'move probabilities of the ants on cells (flat), by the predictor'
+        open_moves = np.column_stack((np.ones(len(cells), dtype=bool),
+                                      ants.neighbours.open[cells]))
+        return self.predictor.predict(cells, owners, open_moves)
+    
+    def save_memo(self):
+        'write the combat memo to its file (-f), if there is one'
+        if self.memo is not None and Settings.MEMO_FILE is not None:
+            self.memo.save(Settings.MEMO_FILE)
+            log.info("Combat memo: %s entries saved", len(self.memo.entries))
+        
+    def use_worker(self, ants, channels, deadline):
+        """
+        Correct this turn's prepared channels with the worker's fields
+        for last turn, hand them to the worker for a full run, and run
+        WORKER_ITERATIONS steps of them here. Each start field was made
+        from last turn's field (decayed, plus new sources); the worker's
+        field is what that one would have been with a full run. If the
+        worker misses the deadline, or its fields are for an older turn,
+        the start fields stay as prepared; before its first result, run
+        in full.
+        """
+        turn = self.worker.pending
+        results = self.worker.collect(deadline)
+        if (self.worker.collected and 
+                (results is None or turn != ants.cur_turn - 1)):
+            # late, or a job from before last turn: nothing to correct
+            results = [None, None, None]
+        if results is not None:
+            previous = [self.u_scent_field, self.e_scent_field, 
+                        self.a_scent_field]
+            gains = [MyBot.U_DECAY, self.e_gain, MyBot.A_DECAY]
+            for field, result, last, gain in zip(channels, results, 
+                                                  previous, gains):
+                if field and result is not None:
+                    field.restart(result, last, gain)
+        # sent with their full iterations
+        self.worker.submit(channels, ants.cur_turn)
+        if results is not None:
+            for field in channels:
+                if field:
+                    field.iterations = MyBot.WORKER_ITERATIONS
+
+    def search_fights(self, ants, scent_field):
+        """
+        Plan each fight in self.fights with combat_search and order its
+        ants; they leave soldiers and normal_ants. My ants start from
+        the move the safety map would make, enemies from their step
+        towards my nearest ant. Fights the search runs out of time on
+        stay with the safety map. With a memo (-m), plans of fights seen
+        before come from there.
+        """
+        rows, cols = ants.dimensions
+        dimensions = np.array(ants.dimensions)
+        neighbours = ants.neighbours
+        world = ants.world_list
+        reservations = ants.reservations
+        memo = self.memo
+        for centres, owners in self.fights:
+            if len(owners) > MyBot.SEARCH_MAX_ANTS:
+                log.info("Search: %s ants, left to the safety map", 
+                         len(owners))
+                continue
+            remaining = ants.time_remaining() - MyBot.SEARCH_RESERVE
+            if remaining <= 0:
+                break
+            search_begin = time.time()
+            deadline = search_begin + min(MyBot.SEARCH_BUDGET, 
+                                          remaining) / 1000.0
+            
+            # destinations: stay, then each direction; -1 where blocked
+            mine = owners == ME
+            cells = centres[:,0] * cols + centres[:,1]
+            targets = np.column_stack((cells, neighbours.table[cells]))
+            valid = np.column_stack((np.ones(len(cells), dtype=bool), 
+                                     neighbours.open[cells]))
+            food = np.array([[world[cell] in ants.food_set 
+                              for cell in row] for row in targets.tolist()])
+            # my ants also keep off squares reserved outside the fight
+            free = (reservations.free(targets.ravel()).reshape(targets.shape)
+                    | np.in1d(targets, cells[mine]).reshape(targets.shape))
+            valid &= ~food & (free | ~mine[:,np.newaxis])
+            valid[:,0] = True
+            moves = np.dstack((targets // cols, targets % cols))
+            moves[~valid] = -1
+            
+            # my ants start as the safety map would move them: the best
+            # scent among SAFE moves (or NEUTRAL ones near my hill), and
+            # only leave that for a better worst case
+            scents = scent_field.ravel()[targets]
+            scents[:,0] = scents[:,1:].mean(axis=1)
+            safety = self.safety_field.ravel()[targets]
+            near_hill = ants.cells.hilldist.ravel()[targets] <= 8
+            rank = np.where((safety == SAFE) | 
+                            ((safety == NEUTRAL) & near_hill), 2,
+                            (safety == NEUTRAL).astype(int))
+            scents = np.where(valid, scents, -np.inf)
+            best = np.where(valid, rank, -1).max(axis=1)
+            scents[rank < best[:,np.newaxis]] = -np.inf
+            d_r = np.abs(moves[:,:,0,np.newaxis] - centres[mine,0])
+            d_c = np.abs(moves[:,:,1,np.newaxis] - centres[mine,1])
+            d_r = np.minimum(d_r, rows - d_r)
+            d_c = np.minimum(d_c, cols - d_c)
+            closest = (d_r * d_r + d_c * d_c).min(axis=2)
+            preferred = np.where(mine,
+                        scents.argmax(axis=1),
+                        np.where(valid, closest, INF).argmin(axis=1))
+            # no two of my ants onto one square: in turn, each takes its
+            # best move to a square not taken yet
+            taken = set()
+            for ant in np.flatnonzero(mine).tolist():
+                for move in np.argsort(-scents[ant], kind='mergesort'):
+                    if (np.isfinite(scents[ant, move]) and 
+                        targets[ant, move] not in taken):
+                        preferred[ant] = move
+                        break
+                taken.add(targets[ant, preferred[ant]])
+            
+            plan = key = None
+            if memo is not None:
+                # positions from the fight's corner; distances in the
+                # search wrap, so only fights well within half the map
+                half = dimensions // 2
+                offsets = (centres - centres[0] + half) % dimensions - half
+                local = offsets - offsets.min(axis=0)
+                shape = local.max(axis=0) + 1
+                if (2 * (shape + 2) <= dimensions).all():
+                    choices = valid + 2 * (np.arange(valid.shape[1]) == 
+                                           preferred[:,np.newaxis])
+                    key, symmetry, order = memo.key(shape, local, owners,
+                                                    choices, 'plan')
+                    found = memo.get(key)
+                    if found is not None:
+                        plan = np.empty_like(found)
+                        plan[order] = memo.moves_from_canonical(found, 
+                                                                symmetry)
+                        log.info("Search: %s ants, plan from the memo", 
+                                 len(owners))
+            if plan is None:
+                plan = self.combat_search.plan(moves, owners, mine, 
+                                               preferred, deadline)
+                search_time = 1000*(time.time()-search_begin)
+                if plan is None:
+                    log.info("Search: %s ants, out of time (%s ms), "
+                             "left to the safety map", len(owners), 
+                             search_time)
+                    continue
+                log.info("Search: %s ants, %s joint moves, %s replies, "
+                         "%s ms", len(owners), self.combat_search.evaluated,
+                         self.combat_search.replies, search_time)
+                if key is not None:
+                    memo.put(key, memo.moves_to_canonical(plan[order], 
+                                                          symmetry))
+            
+            # ants whose target is still taken wait for it to be vacated;
+            # any left over stay
+            orders = [(world[cell], world[target[move]]) for cell, target, 
+                      move in zip(cells[mine], targets[mine], plan[mine])
+                      if move]
+            while orders:
+                waiting = []
+                for ant_loc, target in orders:
+                    if reservations.free([target])[0]:
+                        direction = ant_loc.direction(target)[0]
+                        ants.issue_order((ant_loc, direction))
+                        reservations.move(ant_loc, target)
+                    else:
+                        waiting.append((ant_loc, target))
+                if len(waiting) == len(orders):
+                    break
+                orders = waiting
+            planned = set(world[cell] for cell in cells[mine].tolist())
+            self.soldiers -= planned
+            self.normal_ants -= planned
+        if memo is not None:
+            log.info("Combat memo: %s hits, %s misses (%.1f%%), %s entries",
+                     memo.hits, memo.misses, 
+                     100.0 * memo.hits / max(memo.hits + memo.misses, 1),
+                     len(memo.entries))
+
     def diffuse_food(self, ants):
         # setting up diffusion
         dif_setup_begin = time.time()
         
-        scent_field = MyBot.U_DECAY * self.u_scent_field
-        diff_factor = MyBot.DIFF_FACTOR
-        
         # clamped source setup
         clamps = []
         clamp_field = np.empty(ants.dimensions)
@@ -302,112 +778,125 @@ class MyBot(object):
             #clamp_field[hill_loc] = 100.0
         #clamps.extend(ants.enemy_hills())
         clamp_index = zip(*clamps)
+        
+        if "food" in Settings.DISTANCE:
+            distance = self.u_distance
+            distance.set_unblocked(ants.passable_field, ants.passable_version)
+            self.u_scent_field = distance.scent(zip(*ants.food_set), 50.0,
+                                                MyBot.U_DISTANCE_DECAY,
+                                                MyBot.U_DISTANCE_CUTOFF,
+                                                Settings.SCENT_DTYPE)
+            log.info("Unified: distance, %s waves, %s ms", distance.waves,
+                     1000*(time.time()-dif_setup_begin))
+            return None
                 
-        # unblocked and diff fields
-        unblocked_field = ants.passable_field # WATER blocks diffusion
-        scent_field[~unblocked_field] = 0.0 # reset scent of water (unnecessary)
-        
-        unblocked_n = (np.roll(unblocked_field, 1, axis=0) & 
-                       unblocked_field)
-        unblocked_s = (np.roll(unblocked_field,-1, axis=0) &
-                       unblocked_field)
-        unblocked_w = (np.roll(unblocked_field, 1, axis=1) &
-                       unblocked_field)
-        unblocked_e = (np.roll(unblocked_field,-1, axis=1) &
-                       unblocked_field)
-        adj_field = (unblocked_n.astype(np.int8) + unblocked_s + 
-                       unblocked_w + unblocked_e)
-        diff_loss = 1 - (diff_factor * adj_field)
-        diff_n = diff_factor * unblocked_n
-        diff_s = diff_factor * unblocked_s
-        diff_w = diff_factor * unblocked_w
-        diff_e = diff_factor * unblocked_e
+        # WATER blocks diffusion
+        diffusion = self.u_diffusion
+        diffusion.set_unblocked(ants.passable_field, ants.passable_version)
 
         dif_setup_time = 1000*(time.time()-dif_setup_begin)
         log.info("Diff setup: %s ms", dif_setup_time)
         
-        dif_begin = time.time()
-        for diffusion in xrange(MyBot.U_ITERATIONS):
-            # source blocks
-            scent_field[clamp_index] = clamp_field[clamp_index]
-            # build new scents
-            n = np.concatenate((scent_field[-1:], scent_field[:-1]), axis=0)
-            s = np.concatenate((scent_field[1:], scent_field[:1]), axis=0)
-            w = np.concatenate((scent_field[:,-1:], scent_field[:,:-1]), axis=1)
-            e = np.concatenate((scent_field[:,1:], scent_field[:,:1]), axis=1)
-            scent_field = (diff_loss * scent_field
-                + (diff_n * n)
-                + (diff_s * s)
-                + (diff_w * w)
-                + (diff_e * e))
-        self.u_scent_field = scent_field # store scent field
-        dif_time = 1000*(time.time()-dif_begin)
-        log.info("Unified: %s diff iterations: %s ms", MyBot.U_ITERATIONS, dif_time)
+        scent_field = MyBot.U_DECAY * self.u_scent_field
+        clamp_values = clamp_field[clamp_index]
+        worker_fields = self.worker is not None and self.worker.collected
+        if (ants.rows * ants.cols >= MyBot.CASCADE_CELLS and 
+                not worker_fields):
+            scent_field = diffusion.cascade(scent_field, 
+                                            (clamp_index, clamp_values),
+                                            MyBot.CASCADE_ITERATIONS)
+        diffusion.prepare(scent_field,
+                          clamps=(clamp_index, clamp_values),
+                          iterations=MyBot.U_ITERATIONS,
+                          tolerance=MyBot.DIFF_TOLERANCE)
+        return diffusion
         
     def diffuse_explore(self, ants):
         # setting up variables
         dif_setup_begin = time.time()
         
-        diff_factor = MyBot.E_FACTOR
         invisible = ~ants.visible_field
         unexplored = ~ants.explored_field
         # clamped source setup
         clamp_index = unexplored.copy()
         for e_ant in ants.enemy_ants():
             clamp_index[e_ant] = True
-        clamp_field = 3.0 * clamp_index
         clamp_useless = (np.roll(clamp_index, 1, axis=0) &
                          np.roll(clamp_index,-1, axis=0) &
                          np.roll(clamp_index, 1, axis=1) &
                          np.roll(clamp_index,-1, axis=1))
         clamp_index = clamp_index - clamp_useless
         
-        # re-initialize scent field with 1.0 at invisible squares
-        scent_field = invisible.astype(np.float64) 
+        if "explore" in Settings.DISTANCE:
+            distance = self.e_distance
+            distance.set_unblocked(ants.passable_field & (~ ants.ant_field))
+            self.e_scent_field = distance.scent(clamp_index, 3.0,
+                                                MyBot.E_DISTANCE_DECAY,
+                                                dtype=Settings.SCENT_DTYPE)
+            log.info("Explore: distance, %s waves, %s ms", distance.waves,
+                     1000*(time.time()-dif_setup_begin))
+            return None
         
-        # preset unblocked and diff fields
         # WATER or ant : do not receive diffusion
-        unblocked_field = ants.passable_field & (~ ants.ant_field)
-        scent_field[~unblocked_field] = 0.0 # reset ant/water scent
-        
-        unblocked_n = (np.roll(unblocked_field, 1, axis=0) & 
-                       unblocked_field)
-        unblocked_s = (np.roll(unblocked_field,-1, axis=0) &
-                       unblocked_field)
-        unblocked_w = (np.roll(unblocked_field, 1, axis=1) &
-                       unblocked_field)
-        unblocked_e = (np.roll(unblocked_field,-1, axis=1) &
-                       unblocked_field)
-        adj_field = (unblocked_n.astype(np.int8) + unblocked_s + 
-                       unblocked_w + unblocked_e)
-        diff_loss = 1 - (diff_factor * adj_field)
-        diff_n = diff_factor * unblocked_n
-        diff_s = diff_factor * unblocked_s
-        diff_w = diff_factor * unblocked_w
-        diff_e = diff_factor * unblocked_e
+        diffusion = self.e_diffusion
+        unblocked = ants.passable_field & (~ ants.ant_field)
+        tiled = (self.e_visible is not None and 
+                 ants.rows * ants.cols >= MyBot.E_TILED_CELLS)
+        if tiled:
+            # unexplored squares behind the frontier clamps can not
+            # reach the rest; blocked, they hold no scent and rest
+            unblocked &= ~(unexplored & clamp_useless)
+        diffusion.set_unblocked(unblocked)
         
         dif_setup_time = 1000*(time.time()-dif_setup_begin)
         log.info("Diff setup: %s ms", dif_setup_time)
         
-        dif_begin = time.time()
         log.debug(len(clamp_index.nonzero()[0]))
-        for diffusion in xrange(MyBot.E_ITERATIONS):
-            # source blocks
-            scent_field[clamp_index] = 3.0 # should get from clamp_field
-            # build new scents
-            n = np.concatenate((scent_field[-1:], scent_field[:-1]), axis=0)
-            s = np.concatenate((scent_field[1:], scent_field[:1]), axis=0)
-            w = np.concatenate((scent_field[:,-1:], scent_field[:,:-1]), axis=1)
-            e = np.concatenate((scent_field[:,1:], scent_field[:,:1]), axis=1)
-            scent_field = (
-                (diff_loss * scent_field)
-                + (diff_n * n)
-                + (diff_s * s)
-                + (diff_w * w)
-                + (diff_e * e))
-        self.e_scent_field = scent_field # store scent field
-        dif_time = 1000*(time.time()-dif_begin)
-        log.info("Explore: %s diff iterations: %s ms", MyBot.E_ITERATIONS, dif_time)
+        visible = ants.visible_field
+        if self.e_visible is None:
+            # initialize scent field with 1.0 at invisible squares
+            scent_field = invisible.astype(np.float64)
+            if ants.rows * ants.cols >= MyBot.CASCADE_CELLS:
+                scent_field = diffusion.cascade(scent_field, 
+                                                (clamp_index, 3.0),
+                                                MyBot.CASCADE_ITERATIONS)
+            iterations = MyBot.E_ITERATIONS
+            self.e_gain = 0.0
+        else:
+            # continue from last turn: only squares whose visibility
+            # matters change before the run
+            scent_field = self.e_scent_field.copy()
+            scent_field[visible] *= MyBot.E_VISIBLE_DECAY
+            hidden = invisible & self.e_visible
+            scent_field[hidden] = np.maximum(scent_field[hidden], 1.0)
+            iterations = MyBot.E_WARM_ITERATIONS
+            if self.worker is not None:
+                # how the start field follows last turn's (use_worker);
+                # hidden squares keep their restart
+                self.e_gain = np.where(visible, MyBot.E_VISIBLE_DECAY, 1.0)
+                self.e_gain[hidden] = 0.0
+        self.e_visible = visible.copy()
+        if tiled:
+            dif_begin = time.time()
+            deadline = dif_begin + (ants.time_remaining() - 
+                                    MyBot.DIFF_RESERVE) / 1000.0
+            self.e_scent_field = diffusion.update(scent_field, 
+                                                  visible | hidden,
+                                                  (clamp_index, 3.0),
+                                                  iterations,
+                                                  MyBot.DIFF_TOLERANCE,
+                                                  deadline)
+            log.info("Explore: tiled, %s/%s iterations, %s of %s tiles "
+                     "per step, residual %s, %s ms", diffusion.ran, 
+                     iterations, diffusion.stepped / max(diffusion.ran, 1),
+                     diffusion.tiles.count, diffusion.residual,
+                     1000*(time.time()-dif_begin))
+            return None
+        diffusion.prepare(scent_field,
+                          clamps=(clamp_index, 3.0),
+                          iterations=iterations,
+                          tolerance=MyBot.DIFF_TOLERANCE)
+        return diffusion
 
     def diffuse_attack(self, ants):
         dif_setup_begin = time.time()
@@ -445,24 +934,9 @@ class MyBot(object):
         coop_factor = MyBot.COOP_FACTOR
         coop_index = zip(*ants.my_ants())
                 
-        # unblocked and diff fields
-        diff_factor = MyBot.A_FACTOR
-        unblocked_field = ants.passable_field # WATER blocks diffusion
-        unblocked_n = (np.roll(unblocked_field, 1, axis=0) & 
-                       unblocked_field)
-        unblocked_s = (np.roll(unblocked_field,-1, axis=0) &
-                       unblocked_field)
-        unblocked_w = (np.roll(unblocked_field, 1, axis=1) &
-                       unblocked_field)
-        unblocked_e = (np.roll(unblocked_field,-1, axis=1) &
-                       unblocked_field)
-        adj_field = (unblocked_n.astype(np.int8) + unblocked_s + 
-                       unblocked_w + unblocked_e)
-        diff_loss = 1 - (diff_factor * adj_field)
-        diff_n = diff_factor * unblocked_n
-        diff_s = diff_factor * unblocked_s
-        diff_w = diff_factor * unblocked_w
-        diff_e = diff_factor * unblocked_e
+        # WATER blocks diffusion
+        diffusion = self.a_diffusion
+        diffusion.set_unblocked(ants.passable_field, ants.passable_version)
 
         # clamped source setup
         clamps = []
@@ -474,95 +948,313 @@ class MyBot(object):
 
         # scent field initialize
         scent_field = MyBot.A_DECAY * self.a_scent_field
-        scent_field[~unblocked_field] = 0.0 # reset scent of water (unnecessary)
         if my_hills:
+            far = []
             for ant in enemies:
                 # affected by distance from my_hills
                 if ant.hilldist < INF:
                     clamp_field[ant] = threat_value[ant.hilldist]
                     clamps.append(ant)
-                else:
+                elif self.predictor is None:
                     scent_field[ant] += threat_value[ant.hilldist]
+                else:
+                    far.append(ant)
+            if far:
+                # shared out over where they are likely to be next turn
+                cells = np.array([ant.index for ant in far])
+                probabilities = self.predict_moves(ants, cells, 
+                                    [ant.contents for ant in far])
+                self.predictor.occupancy(cells, probabilities, scent_field,
+                                         threat_value[INF])
         clamp_index = zip(*clamps)
 
         dif_setup_time = 1000*(time.time()-dif_setup_begin)
         log.info("Diff setup: %s ms", dif_setup_time)
         
-        # iteration
-        dif_begin = time.time()
-        for diffusion in xrange(MyBot.A_ITERATIONS):
-            # source blocks
-            scent_field[clamp_index] = clamp_field[clamp_index]
-            # build new scents
-            n = np.concatenate((scent_field[-1:], scent_field[:-1]), axis=0)
-            s = np.concatenate((scent_field[1:], scent_field[:1]), axis=0)
-            w = np.concatenate((scent_field[:,-1:], scent_field[:,:-1]), axis=1)
-            e = np.concatenate((scent_field[:,1:], scent_field[:,:1]), axis=1)
-            scent_field = (diff_loss * scent_field
-                + (diff_n * n)
-                + (diff_s * s)
-                + (diff_w * w)
-                + (diff_e * e))
-            # scaling
-            scent_field[coop_index] *= coop_factor
-        dif_time = 1000*(time.time()-dif_begin)
-        log.info("Attack: %s diff iterations: %s ms", MyBot.A_ITERATIONS, dif_time)
-        
-        # store scent field
-        self.a_scent_field = scent_field
+        diffusion.prepare(scent_field,
+                          clamps=(clamp_index, clamp_field[clamp_index]),
+                          iterations=MyBot.A_ITERATIONS,
+                          scaling=(coop_index, coop_factor),
+                          tolerance=MyBot.DIFF_TOLERANCE)
+        return diffusion
 
     def hilldist_calc(self, ants, limit=10):
-        cur_dist = 0
         my_hills = ants.my_hills()
-        # hill_num = len(my_hills)
-        queue = list(my_hills)
-        complete = set()
-        for cell in ants.world_list:
-            cell.hilldist = INF
-        while queue and cur_dist <= limit:
-            new_queue = []
-            while queue:
-                cell = queue.pop()
-                if cell not in complete:
-                    cell.hilldist = cur_dist
-                    new_queue.extend(cell.adj)
-                    complete.add(cell)
-            queue = new_queue
-            cur_dist += 1
+        # breadth-first over flat indices, one NumPy step per distance
+        hilldist = ants.cells.hilldist.ravel() # view
+        ants.neighbours.spread(hilldist, np.array(
+            [hill.index for hill in my_hills], dtype=np.int32), limit)
         
     def gen_combat_safety(self, ants):
-        player_ants = []
-        positions = []
-        for owner in xrange(10):
-            player_ants.append([a for a in ants.ant_set if a.contents == owner])
+        """
+        Fills lowest_enemy_weakness and safety_field and sets soldiers,
+        as gen_combat_safety_loops does, in one window_safety over the
+        ants of every player present. With a predictor (-e), enemies
+        only make their likely moves. With a search (-s), the fights
+        with my ants in them (combat_clusters) go to self.fights.
+        """
+        by_owner = ants.by_owner
+        owners = sorted(set(by_owner.present) | set([ME]))
+        self.lowest_enemy_weakness.fill(self.no_enemy)
+        self.safety_field.fill(SAFE)
+        self.soldiers = set()
+        if len(owners) < 2:
+            return
+        
+        centres = np.concatenate([by_owner.coords[owner] 
+                                  for owner in owners])
+        ant_owners = np.repeat(owners, [by_owner.counts[owner] 
+                                        for owner in owners])
+        likely = None
+        if self.predictor is not None:
+            # my ants may make any move (see window_combat)
+            cells = centres[:,0] * ants.cols + centres[:,1]
+            likely = ((self.predict_moves(ants, cells, ant_owners) >= 
+                       MyBot.PREDICT_LIKELY) | 
+                      (ant_owners == ME)[:,np.newaxis])
+        self.window_safety(ants, centres, ant_owners, likely)
+        if not Settings.SEARCH:
+            return
+        for cluster in self.combat_clusters(ants, centres, ant_owners):
+            cluster_owners = set(ant_owners[cluster].tolist())
+            if ME in cluster_owners and len(cluster_owners) > 1:
+                self.fights.append((centres[cluster], ant_owners[cluster]))
+    
+    def combat_clusters(self, ants, centres, ant_owners):
+        """
+        Group the ants ((n, 2) array of (row, col), and their owners)
+        that matter to combat safety into fights that can not affect
+        each other. An ant matters if an ant of another player is within
+        combat_link (Chebyshev, wrapped), or, for an enemy, if such an
+        enemy ant is. Ants within combat_link are in one fight, chained;
+        two of my ants do not link. Returns a list of arrays of indices
+        into centres.
+        """
+        link = self.combat_link
+        dimensions = np.array(ants.dimensions)
+        # buckets at least link wide: ants within link of each other are
+        # in the same or neighbouring buckets
+        buckets = np.maximum(dimensions // link, 1)
+        bucket = np.minimum(centres // link, buckets - 1)
+        size = buckets.prod()
+        keys = bucket[:,0] * buckets[1] + bucket[:,1]
+        total = np.bincount(keys, minlength=size)
+        own = np.bincount(ant_owners * size + keys, minlength=10 * size)
+        # the 5x5 buckets around each ant's; wrapped buckets may repeat
+        shifts = np.arange(-2, 3)
+        near_rows = (bucket[:,0,np.newaxis] + shifts) % buckets[0]
+        near_cols = (bucket[:,1,np.newaxis] + shifts) % buckets[1]
+        near = (near_rows[:,:,np.newaxis] * buckets[1] + 
+                near_cols[:,np.newaxis,:])
+        others = (total[near] - 
+                  own[ant_owners[:,np.newaxis,np.newaxis] * size + near])
+        mine = ant_owners == ME
+        # an enemy may matter through an enemy ant within link
+        candidate = np.where(mine, others[:,1:4,1:4].any(axis=(1, 2)),
+                             others.any(axis=(1, 2)))
+        
+        index = np.flatnonzero(candidate)
+        centres = centres[index]
+        owners = ant_owners[index]
+        mine = mine[index]
+        # pairs of ants within link (both ways, and each with itself),
+        # from a map of ant numbers read around every ant
+        rows, cols = ants.dimensions
+        cells = centres[:,0] * cols + centres[:,1]
+        grid = self.ant_grid
+        grid[cells] = np.arange(len(cells))
+        box_r, box_c = self.link_box
+        near = grid[((centres[:,0,np.newaxis] + box_r) % rows) * cols + 
+                    (centres[:,1,np.newaxis] + box_c) % cols]
+        grid[cells] = -1
+        first, second = np.nonzero(near >= 0)
+        second = near[first, second]
+        
+        contact = np.zeros(len(cells), dtype=bool)
+        contact[first[owners[first] != owners[second]]] = True
+        fighting_enemy = contact & ~mine
+        matters = contact.copy()
+        matters[first[~mine[first] & fighting_enemy[second]]] = True
+        linked = (matters[first] & matters[second] & 
+                  ~(mine[first] & mine[second]))
+        first, second = first[linked], second[linked]
+        
+        # fights: the connected groups of linked ants (union-find)
+        group = range(len(cells))
+        def find(ant):
+            while group[ant] != ant:
+                group[ant] = group[group[ant]]
+                ant = group[ant]
+            return ant
+        for one, other in zip(first.tolist(), second.tolist()):
+            group[find(one)] = find(other)
+        members = {}
+        for ant in np.flatnonzero(matters).tolist():
+            members.setdefault(find(ant), []).append(ant)
+        # in order of their first ant
+        clusters = [index[ants] for ants in sorted(members.values())]
+        return clusters
+    
+    def window_safety(self, ants, centres, ant_owners, likely=None):
+        """
+        Combat safety of the ants on centres, in a window of the map 
+        just holding their stamps (the whole map once they spread),
+        with one attack layer per player among them. Lowers
+        lowest_enemy_weakness, marks safety_field and adds soldiers
+        (window_combat works out the rest). likely,
+        if given, are the moves (stay, then each direction) each ant
+        is expected to make; else any move.
+        """
+        rows, cols = ants.dimensions
+        dimensions = np.array(ants.dimensions)
+        # positions relative to the first ant, unwrapped
+        half = dimensions // 2
+        offsets = (centres - centres[0] + half) % dimensions - half
+        low = offsets.min(axis=0) - self.combat_pad
+        shape = np.minimum(offsets.max(axis=0) + self.combat_pad - low + 1,
+                           dimensions)
+        origin = (centres[0] + low) % dimensions
+        # a window as large as the map wraps like the map
+        local = (centres - origin) % dimensions
+        height, width = shape
+        
+        ant_cells, moves, open_moves = self.fight_moves(ants, centres)
+        local_moves = (((moves // cols - origin[0]) % rows) * width +
+                       (moves % cols - origin[1]) % cols)
+        if likely is not None:
+            open_moves = open_moves & likely
+        best_enemy, marks, fighting = self.window_combat(ants, shape, 
+                local, ant_owners, local_moves, open_moves, likely)
+        
+        world = ants.world_list
+        self.soldiers.update(world[cell] for cell in 
+                             ant_cells[fighting].tolist())
+        window = np.ix_((origin[0] + np.arange(height)) % rows,
+                        (origin[1] + np.arange(width)) % cols)
+        lowest = self.lowest_enemy_weakness
+        lowest[window] = np.minimum(lowest[window], best_enemy)
+        safety = self.safety_field[window]
+        marked = marks != SAFE
+        safety[marked] = marks[marked]
+        self.safety_field[window] = safety
+    
+    def fight_moves(self, ants, centres):
+        """
+        The flat cells of the ants on centres, their moves (n, 5) as 
+        flat cells (stay, then each neighbour) and which moves are open.
+        """
+        cols = ants.cols
+        ant_cells = centres[:,0] * cols + centres[:,1]
+        neighbours = ants.neighbours
+        moves = np.column_stack((ant_cells, neighbours.table[ant_cells]))
+        passable = ants.passable_field.ravel()[ant_cells]
+        open_moves = np.column_stack((passable, 
+                        neighbours.open[ant_cells] & passable[:,np.newaxis]))
+        return ant_cells, moves, open_moves
+    
+    def window_combat(self, ants, shape, local, ant_owners, local_moves,
+                      open_moves, likely=None):
+        """
+        The results of one fight in its window (see window_safety): the
+        lowest enemy weakness and the safety marks there (SAFE where
+        unmarked), and which ants are my soldiers.
+        """
+        height, width = shape
+        size = height * width
+        players, layer_of = np.unique(ant_owners, return_inverse=True)
+        
+        if likely is None:
+            # every ant's combat stamp, as flat cells of its owner's layer
+            stamp = mask_offsets(self.approx_combat_stamp)
+            stamp_rows, stamp_cols = stamp_cells(shape, stamp, local)
+            stamped = stamp_rows * width + stamp_cols
+            layers = np.repeat(layer_of, len(stamp[0]))
+        else:
+            # the attack stamps of every ant's likely moves, each cell
+            # once per ant; all five moves of my ants are likely, and
+            # their attack stamps together are approx_combat_stamp, so
+            # my ants stamp as they do without a predictor
+            stamp = mask_offsets(ants.attack_stamp)
+            ant, move = np.nonzero(likely)
+            destinations = local_moves[ant, move]
+            stamp_rows, stamp_cols = stamp_cells(shape, stamp, 
+                    np.column_stack((destinations // width, 
+                                     destinations % width)))
+            keys = np.unique(np.repeat(ant, len(stamp[0])) * size + 
+                             stamp_rows * width + stamp_cols)
+            stamped = keys % size
+            layers = layer_of[keys // size]
+        attack = np.bincount(layers * size + stamped, 
+                             minlength=len(players) * size)
+        total = np.bincount(stamped, minlength=size)
+        weakness = total - attack.reshape(len(players), size)
+        
+        # moves where enemies can attack
+        move_layers = np.repeat(layer_of[:,np.newaxis], 
+                                local_moves.shape[1], axis=1)
+        hot = open_moves & (weakness[move_layers, local_moves] > 0)
+        
+        mine = ant_owners == ME
+        fighting = mine & hot.any(axis=1)
+        
+        # each enemy's candidate squares once, at its weakness there
+        enemy_hot = hot & ~mine[:,np.newaxis]
+        keys = np.unique(move_layers[enemy_hot] * size + 
+                         local_moves[enemy_hot])
+        enemy_cells = keys % size
+        best_enemy = np.empty(shape, dtype=Settings.COUNT_DTYPE)
+        best_enemy.fill(self.no_enemy)
+        min_stamp_many(best_enemy, ants.attack_stamp, 
+                       np.column_stack((enemy_cells // width, 
+                                        enemy_cells % width)),
+                       weakness.ravel()[keys])
+        if ME in players:
+            my_weakness = weakness[players.tolist().index(ME)]
+        else:
+            my_weakness = total
+        my_weakness = my_weakness.reshape(shape)
+        
+        marks = np.empty(shape, dtype=np.int8)
+        marks.fill(SAFE)
+        marks[my_weakness > best_enemy] = DIE
+        marks[my_weakness == best_enemy] = NEUTRAL
+        return best_enemy, marks, fighting
+        
+    def gen_combat_safety_loops(self, ants):
+        'reference version of gen_combat_safety, one player at a time'
+        player_ants = ants.by_owner.ants
+        present = ants.by_owner.present
+        positions = [set() for owner in xrange(10)]
         
         attack_stamp = ants.attack_stamp
         combat_stamp = self.approx_combat_stamp
-        attack_field = self.attack_field
-        weakness_field = self.weakness_field
+        player_dimensions = (10, ants.rows, ants.cols)
+        attack_field = np.zeros(player_dimensions, Settings.COUNT_DTYPE)
+        weakness_field = np.zeros(player_dimensions, Settings.COUNT_DTYPE)
         best_enemy = self.lowest_enemy_weakness
         safety_field = self.safety_field
-        attack_field.fill(0)
-        weakness_field.fill(0)
-        best_enemy.fill(INF)
+        best_enemy.fill(self.no_enemy)
         safety_field.fill(SAFE)
         
-        for owner in xrange(10):
-            player_attack = attack_field[owner]
-            for ant in player_ants[owner]:
-                increment_stamp(player_attack, combat_stamp, ant)
-        for owner in xrange(10):
+        # absent players have empty attack layers; skip them
+        for owner in present:
+            increment_stamp_many(attack_field[owner], combat_stamp, 
+                                 ants.by_owner.coords[owner])
+        for owner in set(present) | set([ME]):
             weakness_field[owner] = sum(attack_field[p] 
-                                    for p in xrange(10) if p != owner)
+                                    for p in present if p != owner)
             arena = set(loc for a in player_ants[owner]
                                 for loc in a.moves
                                     if weakness_field[owner][loc] > 0)
-            positions.append(arena)
-        for enemy in xrange(1,10):
-            for enemy_position in positions[enemy]:
-                min_stamp(best_enemy, 
-                          (attack_stamp, weakness_field[enemy][enemy_position]),
-                          enemy_position)
+            positions[owner] = arena
+        for enemy in present:
+            if enemy == ME:
+                continue
+            enemy_positions = np.array(list(positions[enemy]), 
+                                       dtype=int).reshape(-1, 2)
+            min_stamp_many(best_enemy, attack_stamp, enemy_positions,
+                           weakness_field[enemy][enemy_positions[:,0],
+                                                 enemy_positions[:,1]])
         my_weakness = weakness_field[ME]
         safety_field[my_weakness > best_enemy] = DIE
         safety_field[my_weakness == best_enemy] = NEUTRAL
@@ -580,10 +1272,15 @@ if __name__ == '__main__':
     
     init_options()
     
+    bot = MyBot()
     try:
         # if run is passed a class with a do_turn method, it will do the work
         # this is not needed, in which case you will need to write your own
         # parsing function and your own game state class
-        Ants.run(MyBot())
+        Ants.run(bot)
     except KeyboardInterrupt:
         print('ctrl-c, leaving ...')
+    # the game is over; bots may be killed soon after
+    bot.save_memo()
+    if bot.worker is not None:
+        bot.worker.close()
@@ -2,6 +2,14 @@
 
 """
 ExploreBot
+v3.5
+- -p/--precision: "single" keeps scents in float32 (as CombatBot)
+v3.4
+- exploration scent persists between turns: E_WARM_ITERATIONS steps
+  from last turn's field, in which visible squares fade
+  (E_VISIBLE_DECAY) and squares just out of sight restart at 1.0
+v3.3
+- diffusion through proj.diffusion.DiffusionField
 v3.2
 - use passable/ant fields from numAnts v2.3
 v3, v3.1 (002)
@@ -44,11 +52,13 @@ import copy
 import numpy as np
 
 from proj.numAnts import Ants
+from proj.diffusion import DiffusionField
 from proj.constants import LAND, WATER, UNKNOWN, ME, FOOD, INF
 
 class Settings:
     VISUALIZE = False
     LOGGING = False
+    SCENT_DTYPE = np.float64
 log = logging.getLogger(__name__)
 
 def init_options():
@@ -60,11 +70,18 @@ def init_options():
     parser.add_option("-v", "--visual", action="store_true", 
                       dest="visualize", default=False, 
                       help="Turns on custom visualization.")
+    parser.add_option("-p", "--precision", dest="precision",
+        type="choice", choices=("double", "single"), default="double",
+        help="single: float32 scent fields.")
                      
     (options, args) = parser.parse_args()
     
     # setup visualizer
     Settings.VISUALIZE = options.visualize
+    
+    # setup field types
+    if options.precision == "single":
+        Settings.SCENT_DTYPE = np.float32
 
     # setup logging
     level = {"DEBUG": logging.DEBUG,
@@ -92,7 +109,9 @@ class MyBot(object):
         MyBot.DIFF_FACTOR = 0.2
         MyBot.U_ITERATIONS = 150
         MyBot.E_FACTOR = 0.15
-        MyBot.E_ITERATIONS = 150
+        MyBot.E_ITERATIONS = 150 # first turn
+        MyBot.E_WARM_ITERATIONS = 50
+        MyBot.E_VISIBLE_DECAY = 0.5
     
     # do_setup is run once at the start of the game
     # after the bot has received the game settings
@@ -100,8 +119,14 @@ class MyBot(object):
         self.ants = ants
         ##self.world = set(c for r in ants.loc for c in r)
         
-        self.u_scent_field = np.zeros(ants.dimensions) # unified
-        self.e_scent_field = np.zeros(ants.dimensions) # exploration
+        scent_dtype = Settings.SCENT_DTYPE
+        self.u_scent_field = np.zeros(ants.dimensions, scent_dtype) # unified
+        self.e_scent_field = np.zeros(ants.dimensions, scent_dtype) # explore
+        self.e_visible = None # visible squares at the last explore run
+        self.u_diffusion = DiffusionField(ants.dimensions, MyBot.DIFF_FACTOR,
+                                          scent_dtype)
+        self.e_diffusion = DiffusionField(ants.dimensions, MyBot.E_FACTOR,
+                                          scent_dtype)
         for r in xrange(ants.rows):
             for c in xrange(ants.cols):
                 cell = ants.loc[r][c]
@@ -161,11 +186,9 @@ class MyBot(object):
         # setting up diffusion
         dif_setup_begin = time.time()
         
-        scent_field = 0.95*self.u_scent_field
-        
         # clamped source setup
         clamps = []
-        clamp_field = np.empty(ants.dimensions)
+        clamp_field = np.empty(ants.dimensions, Settings.SCENT_DTYPE)
         for ant in ants.ant_set:
             clamp_field[ant] = -1.0
         clamps.extend(ants.ant_set)
@@ -177,40 +200,18 @@ class MyBot(object):
         clamps.extend(ants.enemy_hills())
         clamp_index = zip(*clamps)
                 
-        # unblocked and diff fields
-        unblocked_field = ants.passable_field # WATER blocks diffusion
-        scent_field[~unblocked_field] = 0.0 # reset scent of water (unnecessary)
-        
-        unblocked_n = np.roll(unblocked_field, 1, axis=0)
-        unblocked_s = np.roll(unblocked_field,-1, axis=0)
-        unblocked_w = np.roll(unblocked_field, 1, axis=1)
-        unblocked_e = np.roll(unblocked_field,-1, axis=1)
-        adj_field = (unblocked_n.astype(np.int8) + unblocked_s + 
-                       unblocked_w + unblocked_e)
-        diff_self = MyBot.DIFF_FACTOR * adj_field * unblocked_field
-        diff_n = (MyBot.DIFF_FACTOR * 
-            (unblocked_field & unblocked_n))
-        diff_s = (MyBot.DIFF_FACTOR * 
-            (unblocked_field & unblocked_s))
-        diff_w = (MyBot.DIFF_FACTOR * 
-            (unblocked_field & unblocked_w))
-        diff_e = (MyBot.DIFF_FACTOR * 
-            (unblocked_field & unblocked_e))
+        # WATER blocks diffusion
+        diffusion = self.u_diffusion
+        diffusion.set_unblocked(ants.passable_field, ants.passable_version)
 
         dif_setup_time = 1000*(time.time()-dif_setup_begin)
         log.info("Diff setup: %s ms", dif_setup_time)
         
         dif_begin = time.time()
-        for diffusion in xrange(MyBot.U_ITERATIONS):
-            # source blocks
-            scent_field[clamp_index] = clamp_field[clamp_index]
-            # build new scents
-            scent_field = (scent_field * (1 - diff_self)
-                + (diff_n * np.roll(scent_field, 1, axis=0))
-                + (diff_s * np.roll(scent_field,-1, axis=0))
-                + (diff_w * np.roll(scent_field, 1, axis=1))
-                + (diff_e * np.roll(scent_field,-1, axis=1)))
-        self.u_scent_field = scent_field # store scent field
+        self.u_scent_field = diffusion.run( # store scent field
+            0.95*self.u_scent_field,
+            clamps=(clamp_index, clamp_field[clamp_index]),
+            iterations=MyBot.U_ITERATIONS)
         dif_time = 1000*(time.time()-dif_begin)
         log.info("Unified: %s diff iterations: %s ms", MyBot.U_ITERATIONS, dif_time)
         
@@ -229,47 +230,35 @@ class MyBot(object):
                          np.roll(clamp_index,-1, axis=1))
         clamp_index = clamp_index - clamp_useless
         
-        # re-initialize scent field with 1.0 at invisible squares
-        scent_field = invisible.astype(np.float64) 
-        
-        # preset unblocked and diff fields
         # WATER or ant : do not receive diffusion
-        unblocked_field = ants.passable_field & (~ ants.ant_field)
-        scent_field[~unblocked_field] = 0.0 # reset ant/water scent
-        
-        unblocked_n = np.roll(unblocked_field, 1, axis=0)
-        unblocked_s = np.roll(unblocked_field,-1, axis=0)
-        unblocked_w = np.roll(unblocked_field, 1, axis=1)
-        unblocked_e = np.roll(unblocked_field,-1, axis=1)
-        adj_field = (unblocked_n.astype(np.int8) + unblocked_s + 
-                       unblocked_w + unblocked_e)
-        diff_self = MyBot.E_FACTOR * adj_field * unblocked_field
-        diff_n = (MyBot.E_FACTOR * 
-            (unblocked_field & unblocked_n))
-        diff_s = (MyBot.E_FACTOR * 
-            (unblocked_field & unblocked_s))
-        diff_w = (MyBot.E_FACTOR * 
-            (unblocked_field & unblocked_w))
-        diff_e = (MyBot.E_FACTOR * 
-            (unblocked_field & unblocked_e))
+        diffusion = self.e_diffusion
+        diffusion.set_unblocked(ants.passable_field & (~ ants.ant_field))
         
         dif_setup_time = 1000*(time.time()-dif_setup_begin)
         log.info("Diff setup: %s ms", dif_setup_time)
         
         dif_begin = time.time()
         log.debug(len(clamp_index.nonzero()[0]))
-        for diffusion in xrange(MyBot.E_ITERATIONS):
-            # source blocks
-            scent_field[clamp_index] = 3.0 # should get from clamp_field
-            # build new scents
-            scent_field = (scent_field * (1 - diff_self)
-                + (diff_n * np.roll(scent_field, 1, axis=0))
-                + (diff_s * np.roll(scent_field,-1, axis=0))
-                + (diff_w * np.roll(scent_field, 1, axis=1))
-                + (diff_e * np.roll(scent_field,-1, axis=1)))
-        self.e_scent_field = scent_field # store scent field
+        visible = ants.visible_field
+        if self.e_visible is None:
+            # initialize scent field with 1.0 at invisible squares
+            scent_field = invisible.astype(Settings.SCENT_DTYPE)
+            iterations = MyBot.E_ITERATIONS
+        else:
+            # continue from last turn: only squares whose visibility
+            # matters change before the run
+            scent_field = self.e_scent_field.copy()
+            scent_field[visible] *= MyBot.E_VISIBLE_DECAY
+            hidden = invisible & self.e_visible
+            scent_field[hidden] = np.maximum(scent_field[hidden], 1.0)
+            iterations = MyBot.E_WARM_ITERATIONS
+        self.e_visible = visible.copy()
+        self.e_scent_field = diffusion.run( # store scent field
+            scent_field,
+            clamps=(clamp_index, 3.0), # should get from clamp_field
+            iterations=iterations)
         dif_time = 1000*(time.time()-dif_begin)
-        log.info("Explore: %s diff iterations: %s ms", MyBot.E_ITERATIONS, dif_time)
+        log.info("Explore: %s diff iterations: %s ms", iterations, dif_time)
 
 if __name__ == '__main__':
     # psyco will speed up python a little, but is not needed
@@ -2,6 +2,10 @@
 
 """
 NumDiffBot
+v 2.4
+- -p/--precision: "single" keeps scents in float32 (as CombatBot)
+v 2.3
+- diffusion through proj.diffusion.DiffusionField
 v 2.2
 - use numAnts
 v 2.1
@@ -32,11 +36,13 @@ import copy
 import numpy as np
 
 from proj.numAnts import Ants
+from proj.diffusion import DiffusionField
 from proj.constants import LAND, WATER, UNKNOWN, ME, FOOD, INF
 
 class Settings:
     VISUALIZE = False
     LOGGING = False
+    SCENT_DTYPE = np.float64
 log = logging.getLogger(__name__)
 
 def init_options():
@@ -48,11 +54,18 @@ def init_options():
     parser.add_option("-v", "--visual", action="store_true", 
                       dest="visualize", default=False, 
                       help="Turns on custom visualization.")
+    parser.add_option("-p", "--precision", dest="precision",
+        type="choice", choices=("double", "single"), default="double",
+        help="single: float32 scent fields.")
                      
     (options, args) = parser.parse_args()
     
     # setup visualizer
     Settings.VISUALIZE = options.visualize
+    
+    # setup field types
+    if options.precision == "single":
+        Settings.SCENT_DTYPE = np.float32
 
     # setup logging
     level = {"DEBUG": logging.DEBUG,
@@ -86,7 +99,11 @@ class MyBot(object):
         self.ants = ants
         ##self.world = set(c for r in ants.loc for c in r)
         
-        self.u_scent_field = np.zeros((ants.rows, ants.cols)) # unified
+        scent_dtype = Settings.SCENT_DTYPE
+        self.u_scent_field = np.zeros((ants.rows, ants.cols), 
+                                      scent_dtype) # unified
+        self.u_diffusion = DiffusionField(ants.dimensions, MyBot.DIFF_FACTOR,
+                                          scent_dtype)
         for r in xrange(ants.rows):
             for c in xrange(ants.cols):
                 cell = ants.loc[r][c]
@@ -101,36 +118,19 @@ class MyBot(object):
         # setting up diffusion
         dif_setup_begin = time.time()
         
-        u_scent_field = self.u_scent_field
-        u_unblocked_field = np.ones(ants.dimensions, dtype=bool)
         u_clamps = []
-        u_clamp_field = np.empty(ants.dimensions)
+        u_clamp_field = np.empty(ants.dimensions, Settings.SCENT_DTYPE)
         
         for r in xrange(ants.rows):
             for c in xrange(ants.cols):
                 cell = ants.loc[r][c]
-                cell.u_source = None
                 if cell.passable and cell.contents in (None, FOOD):
                     cell.unoccupied_next = True # unless food
-                else: # WATER or ant : do not receive diffusion
-                    u_unblocked_field[cell] = False
-                    u_scent_field[cell] = 0.0 # reset scent
+                else:
                     cell.unoccupied_next = False
-        u_unblocked_n = np.roll(u_unblocked_field, 1, axis=0)
-        u_unblocked_s = np.roll(u_unblocked_field,-1, axis=0)
-        u_unblocked_w = np.roll(u_unblocked_field, 1, axis=1)
-        u_unblocked_e = np.roll(u_unblocked_field,-1, axis=1)
-        u_adj_field = (u_unblocked_n.astype(np.int8) + u_unblocked_s + 
-                       u_unblocked_w + u_unblocked_e)
-        u_diff_self = MyBot.DIFF_FACTOR * u_adj_field * u_unblocked_field
-        u_diff_n = (MyBot.DIFF_FACTOR * 
-            (u_unblocked_field & u_unblocked_n))
-        u_diff_s = (MyBot.DIFF_FACTOR * 
-            (u_unblocked_field & u_unblocked_s))
-        u_diff_w = (MyBot.DIFF_FACTOR * 
-            (u_unblocked_field & u_unblocked_w))
-        u_diff_e = (MyBot.DIFF_FACTOR * 
-            (u_unblocked_field & u_unblocked_e))
+        # WATER or ant : do not receive diffusion
+        u_diffusion = self.u_diffusion
+        u_diffusion.set_unblocked(ants.passable_field & (~ ants.ant_field))
         
         # clamped source setup
         for food in ants.food_set:
@@ -149,16 +149,10 @@ class MyBot(object):
         log.info("Diff setup: %s ms", dif_setup_time)
         
         dif_begin = time.time()
-        for u_diffusion in xrange(MyBot.U_ITERATIONS):
-            # source blocks
-            u_scent_field[u_clamp_index] = u_clamp_field[u_clamp_index]
-            # build new scents
-            u_scent_field = (u_scent_field
-                + (u_diff_n * np.roll(u_scent_field, 1, axis=0))
-                + (u_diff_s * np.roll(u_scent_field,-1, axis=0))
-                + (u_diff_w * np.roll(u_scent_field, 1, axis=1))
-                + (u_diff_e * np.roll(u_scent_field,-1, axis=1))
-                - (u_diff_self * u_scent_field)) #factor scent_field
+        u_scent_field = u_diffusion.run(
+            self.u_scent_field, 
+            clamps=(u_clamp_index, u_clamp_field[u_clamp_index]),
+            iterations=MyBot.U_ITERATIONS)
         self.u_scent_field = u_scent_field # store scent field
         dif_time = 1000*(time.time()-dif_begin)
         log.info("%s diff iterations: %s ms", MyBot.U_ITERATIONS, dif_time)
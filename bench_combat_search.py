@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+CombatSearch.plan on fights in contact, on an open map: a line of my
+ants facing a line of enemies, and clumps of n of my ants against n
+enemies, a few squares apart, at random squares of two blocks.
+
+For each kind of fight, the search runs to the end (no deadline) on
+count random fights (one for the lines); reported are the median and
+largest time, the joint moves scored and how many plans would have run
+out of the budget (-b ms). With a budget, a plan that runs out gives
+None and the fight is left to the safety map.
+
+usage: python bench_combat_search.py [-c count] [-b ms] [-r radius2]
+"""
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from proj.constants import ME
+from proj.combat import CombatSearch, DIRECTIONS
+from proj.numLocation import AIM
+
+DIMENSIONS = (60, 60)
+
+def fight_moves(mine, enemies):
+    'moves (n, MOVES, 2), owners and the mine mask; my ants come first'
+    centres = np.array(mine + enemies)
+    steps = np.array([(0, 0)] + [AIM[direction] for direction in DIRECTIONS])
+    moves = (centres[:,np.newaxis] + steps) % DIMENSIONS
+    owners = np.array([ME] * len(mine) + [1] * len(enemies))
+    return moves, owners, owners == ME
+
+def preferred_moves(moves, mine):
+    'my ants stay, enemies step towards my nearest ant'
+    d = np.abs(moves[:,:,np.newaxis] - moves[mine,0][np.newaxis,np.newaxis])
+    closest = (d * d).sum(axis=3).min(axis=2)
+    return np.where(mine, 0, closest.argmin(axis=1))
+
+def lines(n, rng):
+    'n of mine in a column, n enemies in one two columns over'
+    mine = [(20 + k, 20) for k in xrange(n)]
+    enemies = [(20 + k, 22) for k in xrange(n)]
+    return mine, enemies
+
+def clumps(n, rng):
+    'n of mine and n enemies at random squares of two blocks, 1 apart'
+    side = int(np.ceil(np.sqrt(2 * n)))
+    squares = [(r, c) for r in xrange(side) for c in xrange(side)]
+    mine = [(20 + r, 20 + c) for r, c in
+            (squares[k] for k in rng.choice(len(squares), n, replace=False))]
+    enemies = [(20 + r, 21 + side + c) for r, c in
+               (squares[k] for k in rng.choice(len(squares), n, replace=False))]
+    return mine, enemies
+
+def bench(name, fights, search, budget):
+    times = []
+    evaluated = []
+    for mine, enemies in fights:
+        moves, owners, mask = fight_moves(mine, enemies)
+        preferred = preferred_moves(moves, mask)
+        start = time.time()
+        search.plan(moves, owners, mask, preferred, float('inf'))
+        times.append(1e3 * (time.time() - start))
+        evaluated.append(search.evaluated)
+    times = np.array(times)
+    print "%-12s %3d fights: %6.1f ms median, %6.1f ms max, " \
+          "%6d joint moves median, %d over %d ms" % (name, len(fights),
+        np.median(times), times.max(), np.median(evaluated),
+        (times > budget).sum(), budget)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [-c count] [-b ms] [-r radius2]")
+    parser.add_option("-c", "--count", dest="count", type="int",
+                      default=20, help="random fights of each size")
+    parser.add_option("-b", "--budget", dest="budget", type="float",
+                      default=10.0, help="ms per fight (SEARCH_BUDGET)")
+    parser.add_option("-r", "--radius2", dest="radius2", type="int",
+                      default=5, help="attack radius squared")
+    (options, args) = parser.parse_args()
+    search = CombatSearch(DIMENSIONS, options.radius2, 1.1)
+    rng = np.random.RandomState(0)
+    for n in (3, 6):
+        bench("lines %dv%d" % (n, n), [lines(n, rng)], search,
+              options.budget)
+    for n in (4, 8, 12):
+        bench("clumps %dv%d" % (n, n), [clumps(n, rng) for k in
+              xrange(options.count)], search, options.budget)
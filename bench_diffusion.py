@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Per-iteration diffusion timing: the np.concatenate kernel the bots used
+(diffusion.py v1.0) against the in-place stencil_step (v1.1) and the
+DiffusionField.step of now (gain_step); and CombatBot's three scents
+(60/90/40 iterations) as the bot ran them up to diffusion.py v1.9 (one
+stencil_step loop each), one by one with step() and in one
+DiffusionStack.run; and, on large maps, a settled field in which the
+squares around a few ants fade: 30 steps of run() against the tiled
+DiffusionField.update; and 60 steps with and without a
+DiffusionField.cascade start, against a 1000 step run; and step() in
+float64 against float32.
+
+usage: python bench_diffusion.py [iterations]
+"""
+import sys
+import time
+
+import numpy as np
+
+from proj.diffusion import DiffusionField, DiffusionStack, stencil_step
+
+SIZES = [(60, 90), (130, 176)]
+LARGE_SIZES = [(150, 150), (200, 200)]
+
+def concatenate_kernel(field, scent_field, iterations):
+    loss = field.loss
+    diff_n, diff_s = field.diff_n, field.diff_s
+    diff_w, diff_e = field.diff_w, field.diff_e
+    clamp_index, clamp_values = field.clamps
+    for diffusion in xrange(iterations):
+        scent_field.ravel()[clamp_index] = clamp_values
+        n = np.concatenate((scent_field[-1:], scent_field[:-1]), axis=0)
+        s = np.concatenate((scent_field[1:], scent_field[:1]), axis=0)
+        w = np.concatenate((scent_field[:,-1:], scent_field[:,:-1]), axis=1)
+        e = np.concatenate((scent_field[:,1:], scent_field[:,:1]), axis=1)
+        scent_field = (loss * scent_field
+            + (diff_n * n)
+            + (diff_s * s)
+            + (diff_w * w)
+            + (diff_e * e))
+    return scent_field
+
+def stencil_kernel(field, scent_field, iterations):
+    'step() as of diffusion.py v1.1-v1.9: stencil_step, no scaling'
+    stencil = (field.loss, field.diff_n, field.diff_s, 
+               field.diff_w, field.diff_e)
+    new_field = np.empty_like(scent_field)
+    term = np.empty_like(scent_field)
+    if field.clamps is not None:
+        clamp_index, clamp_values = field.clamps
+    for diffusion in xrange(iterations):
+        if field.clamps is not None:
+            scent_field.ravel().put(clamp_index, clamp_values)
+        stencil_step(scent_field, new_field, term, stencil)
+        scent_field, new_field = new_field, scent_field
+    return scent_field
+
+def bench(dimensions, iterations):
+    rng = np.random.RandomState(0)
+    unblocked = rng.rand(*dimensions) > 0.2 # ~20% water
+    sources = rng.rand(*dimensions)
+    clamps = (unblocked & (rng.rand(*dimensions) > 0.99), 50.0)
+
+    field = DiffusionField(dimensions, 0.2)
+    field.set_unblocked(unblocked)
+    field.run(sources, clamps, 0) # set up buffers and clamps
+
+    times = []
+    results = []
+    for kernel in (concatenate_kernel, stencil_kernel):
+        start = time.time()
+        results.append(kernel(field, field.scent.copy(), iterations))
+        times.append((time.time() - start) / iterations)
+    start = time.time()
+    results.append(field.step(iterations))
+    times.append((time.time() - start) / iterations)
+    assert (results[0] == results[1]).all()
+    assert np.allclose(results[1], results[2], rtol=1e-12, atol=0)
+
+    print "%dx%d: concatenate %.1f us/iter, stencil_step %.1f us/iter, " \
+          "gain_step %.1f us/iter (x%.1f)" % (dimensions[0], dimensions[1], 
+            times[0] * 1e6, times[1] * 1e6, times[2] * 1e6, 
+            times[0] / times[2])
+
+def bench_stack(dimensions, repeats=5):
+    rng = np.random.RandomState(0)
+    unblocked = rng.rand(*dimensions) > 0.2
+    channels = [(0.2, 60), (0.15, 90), (0.2, 40)] # food, explore, attack
+    fields = []
+    for factor, iterations in channels:
+        field = DiffusionField(dimensions, factor)
+        field.set_unblocked(unblocked)
+        fields.append(field)
+    runs = [(rng.rand(*dimensions),
+             (unblocked & (rng.rand(*dimensions) > 0.99), 50.0),
+             iterations) for factor, iterations in channels]
+    stack = DiffusionStack(dimensions)
+
+    old_time = separate_time = stack_time = 0.0
+    for repeat in xrange(repeats):
+        start = time.time()
+        for field, args in zip(fields, runs):
+            field.prepare(*args)
+            stencil_kernel(field, field.scent.copy(), field.iterations)
+        old_time += time.time() - start
+        start = time.time()
+        separate = [field.run(*args) for field, args in zip(fields, runs)]
+        separate_time += time.time() - start
+        start = time.time()
+        for field, args in zip(fields, runs):
+            field.prepare(*args)
+        stacked = stack.run(fields)
+        stack_time += time.time() - start
+        assert all((a == b).all() for a, b in zip(separate, stacked))
+
+    print "%dx%d: 3 channels as before %.1f ms, separately %.1f ms, " \
+          "stacked %.1f ms (x%.1f)" % (dimensions[0], dimensions[1], 
+            old_time / repeats * 1e3, separate_time / repeats * 1e3,
+            stack_time / repeats * 1e3, old_time / stack_time)
+
+def bench_tiled(dimensions, counts=(1, 4, 16, 64), steps=30,
+                tolerance=1e-3):
+    rng = np.random.RandomState(0)
+    rows, cols = dimensions
+    unblocked = rng.rand(*dimensions) > 0.2
+    clamps = (unblocked & (rng.rand(*dimensions) > 0.998), 3.0)
+    full = DiffusionField(dimensions, 0.15)
+    full.set_unblocked(unblocked)
+    tiled = DiffusionField(dimensions, 0.15)
+    tiled.set_unblocked(unblocked)
+    settled = full.run(np.zeros(dimensions), clamps, 20000, None, 1e-7)
+    # a first update only settles the tiled field's bookkeeping
+    tiled.update(settled, np.zeros(dimensions, dtype=bool), clamps, 0)
+
+    print "%dx%d, %d steps, tolerance %g:" % (rows, cols, steps, tolerance)
+    r, c = np.indices(dimensions)
+    for count in counts:
+        # squares within sight (radius2 77) of count ants fade
+        changed = np.zeros(dimensions, dtype=bool)
+        for ant_r, ant_c in zip(rng.randint(rows, size=count),
+                                rng.randint(cols, size=count)):
+            d_r = np.minimum(abs(r - ant_r), rows - abs(r - ant_r))
+            d_c = np.minimum(abs(c - ant_c), cols - abs(c - ant_c))
+            changed |= d_r * d_r + d_c * d_c <= 77
+        sources = np.where(changed, 0.5 * settled, settled)
+        start = time.time()
+        reference = full.run(sources, clamps, steps, None, tolerance)
+        full_time = time.time() - start
+        tiled.restless = None
+        start = time.time()
+        result = tiled.update(sources, changed, clamps, steps, tolerance)
+        tiled_time = time.time() - start
+        print "  %2d ants: run %.1f ms, update %.1f ms (%.1f of %d tiles " \
+              "per step), largest difference %.2g" % (count,
+                full_time * 1e3, tiled_time * 1e3,
+                tiled.stepped / float(max(tiled.ran, 1)), tiled.tiles.count,
+                np.abs(result - reference).max())
+
+def bench_cascade(dimensions, iterations=1000, steps=60):
+    rng = np.random.RandomState(0)
+    unblocked = rng.rand(*dimensions) > 0.2
+    clamps = (unblocked & (rng.rand(*dimensions) > 0.999), 50.0)
+    sources = np.zeros(dimensions)
+    field = DiffusionField(dimensions, 0.2)
+    field.set_unblocked(unblocked)
+    reference = field.run(sources, clamps, iterations)
+
+    start = time.time()
+    plain = field.run(sources, clamps, steps)
+    plain_time = time.time() - start
+    start = time.time()
+    cascaded = field.run(field.cascade(sources, clamps, iterations),
+                         clamps, steps)
+    cascade_time = time.time() - start
+    print "%dx%d, %d steps: mean error %.2f in %.1f ms, cascaded %.2f " \
+          "in %.1f ms" % (dimensions[0], dimensions[1], steps, 
+            np.abs(plain - reference)[unblocked].mean(), plain_time * 1e3,
+            np.abs(cascaded - reference)[unblocked].mean(), 
+            cascade_time * 1e3)
+
+def bench_dtype(dimensions, iterations):
+    rng = np.random.RandomState(0)
+    unblocked = rng.rand(*dimensions) > 0.2
+    sources = rng.rand(*dimensions)
+    clamps = (unblocked & (rng.rand(*dimensions) > 0.99), 50.0)
+    times = []
+    for dtype in (np.float64, np.float32):
+        field = DiffusionField(dimensions, 0.2, dtype)
+        field.set_unblocked(unblocked)
+        field.run(sources, clamps, 0)
+        start = time.time()
+        field.step(iterations)
+        times.append((time.time() - start) / iterations)
+    print "%dx%d: float64 %.1f us/iter, float32 %.1f us/iter (x%.1f)" % (
+        dimensions[0], dimensions[1], times[0] * 1e6, times[1] * 1e6,
+        times[0] / times[1])
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    for dimensions in SIZES:
+        bench(dimensions, iterations)
+    for dimensions in SIZES:
+        bench_stack(dimensions)
+    for dimensions in LARGE_SIZES:
+        bench_tiled(dimensions)
+    for dimensions in SIZES + LARGE_SIZES:
+        bench_cascade(dimensions)
+    for dimensions in SIZES + LARGE_SIZES:
+        bench_dtype(dimensions, iterations)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Move gradients on the shipped maps (tools/maps): DistanceField.run, an
+exact BFS, against a 60 step DiffusionField.run, with a few random land
+squares as sources (food, say).
+
+For every land square that a source can reach, the best diffusion move
+(the neighbour with the most scent) is checked against the BFS: it
+should lead one step closer to the nearest source. Squares where no
+neighbour has more scent than the others (faded out to nothing or
+saturated) count as flat. The first map is also checked against a plain
+deque BFS.
+
+usage: python bench_distance.py [-s sources] [-a] [map ...]
+    -a: every map, not the first of each tools/maps directory
+"""
+import os
+import glob
+import time
+from collections import deque
+from optparse import OptionParser
+
+import numpy as np
+
+from proj.diffusion import DiffusionField
+from proj.distance import DistanceField, UNREACHED
+
+MAP_DIR = os.path.join("tools", "maps")
+
+def read_map(filename):
+    'unblocked field of a map file'
+    with open(filename) as f:
+        rows = [line[2:].rstrip('\r\n') for line in f
+                if line.startswith('m ')]
+    return np.array([[square != '%' for square in row] for row in rows])
+
+def deque_bfs(unblocked, sources):
+    rows, cols = unblocked.shape
+    distance = np.empty(unblocked.shape, dtype=np.int64)
+    distance.fill(UNREACHED)
+    queue = deque()
+    for loc in zip(*sources.nonzero()):
+        distance[loc] = 0
+        queue.append(loc)
+    while queue:
+        r, c = queue.popleft()
+        for d_r, d_c in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            loc = ((r + d_r) % rows, (c + d_c) % cols)
+            if unblocked[loc] and distance[loc] == UNREACHED:
+                distance[loc] = distance[r, c] + 1
+                queue.append(loc)
+    return distance
+
+def neighbour_fields(field):
+    return [np.roll(field, shift, axis)
+            for shift, axis in ((1, 0), (-1, 0), (1, 1), (-1, 1))]
+
+def bench(filename, count, check=False, iterations=60, repeats=5):
+    unblocked = read_map(filename)
+    dimensions = unblocked.shape
+    rng = np.random.RandomState(0)
+    sources = np.zeros(dimensions, dtype=bool)
+    sources.ravel()[rng.choice(np.flatnonzero(unblocked), count,
+                               replace=False)] = True
+
+    distance_field = DistanceField(dimensions)
+    distance_field.set_unblocked(unblocked)
+    start = time.time()
+    for repeat in xrange(repeats):
+        distance = distance_field.run(sources)
+    distance_time = (time.time() - start) / repeats
+    if check:
+        assert (distance == deque_bfs(unblocked, sources)).all()
+
+    diffusion = DiffusionField(dimensions, 0.2)
+    diffusion.set_unblocked(unblocked)
+    start = time.time()
+    for repeat in xrange(repeats):
+        scent = diffusion.run(np.zeros(dimensions), (sources, 50.0),
+                              iterations)
+    diffusion_time = (time.time() - start) / repeats
+
+    # squares with a move to make
+    moving = unblocked & ~sources & (distance != UNREACHED)
+    # blocked neighbours can not be moved to
+    scents = np.array([np.where(n_unblocked, n_scent, -np.inf)
+                       for n_scent, n_unblocked in
+                       zip(neighbour_fields(scent),
+                           neighbour_fields(unblocked))])
+    best = scents.argmax(axis=0)
+    flat = (scents == scents.max(axis=0)).sum(axis=0) > 1
+    closer = np.array(neighbour_fields(distance)) == distance - 1
+    right = np.choose(best, closer) & ~flat
+    total = moving.sum()
+    print "%s %dx%d: BFS %.1f ms (%d waves), diffusion %.1f ms; " \
+          "diffusion moves closer %.1f%%, flat %.1f%%" % (
+        os.path.relpath(filename, MAP_DIR), dimensions[0], dimensions[1],
+        distance_time * 1e3, distance_field.waves, diffusion_time * 1e3,
+        100.0 * (right & moving).sum() / total,
+        100.0 * (flat & moving).sum() / total)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [-s sources] [-a] [map ...]")
+    parser.add_option("-s", "--sources", dest="sources", type="int",
+                      default=10, help="random land squares used as sources")
+    parser.add_option("-a", "--all", dest="all", action="store_true",
+                      default=False, help="every shipped map")
+    (options, args) = parser.parse_args()
+    if not args:
+        for directory in sorted(glob.glob(os.path.join(MAP_DIR, "*"))):
+            maps = sorted(glob.glob(os.path.join(directory, "*.map")))
+            args.extend(maps if options.all else maps[:1])
+    for i, filename in enumerate(args):
+        bench(filename, options.sources, check=(i == 0))
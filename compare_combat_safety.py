@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Replays recorded bot inputs (game_logs/*.input) through CombatBot and, on
+every turn with a fight, checks gen_combat_safety, which works in one
+window with a layer per player present, against gen_combat_safety_loops: the lowest enemy weakness and safety fields and
+the soldiers must all be the same. Reports the turns checked, the first
+differences and the time each version took.
+With -e, gen_combat_safety uses a move predictor that expects every
+move (PREDICT_LIKELY 0): the stamps of the likely moves, my ants' 
+included, must then give the loops' results too.
+
+usage: python compare_combat_safety.py [-e] [input ...]
+"""
+import sys
+import os
+import glob
+import time
+
+import numpy as np
+
+import proj.numAnts
+from proj.numAnts import Ants
+import CombatBot
+
+FIELDS = ("lowest_enemy_weakness", "safety_field")
+
+class CheckedBot(CombatBot.MyBot):
+    def __init__(self):
+        CombatBot.MyBot.__init__(self)
+        # -e: every move is likely
+        CombatBot.MyBot.PREDICT_LIKELY = 0.0
+        self.checked = 0
+        self.differences = []
+        self.times = [0.0, 0.0]
+
+    def gen_combat_safety(self, ants):
+        results = []
+        for k, method in enumerate((CombatBot.MyBot.gen_combat_safety_loops,
+                                    CombatBot.MyBot.gen_combat_safety)):
+            start = time.time()
+            method(self, ants)
+            self.times[k] += time.time() - start
+            results.append([getattr(self, name).copy() for name in FIELDS] +
+                           [set(self.soldiers)])
+        self.checked += 1
+        reference, batched = results
+        for name, old, new in zip(FIELDS + ("soldiers",), reference, batched):
+            same = old == new if name == "soldiers" else (old == new).all()
+            if not same:
+                self.differences.append((ants.cur_turn, name))
+
+def check(filename):
+    bot = CheckedBot()
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin = open(filename)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        Ants.run(bot)
+    finally:
+        sys.stdin.close()
+        sys.stdout.close()
+        sys.stdin, sys.stdout = stdin, stdout
+    print "%s: %d fights checked, %d differences%s" % (filename,
+        bot.checked, len(bot.differences),
+        " (turn, field) %s" % bot.differences[:5] if bot.differences else "")
+    print "  loops %.1f ms, batched %.1f ms per fight" % tuple(
+        1e3 * t / max(bot.checked, 1) for t in bot.times)
+    return not bot.differences
+
+if __name__ == '__main__':
+    # recorded input arrives at once: no turn timer
+    proj.numAnts.set_alarm = lambda start_time, milliseconds: None
+    args = CombatBot.init_options()
+    results = [check(filename) for filename in
+               args or sorted(glob.glob("game_logs/*.input"))]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Replays recorded bot inputs (game_logs/*.input) through a bot run with
+-p double and with -p single, and reports how often the orders differ.
+
+Input is fed one frame at a time, as the engine does, so each turn is
+decided from the same recorded state with the bot's own carried-over
+fields. Diffusion stops at a deadline, so a heavily loaded machine can
+add differences of its own; compare a double run against itself
+(-s double) to see that noise. Bots with -p: CombatBot, ExploreBot
+and NumDiffBot_006.
+
+usage: python compare_precision.py [-b bot] [-s single] [input ...]
+"""
+import sys
+import os
+import re
+import glob
+import time
+import subprocess
+from optparse import OptionParser
+
+# an input frame ends with a ready or go line; the bot answers with go
+FRAME = re.compile(r'.*?^(?:ready|go)\r?\n', re.M | re.S)
+
+def read_frames(filename):
+    with open(filename) as f:
+        return FRAME.findall(f.read())
+
+def play(bot, precision, frames):
+    """
+    Run bot on frames; return ({turn: {(row, col): direction}}, seconds).
+    """
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        process = subprocess.Popen([sys.executable, bot, '-p', precision],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=devnull)
+        turns = {}
+        for turn, frame in enumerate(frames):
+            process.stdin.write(frame)
+            process.stdin.flush()
+            orders = turns[turn] = {}
+            for line in iter(process.stdout.readline, ''):
+                line = line.strip()
+                if line == 'go':
+                    break
+                if line.startswith('o '):
+                    o, row, col, direction = line.split()
+                    orders[(int(row), int(col))] = direction
+            else:
+                break # bot exited
+        process.stdin.close()
+        process.wait()
+        return turns, time.time() - start
+
+def compare(bot, filename, precision):
+    frames = read_frames(filename)
+    reference, reference_time = play(bot, 'double', frames)
+    other, other_time = play(bot, precision, frames)
+    turns = sorted(set(reference) | set(other))
+    differing_turns = []
+    ordered = differing = 0
+    for turn in turns:
+        orders = reference.get(turn, {})
+        other_orders = other.get(turn, {})
+        ants = set(orders) | set(other_orders)
+        changed = sum(1 for ant in ants
+                      if orders.get(ant) != other_orders.get(ant))
+        ordered += len(ants)
+        differing += changed
+        if changed:
+            differing_turns.append(turn)
+
+    print "%s: %d turns, %d ants ordered" % (filename, len(turns), ordered)
+    print "  turns with different orders: %d (%.1f%%)%s" % (
+        len(differing_turns), 
+        100.0 * len(differing_turns) / max(len(turns), 1),
+        ", first turn %d" % differing_turns[0] if differing_turns else "")
+    print "  ants with different orders: %d (%.2f%%)" % (
+        differing, 100.0 * differing / max(ordered, 1))
+    print "  time: double %.1f s, %s %.1f s" % (reference_time, precision,
+                                               other_time)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [-b bot] [-s single] [input ...]")
+    parser.add_option("-b", "--bot", dest="bot", default="CombatBot.py")
+    parser.add_option("-s", "--precision", dest="precision",
+                      type="choice", choices=("double", "single"),
+                      default="single", help="precision compared to double")
+    (options, args) = parser.parse_args()
+    for filename in args or sorted(glob.glob("game_logs/*.input")):
+        compare(options.bot, filename, options.precision)
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
 """proj/ants.py
+Version 1.5
+- orders are buffered (protocol.OrderBuffer) and written with 'go' in one
+  write; flush_orders() sends a partial batch early
+Version 1.4
+- read input by frame (protocol.FrameReader); turn timer starts when
+  the frame's first byte arrives
 Version 1.3
 - edit logging heading format
 - limit turntime to 500 (TCP etiquette)
@@ -24,6 +30,7 @@ import logging
 #from location import Location, Offset, gen_offsets
 import location
 from constants import *
+from protocol import FrameReader, OrderBuffer
 
 log = logging.getLogger(__name__)
 
@@ -43,6 +50,7 @@ class Ants():
         self.food_set = set()
         self.explored = set()
         self.water = set()
+        self.order_buffer = OrderBuffer()
 
         self.turntime = 0
         self.loadtime = 0
@@ -53,11 +61,13 @@ class Ants():
         self.spawnradius2 = 0
         self.turns = 0
 
-    def setup(self, data):
+    def setup(self, data, start_time=None):
         'parse initial input and setup starting game state'
 
-        # start timer
-        self.turn_start_time = time.time()
+        # start timer (from arrival of input, if known)
+        if start_time is None:
+            start_time = time.time()
+        self.turn_start_time = start_time
 
         log.info("== SETUP BEGINS == ")
 
@@ -116,10 +126,12 @@ class Ants():
         log.debug('remaining in setup = {0} milliseconds'.format(self.setup_time_remaining()))
 
 
-    def update(self, data):
+    def update(self, data, start_time=None):
         'parse engine input and update the game state'
-        # start timer
-        self.turn_start_time = time.time()
+        # start timer (from arrival of input, if known)
+        if start_time is None:
+            start_time = time.time()
+        self.turn_start_time = start_time
 
         #increment turn
         self.cur_turn += 1
@@ -196,15 +208,17 @@ class Ants():
 
 
     def issue_order(self, order):
-        'issue an order by writing the proper ant location and direction'
+        'queue an order for the proper ant location and direction'
         (row, col), direction = order
-        sys.stdout.write('o %s %s %s\n' % (row, col, direction))
-        sys.stdout.flush()
+        self.order_buffer.add(row, col, direction)
+
+    def flush_orders(self):
+        'send the orders issued so far now, without ending the turn'
+        self.order_buffer.flush()
 
     def finish_turn(self):
-        'finish the turn by writing the go line'
-        sys.stdout.write('go\n')
-        sys.stdout.flush()
+        'finish the turn by writing the buffered orders and the go line'
+        self.order_buffer.finish()
 
     # Utility Functions
 
@@ -276,25 +290,24 @@ class Ants():
         'parse input, update game state and call the bot classes do_turn method'
         log.info("\n\n======= GAME BEGINS ======= ")
         ants = Ants()
-        map_data = ''
+        reader = FrameReader()
         while(True):
             try:
-                current_line = sys.stdin.readline().rstrip('\r\n') # string new line char
-                if current_line.lower() == 'ready':
-                    ants.setup(map_data)
+                frame = reader.read_frame()
+                if frame is None: # EOF
+                    break
+                terminator, map_data, start_time = frame
+                if terminator == 'ready':
+                    ants.setup(map_data, start_time)
                     bot.do_setup(ants)
                     ants.finish_turn()
-                    map_data = ''
-                elif current_line.lower() == 'end':
+                elif terminator == 'end':
                     break
-                elif current_line.lower() == 'go':
-                    ants.update(map_data)
+                elif terminator == 'go':
+                    ants.update(map_data, start_time)
                     # call the do_turn method of the class passed in
                     bot.do_turn(ants)
                     ants.finish_turn()
-                    map_data = ''
-                else:
-                    map_data += current_line + '\n'
             except EOFError:
                 break
             except KeyboardInterrupt:
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+
+"""proj/combat.py
+v1.4
+- my ants leave their preferred moves only for a worst case at least
+  MIN_GAIN better (an ant saved or taken, not a trade avoided); plans
+  that only dodged trades gave up ground the safety map holds
+- no anytime plans again: past the deadline plan() gives None
+- improve and relax score the moves of all ants of a side in one
+  batch and take the best, instead of one ant (one score call) at a
+  time; after the first batch of a pass only moves that beat the best
+  then are tried again
+- score finds shared squares by sorting, reads opponents off a flat
+  table and counts them as bytes: about 2x faster from 20 joint moves
+  a call (24 ants)
+v1.3
+- CombatCache keys search plans only: to_canonical and from_canonical
+  (window arrays) are gone
+v1.2
+- CombatSearch is anytime: past the deadline plan() gives the moves
+  with the best worst case over the replies found so far (complete is
+  False) instead of None
+- whole-side steps stop once they fail for the side; ants alone only
+  try moves that change their contacts (in range, same square)
+v1.1
+- CombatCache: bounded LRU of fight results by local pattern (relative
+  ant positions, owners and open moves), the same under the 8 grid
+  symmetries; hit counts, optional pickle file across games
+- moves are stay, then AIM order (was n, e, s, w)
+v1.0
+- CombatSearch: joint-move search for one fight, scored with the
+  engine's focus rule (tools/ants.py do_attack_focus) after collisions
+  - my moves are chosen for the worst case over a growing set of enemy
+    replies; each side improves by whole-side steps, then one ant at a
+    time, all candidate moves scored in one batch
+  - my ants keep their preferred moves where changing them does not
+    improve the worst case
+  - gives up (returns None) at a time.time() deadline
+"""
+
+import os
+import time
+import cPickle
+from collections import OrderedDict
+
+import numpy as np
+
+from proj.constants import ME
+from proj.numLocation import AIM
+
+# moves per ant: stay, then a step in each direction, in AIM order (as
+# in NeighbourTable)
+DIRECTIONS = list(AIM)
+MOVES = len(DIRECTIONS) + 1
+# direction of each AIM offset
+OFFSETS = dict((offset, direction) for direction, offset in AIM.items())
+# improvement passes over all ants of a side
+SWEEPS = 3
+# worst case gain for which my ants leave their preferred moves
+MIN_GAIN = 1.0
+
+class CombatSearch(object):
+    """
+    Plans the moves of my ants in one fight against the enemy ants in
+    it.
+
+    A joint move is scored as in the engine: ants moving to the same
+    square die, then an ant dies if an opponent in attack range has no
+    more opponents in range than it has. The score is enemies lost
+    minus loss_weight times my ants lost.
+
+    The search is a double oracle: my moves are improved against every
+    enemy reply found so far, then the enemies look for a reply that
+    does better against them. When they find none, the plan stands if
+    its worst case beats that of my preferred moves by MIN_GAIN.
+
+    Usage:
+        search = CombatSearch(ants.dimensions, ants.attackradius2)
+        plan = search.plan(moves, owners, mine, preferred, deadline)
+        # plan[i]: index into moves[i] for every ant, or None if the
+        # search ran out of time
+    """
+    def __init__(self, dimensions, attackradius2, loss_weight=1.0):
+        self.dimensions = dimensions
+        self.attackradius2 = attackradius2
+        self.loss_weight = loss_weight
+        self.evaluated = 0 # joint moves scored by the last plan()
+        self.complete = True # whether the last plan() finished in time
+        self.replies = 0 # enemy replies my last plan was checked against
+
+    def plan(self, moves, owners, mine, preferred, deadline):
+        """
+        moves is an (n, MOVES, 2) array of (row, col) destinations: the
+        ant's own square, then a step in each of DIRECTIONS; -1 rows for
+        moves it can not make.
+        owners are the n owners, mine the bool mask of my ants and
+        preferred the move each ant starts from (kept on ties; my ants
+        should not share squares). Returns the chosen move indices (for
+        enemies: their worst reply found), or None once time.time()
+        passes deadline.
+        """
+        self.setup(moves, owners, mine)
+        self.evaluated = 0
+        self.deadline = deadline
+        self.complete = True
+        mine = self.mine
+        preferred = np.asarray(preferred, dtype=int)
+        # enemies come on, or stay
+        replies = [preferred.copy(), np.zeros(len(owners), dtype=int)]
+        choice = preferred
+        self.replies = 0
+        while True:
+            choice = self.improve(choice, replies, mine, True)
+            if not self.complete:
+                return None
+            joint = np.where(mine, choice, replies)
+            scores = self.score(joint)
+            reply = self.improve(joint[scores.argmin()], [choice], ~mine,
+                                 False)
+            self.replies = len(replies)
+            if not self.complete:
+                return None
+            if self.score(reply[np.newaxis])[0] >= scores.min():
+                break
+            replies.append(reply)
+        choice = self.relax(choice, preferred, replies)
+        if not self.complete:
+            return None
+        # the worst case of both against every reply, and the enemies'
+        # best reply to each
+        results = []
+        for moves in (choice, preferred):
+            joint = np.where(mine, moves, replies)
+            scores = self.score(joint)
+            reply = self.improve(joint[scores.argmin()], [moves], ~mine,
+                                 False)
+            if not self.complete:
+                return None
+            value = self.score(reply[np.newaxis])[0]
+            if value >= scores.min():
+                value, reply = scores.min(), joint[scores.argmin()]
+            results.append((value, reply))
+        (value, reply), (preferred_value, preferred_reply) = results
+        if value < preferred_value + MIN_GAIN:
+            return preferred_reply
+        return reply
+
+    def out_of_time(self):
+        'whether the deadline has passed; the search is then incomplete'
+        if time.time() > self.deadline:
+            self.complete = False
+        return not self.complete
+
+    def relax(self, choice, preferred, others):
+        """
+        Put my ants back on their preferred moves wherever that keeps the
+        worst score over others: ants need not give up their own moves
+        (and freeze in place with the rest of the side) for a fight they
+        take no part in. Each round scores every ant's way back in one
+        batch and takes the best; ants whose way back lost are not
+        tried again. Returns the new choice (so far, past
+        the deadline).
+        """
+        mine = self.mine
+        joint = np.where(mine, choice, others)
+        best = self.score(joint).min()
+        side = np.flatnonzero(mine)
+        # after the first batch, only ants whose way back kept best
+        hopeful = mine.copy()
+        while not self.out_of_time():
+            ants = np.flatnonzero(hopeful & (joint[0] != preferred))
+            # not onto squares the rest of the side takes
+            taken = np.in1d(self.cells[ants, preferred[ants]],
+                            self.cells[side, joint[0, side]])
+            ants = ants[~taken]
+            if not len(ants):
+                break
+            trial = np.repeat(joint[np.newaxis], len(ants), axis=0)
+            trial[np.arange(len(ants)), :, ants] = preferred[ants, 
+                                                             np.newaxis]
+            values = self.score(trial.reshape(-1, len(mine))).reshape(
+                                    len(ants), len(joint)).min(axis=1)
+            k = values.argmax()
+            if values[k] < best:
+                break
+            hopeful[ants] = values >= best
+            best = values[k]
+            joint = trial[k]
+        return joint[0]
+
+    def setup(self, moves, owners, mine):
+        'tables of opponents in range and shared squares, per move pair'
+        n = len(owners)
+        rows, cols = self.dimensions
+        self.mine = np.asarray(mine, dtype=bool)
+        self.valid = moves[:,:,0] >= 0
+        self.cells = np.where(self.valid,
+                              moves[:,:,0] * cols + moves[:,:,1], -1)
+        dest_r = moves[:,:,0].ravel()
+        dest_c = moves[:,:,1].ravel()
+        d_r = np.abs(dest_r[:,np.newaxis] - dest_r)
+        d_c = np.abs(dest_c[:,np.newaxis] - dest_c)
+        d_r = np.minimum(d_r, rows - d_r)
+        d_c = np.minimum(d_c, cols - d_c)
+        owner = np.repeat(owners, MOVES)
+        ant = np.repeat(np.arange(n), MOVES)
+        valid = self.valid.ravel()
+        both = valid[:,np.newaxis] & valid
+        self.in_range = (both & (owner[:,np.newaxis] != owner) &
+                         (d_r * d_r + d_c * d_c <= self.attackradius2))
+        cells = self.cells.ravel()
+        # squares per move, a different one for each move not made
+        self.squares = np.where(valid, cells, -1 - np.arange(len(cells)))
+        self.collide = (both & (ant[:,np.newaxis] != ant) &
+                        (cells[:,np.newaxis] == cells))
+        # a move only changes the score through these
+        self.contact = self.in_range | self.collide
+        self.base = np.arange(n) * MOVES
+        self.steps = np.arange(MOVES)[:,np.newaxis]
+
+    def score(self, choices):
+        'scores of joint moves; choices is a (k, n) array of move indices'
+        self.evaluated += len(choices)
+        index = self.base + choices
+        k, n = index.shape
+        each = np.arange(k)[:,np.newaxis]
+        # ants sharing a square die: neighbours once sorted by square
+        cells = self.squares[index]
+        order = cells.argsort(axis=1)
+        cells = cells[each, order]
+        shared = np.zeros((k, n + 1), dtype=bool)
+        shared[:,1:-1] = cells[:,1:] == cells[:,:-1]
+        alive = np.empty((k, n), dtype=bool)
+        alive[each, order] = ~(shared[:,1:] | shared[:,:-1])
+        opponents = self.in_range.take(index[:,:,np.newaxis] * 
+                                       self.in_range.shape[1] + 
+                                       index[:,np.newaxis,:])
+        opponents &= alive[:,:,np.newaxis]
+        opponents &= alive[:,np.newaxis,:]
+        weakness = opponents.view(np.uint8).sum(axis=2, dtype=np.uint8)
+        # focus: an opponent in range with no more opponents than it
+        dead = (opponents & (weakness[:,np.newaxis,:] <= 
+                             weakness[:,:,np.newaxis])).any(axis=2)
+        dead |= ~alive
+        return ((dead & ~self.mine).sum(axis=1) -
+                self.loss_weight * (dead & self.mine).sum(axis=1))
+
+    def improve(self, choice, others, side, maximise):
+        """
+        Improve the moves of the ants in side for the worst score over
+        others (moves for the rest of the ants): the lowest if
+        maximising, else the highest. Each pass tries every ant of the
+        side taking the same step (where it can), until that first
+        fails for the side, then ants alone: the moves of all ants are
+        scored in one batch and the best taken, each ant moving at most
+        once a pass. Alone, ants of a side never take the same square,
+        and only try moves that change which ants they are in range of
+        or share a square with (no other move can change the score).
+        Returns the new choice (so far, past the deadline).
+        """
+        sign = 1 if maximise else -1
+        joint = np.where(side, choice, others)
+        best = (sign * self.score(joint)).min()
+        ants = np.flatnonzero(side)
+        rows = self.base[ants,np.newaxis] + self.steps.T
+        together = True
+        for sweep in xrange(SWEEPS):
+            improved = False
+            # the whole side steps together: a lone step may only trade
+            if together:
+                steps = np.where(side & self.valid.T, 
+                                 np.arange(MOVES)[:,np.newaxis], joint[0])
+                trial = np.repeat(joint, MOVES, axis=0)
+                trial[:] = np.where(side, np.tile(steps, (len(joint), 1)),
+                                    trial)
+                values = (sign * self.score(trial)).reshape(
+                                    len(joint), MOVES).min(axis=0)
+                k = values.argmax()
+                if values[k] > best:
+                    best = values[k]
+                    joint[:] = np.where(side, steps[k], joint)
+                    improved = True
+                else:
+                    # gone quiet: from now on ants move alone
+                    together = False
+            moved = np.zeros(len(ants), dtype=bool)
+            # after the first batch, only moves that beat best so far
+            hopeful = np.ones((len(ants), MOVES), dtype=bool)
+            while not self.out_of_time():
+                current = joint[0, ants]
+                # contacts of each move of each ant with the others' moves
+                contact = self.contact[rows[:,:,np.newaxis], 
+                                       (self.base + joint).ravel()]
+                changes = (contact != contact[np.arange(len(ants)), 
+                                              current][:,np.newaxis]
+                           ).any(axis=2)
+                # squares taken by the rest of this side
+                cells = self.cells[ants, current]
+                taken = ((self.cells[ants][:,:,np.newaxis] == cells) &
+                         (ants[:,np.newaxis] != ants)[:,np.newaxis,:]
+                         ).any(axis=2)
+                candidates = (changes & self.valid[ants] & ~taken & 
+                              ~moved[:,np.newaxis] & hopeful)
+                ant, move = np.nonzero(candidates)
+                if not len(ant):
+                    break
+                trial = np.repeat(joint[np.newaxis], len(ant), axis=0)
+                trial[np.arange(len(ant)), :, ants[ant]] = move[:,np.newaxis]
+                values = (sign * self.score(trial.reshape(-1, len(side)))
+                          ).reshape(len(ant), len(joint)).min(axis=1)
+                k = values.argmax()
+                if values[k] <= best:
+                    break
+                hopeful[:] = False
+                hopeful[ant, move] = values > best
+                best = values[k]
+                joint = trial[k]
+                moved[ant[k]] = True
+                improved = True
+            if not self.complete:
+                return joint[0]
+            if not improved:
+                break
+        return joint[0]
+
+# the 8 symmetries of the grid: (transpose, flip rows, flip columns)
+SYMMETRIES = [(transpose, flip_rows, flip_cols) for transpose in (False, True)
+              for flip_rows in (False, True) for flip_cols in (False, True)]
+
+class CombatCache(object):
+    """
+    Results of fights, by the local pattern of the fight: the positions
+    of its ants in their window, their owners (mine first, then enemies
+    in order of appearance) and a value for each of their moves (open
+    or not, say). Patterns that are rotations or reflections of each
+    other share one entry, kept as seen in a canonical orientation.
+
+    The least recently used entries go once there are more than size.
+    Entries are only good for the header they were made with (attack
+    radius and the like); a file saved with another header is ignored.
+
+    Usage:
+        cache = CombatCache(4096, header)
+        key, symmetry, order = cache.key(shape, local, owners, choices,
+                                         'plan')
+        found = cache.get(key)
+        if found is None:
+            plan = ... # move indices of the ants
+            cache.put(key, cache.moves_to_canonical(plan[order], symmetry))
+        else:
+            plan[order] = cache.moves_from_canonical(found, symmetry)
+    """
+    def __init__(self, size=4096, header=None):
+        self.size = size
+        self.header = header
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # move columns as seen after each symmetry: 
+        # canonical[:, k] = moves[:, columns[k]]
+        self.columns = np.zeros((len(SYMMETRIES), MOVES), dtype=int)
+        for s, symmetry in enumerate(SYMMETRIES):
+            for k, direction in enumerate(DIRECTIONS):
+                moved = self.transform_offset(AIM[direction], symmetry)
+                self.columns[s, DIRECTIONS.index(OFFSETS[moved]) + 1] = k + 1
+        self.inverse = self.columns.argsort(axis=1)
+        self.symmetries = np.array(SYMMETRIES).T
+
+    @staticmethod
+    def transform_offset(offset, symmetry):
+        transpose, flip_rows, flip_cols = symmetry
+        d_r, d_c = offset
+        if transpose:
+            d_r, d_c = d_c, d_r
+        return (-d_r if flip_rows else d_r, -d_c if flip_cols else d_c)
+
+    def key(self, shape, local, owners, moves, kind=''):
+        """
+        Canonical key of a fight in a window of shape, with its ants at
+        local (n, 2) positions in it; moves is an (n, MOVES) array of
+        small integers. Returns the key (starting with kind), the
+        symmetry that turns the window into the canonical one and the
+        order of the ants in it. All symmetries are worked out at once,
+        one row each.
+        """
+        transpose, flip_rows, flip_cols = self.symmetries
+        height, width = shape
+        heights = np.where(transpose, width, height)
+        widths = np.where(transpose, height, width)
+        rows = np.where(transpose[:,np.newaxis], local[:,1], local[:,0])
+        cols = np.where(transpose[:,np.newaxis], local[:,0], local[:,1])
+        rows = np.where(flip_rows[:,np.newaxis], 
+                        heights[:,np.newaxis] - 1 - rows, rows)
+        cols = np.where(flip_cols[:,np.newaxis], 
+                        widths[:,np.newaxis] - 1 - cols, cols)
+        # ants are on different squares: no ties
+        order = np.argsort(rows * max(height, width) + cols, axis=1)
+        each = np.arange(len(SYMMETRIES))[:,np.newaxis]
+        rows = rows[each, order]
+        cols = cols[each, order]
+        sorted_owners = owners[order]
+        # mine stay 0, enemies are numbered as they come
+        players = np.arange(10)
+        seen = sorted_owners[:,:,np.newaxis] == players
+        first = np.where(seen.any(axis=1), seen.argmax(axis=1), len(owners))
+        first[:,ME] = len(owners)
+        rank = (first[:,np.newaxis,:] < first[:,:,np.newaxis]).sum(axis=2) + 1
+        rank[:,ME] = 0
+        labels = rank[each, sorted_owners]
+        moves = moves[order][each[:,:,np.newaxis], 
+                             np.arange(len(owners))[:,np.newaxis],
+                             self.columns[:,np.newaxis,:]]
+        keys = np.column_stack((heights, widths, rows, cols, labels,
+                                moves.reshape(len(SYMMETRIES), -1))
+                               ).astype(np.int16)
+        # any fixed choice among the 8 will do
+        strings = [key.tostring() for key in keys]
+        k = strings.index(min(strings))
+        return kind + strings[k], SYMMETRIES[k], order[k]
+
+    def moves_to_canonical(self, moves, symmetry):
+        'move indices as seen after symmetry'
+        return self.inverse[SYMMETRIES.index(symmetry)][moves]
+
+    def moves_from_canonical(self, moves, symmetry):
+        return self.columns[SYMMETRIES.index(symmetry)][moves]
+
+    def get(self, key):
+        'the value for key, now the most recently used, or None'
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def load(self, filename):
+        'entries saved by save() with the same header; False if none'
+        try:
+            with open(filename, 'rb') as f:
+                header, entries = cPickle.load(f)
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            return False
+        if header != self.header:
+            return False
+        for key, value in entries[-self.size:]:
+            self.put(key, value)
+        return True
+
+    def save(self, filename):
+        'write the entries, oldest first, replacing filename at once'
+        temp = filename + '.tmp'
+        with open(temp, 'wb') as f:
+            cPickle.dump((self.header, self.entries.items()), f, 
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp, filename)
@@ -0,0 +1,847 @@
+#!/usr/bin/env python
+
+"""proj/diffusion.py
+v1.12
+- DiffusionField.restart(result, previous, gain) moves the prepared
+  start by gain * (result - previous) instead of replacing it, so this
+  turn's decay and added sources stay in it; iterations are left to
+  the caller
+v1.11
+- DiffusionField.update back, for a field carried over between turns
+  (the persistent explore scent): only tiles marked changed by the
+  caller, with changed clamps or stencil, or still changing at the end
+  of the last update are stepped, plus a halo
+  - tiles are bands of TILE rows across the map, stepped in place by
+    band_step; gathering square tiles (v1.4) cost more than a full step
+- TileGrid: the bands, and runs of active ones
+v1.10
+- gain_step: a step as loss * scent + gain * (sum of the four
+  neighbours), 10 passes over the field instead of 13; blocked squares
+  hold no scent during a run, and clamps on them are set at its end
+  (blocked_clamps)
+- DiffusionStack stacks loss and gain only (STACK_ARRAYS 5), so more
+  channels fit in STACK_CACHE
+v1.9
+- DiffusionField.update and TileGrid dropped: no bot called them, and
+  the food and attack scents decay everywhere each turn (U_DECAY,
+  A_DECAY), so none of their tiles could rest
+v1.8
+- DiffusionStack groups channels by the bytes a step works on
+  (STACK_CACHE, so float32 stacks twice as many squares) instead of a
+  square count
+v1.7
+- DiffusionField.restart: new start field and iteration count for a
+  prepared run (clamps and scaling kept)
+v1.6
+- dtype for DiffusionField and DiffusionStack (float32 halves the
+  bytes moved per step)
+v1.5
+- DiffusionField.cascade: coarse-to-fine start field for long-range
+  runs; the run is done on grids of 2x2 blocks, then prolonged
+  - coarse stencils from the fine edge conductances, so water stays
+    exact and the coarse grid wraps like the map
+v1.4
+- DiffusionField.update: tiled run that only steps the tiles still
+  changing (plus a halo), for fields carried over between turns
+- TileGrid: tile split and flat neighbour indices
+v1.3
+- runs stop early on convergence (residual <= tolerance, checked every
+  CHECK_EVERY steps) or at a time.time() deadline
+  - ran / residual record the last run for logging
+v1.2
+- DiffusionStack: several channels stepped together in a (k, rows, cols)
+  array; channels drop out as their iteration counts run out
+- stencil_step: the in-place kernel, for 2d fields and stacks
+- DiffusionField.prepare: set up a run for DiffusionStack
+v1.1
+- step() works in place: double-buffered scent, wrapped slice views and
+  ufunc out= arithmetic; clamp/scale indices flattened once per run
+v1.0
+- DiffusionField: scent diffusion with a cached 5-point stencil
+  - stencil coefficients kept between turns; only squares next to a
+    change in the unblocked mask are recomputed
+  - step(n) / run(sources, clamps, iterations, scaling)
+"""
+
+import time
+
+import numpy as np
+
+# a patch touching more than this fraction of the map rebuilds instead
+REBUILD_FRACTION = 0.25
+# bytes of arrays DiffusionStack steps together: a step works on scent,
+# new scent, term, loss and gain (STACK_ARRAYS) per square, and runs
+# fastest while they stay in cache (L2). A channel on its own is stepped
+# with DiffusionField.step: it stays in cache across all its steps.
+STACK_CACHE = 2 * 1024 * 1024
+STACK_ARRAYS = 5
+# iterations between residual and deadline checks
+CHECK_EVERY = 5
+# steps on each intermediate grid of a cascade
+SMOOTH = 10
+# rows of the tiles (bands across the map) DiffusionField.update steps;
+# at least CHECK_EVERY so change can not cross a halo tile between two
+# checks
+TILE = 8
+
+def stencil_step(scent_field, new_field, term, stencil):
+    """
+    One diffusion step from scent_field into new_field, allocating
+    nothing. All arrays are contiguous with shape (..., rows, cols); term
+    is scratch. stencil is (loss, diff_n, diff_s, diff_w, diff_e).
+    """
+    loss, diff_n, diff_s, diff_w, diff_e = stencil
+    cols = scent_field.shape[-1]
+    # neighbour terms are products of flat views shifted by one row
+    # (n, s) or one square (w, e); the squares that wrap around are
+    # then corrected through small views
+    scent_flat = scent_field.ravel()
+    term_flat = term.ravel()
+    np.multiply(loss, scent_field, out=new_field)
+    # from n: row r receives row r-1
+    np.multiply(diff_n.ravel()[cols:], scent_flat[:-cols], 
+                out=term_flat[cols:])
+    np.multiply(diff_n[...,0,:], scent_field[...,-1,:], out=term[...,0,:])
+    np.add(new_field, term, out=new_field)
+    # from s: row r receives row r+1
+    np.multiply(diff_s.ravel()[:-cols], scent_flat[cols:], 
+                out=term_flat[:-cols])
+    np.multiply(diff_s[...,-1,:], scent_field[...,0,:], out=term[...,-1,:])
+    np.add(new_field, term, out=new_field)
+    # from w: square c receives c-1
+    np.multiply(diff_w.ravel()[1:], scent_flat[:-1], out=term_flat[1:])
+    np.multiply(diff_w[...,0], scent_field[...,-1], out=term[...,0])
+    np.add(new_field, term, out=new_field)
+    # from e: square c receives c+1
+    np.multiply(diff_e.ravel()[:-1], scent_flat[1:], out=term_flat[:-1])
+    np.multiply(diff_e[...,-1], scent_field[...,0], out=term[...,-1])
+    np.add(new_field, term, out=new_field)
+
+def band_step(scent_field, new_field, term, loss, gain, top, bottom):
+    """
+    gain_step for rows top:bottom of a 2d field (into the same rows of
+    new_field); the rows next to them are read, wrapping at the map
+    edges.
+    """
+    rows, cols = scent_field.shape
+    scent_flat = scent_field.ravel()
+    new_flat = new_field.ravel()
+    term_flat = term.ravel()
+    # n + s: rows inside the map edges from flat shifts, edge rows wrap
+    inner_top, inner_bottom = max(top, 1), min(bottom, rows - 1)
+    if inner_top < inner_bottom:
+        np.add(scent_flat[(inner_top-1)*cols:(inner_bottom-1)*cols],
+               scent_flat[(inner_top+1)*cols:(inner_bottom+1)*cols],
+               out=new_flat[inner_top*cols:inner_bottom*cols])
+    if top == 0:
+        np.add(scent_field[-1], scent_field[1], out=new_field[0])
+    if bottom == rows:
+        np.add(scent_field[-2], scent_field[0], out=new_field[-1])
+    # w + e: flat shifts, first and last columns wrap
+    start, end = top * cols, bottom * cols
+    np.add(scent_flat[start:end-2], scent_flat[start+2:end], 
+           out=term_flat[start+1:end-1])
+    band, band_term = scent_field[top:bottom], term[top:bottom]
+    np.add(band[:,-1], band[:,1], out=band_term[:,0])
+    np.add(band[:,-2], band[:,0], out=band_term[:,-1])
+    new = new_flat[start:end]
+    np.add(new, term_flat[start:end], out=new)
+    np.multiply(new, gain.ravel()[start:end], out=new)
+    np.multiply(loss.ravel()[start:end], scent_flat[start:end], 
+                out=term_flat[start:end])
+    np.add(new, term_flat[start:end], out=new)
+
+def gain_step(scent_field, new_field, term, loss, gain):
+    """
+    stencil_step for a stencil in which every open edge carries the
+    same factor: new = loss * scent + gain * (n + s + w + e), with gain
+    factor on unblocked squares and 0 on blocked ones, which must hold
+    no scent. Same shapes as stencil_step.
+    """
+    cols = scent_field.shape[-1]
+    scent_flat = scent_field.ravel()
+    term_flat = term.ravel()
+    # n + s into new_field: row r gets rows r-1 and r+1; first and last
+    # rows wrap
+    np.add(scent_flat[:-2*cols], scent_flat[2*cols:],
+           out=new_field.ravel()[cols:-cols])
+    np.add(scent_field[...,-1,:], scent_field[...,1,:],
+           out=new_field[...,0,:])
+    np.add(scent_field[...,-2,:], scent_field[...,0,:],
+           out=new_field[...,-1,:])
+    # w + e into term: square c gets c-1 and c+1; first and last columns
+    # wrap
+    np.add(scent_flat[:-2], scent_flat[2:], out=term_flat[1:-1])
+    np.add(scent_field[...,-1], scent_field[...,1], out=term[...,0])
+    np.add(scent_field[...,-2], scent_field[...,0], out=term[...,-1])
+    np.add(new_field, term, out=new_field)
+    np.multiply(new_field, gain, out=new_field)
+    np.multiply(loss, scent_field, out=term)
+    np.add(new_field, term, out=new_field)
+
+class DiffusionField(object):
+    """
+    Diffusion over a wrapped grid in which blocked squares neither send
+    nor receive scent.
+
+    Each step every unblocked square keeps (1 - factor * open neighbours)
+    of its scent and gains factor * scent of each unblocked neighbour.
+
+    Usage:
+        field = DiffusionField(ants.dimensions, 0.2)
+        # once per turn; version lets unchanged masks skip the compare
+        field.set_unblocked(ants.passable_field, ants.passable_version)
+        scent = field.run(0.95 * scent, (clamp_index, clamp_values), 60)
+        log.info("%s iterations, residual %s", field.ran, field.residual)
+    """
+    def __init__(self, dimensions, factor, dtype=np.float64):
+        self.dimensions = dimensions
+        self.factor = factor
+        self.dtype = dtype # of the stencil and scent fields
+        self.unblocked = None # copy of the mask the stencil was built for
+        self.version = None
+        self.stencil_version = 0 # bumped on every stencil change
+        # stencil coefficients
+        self.loss = np.ones(dimensions, dtype=dtype)
+        self.diff_n = np.zeros(dimensions, dtype=dtype)
+        self.diff_s = np.zeros(dimensions, dtype=dtype)
+        self.diff_w = np.zeros(dimensions, dtype=dtype)
+        self.diff_e = np.zeros(dimensions, dtype=dtype)
+        # factor on unblocked squares: with loss, the whole stencil for
+        # gain_step (None on coarse grids, whose edges differ)
+        self.gain = np.zeros(dimensions, dtype=dtype)
+        # scent double buffer and a scratch field for one stencil term
+        self.scent = np.zeros(dimensions, dtype=dtype)
+        self.new_scent = np.zeros(dimensions, dtype=dtype)
+        self.term = np.zeros(dimensions, dtype=dtype)
+        self.clamps = None # (flat index, values)
+        # the clamps on unblocked squares, set before every step, and on
+        # blocked ones, set at the end of a run
+        self.open_clamps = None
+        self.blocked_clamps = None
+        self.scaling = None # (flat index, scratch); factor in self.scale
+        self.scale = 1.0
+        self.iterations = 0 # most iterations for the prepared run
+        self.tolerance = None
+        # last run: iterations done and final residual (largest change of
+        # an unclamped square in the last step)
+        self.ran = 0
+        self.residual = None
+        # update(): the tile split, squares whose stencil changed since
+        # the last update, its clamps (mask and values), the tiles still
+        # changing at its end, and the tile steps it took
+        self.tiles = None
+        self.stencil_dirty = np.ones(dimensions, dtype=bool)
+        self.tile_clamps = None
+        self.restless = None
+        self.stepped = 0
+        # cascade(): the 2x2 block grid, its index for every square and
+        # the stencil_version it was restricted from
+        self.coarse = None
+        self.coarse_index = None
+        self.coarse_version = None
+
+    def set_unblocked(self, unblocked, version=None):
+        """
+        Bring the stencil up to date with the unblocked mask. With a
+        version equal to the last one given, the mask is assumed
+        unchanged.
+        """
+        if version is not None and version == self.version:
+            return
+        self.version = version
+        if self.unblocked is None:
+            self.unblocked = unblocked.copy()
+            self.build()
+            return
+        changed = np.flatnonzero(unblocked != self.unblocked)
+        if not len(changed):
+            return
+        self.unblocked[...] = unblocked
+        if 5 * len(changed) > REBUILD_FRACTION * self.unblocked.size:
+            self.build()
+        else:
+            self.patch(changed)
+
+    def build(self):
+        'compute the whole stencil from self.unblocked'
+        unblocked = self.unblocked
+        factor = self.factor
+        unblocked_n = np.roll(unblocked, 1, axis=0) & unblocked
+        unblocked_s = np.roll(unblocked,-1, axis=0) & unblocked
+        unblocked_w = np.roll(unblocked, 1, axis=1) & unblocked
+        unblocked_e = np.roll(unblocked,-1, axis=1) & unblocked
+        adj_field = (unblocked_n.astype(np.int8) + unblocked_s +
+                     unblocked_w + unblocked_e)
+        self.loss[...] = 1 - (factor * adj_field)
+        self.diff_n[...] = factor * unblocked_n
+        self.diff_s[...] = factor * unblocked_s
+        self.diff_w[...] = factor * unblocked_w
+        self.diff_e[...] = factor * unblocked_e
+        self.gain[...] = factor * unblocked
+        self.stencil_version += 1
+        self.stencil_dirty.fill(True)
+
+    def patch(self, changed):
+        'recompute the stencil at changed flat indices and their neighbours'
+        rows, cols = self.dimensions
+        r, c = changed // cols, changed % cols
+        r = np.concatenate((r, (r-1) % rows, (r+1) % rows, r, r))
+        c = np.concatenate((c, c, c, (c-1) % cols, (c+1) % cols))
+        cells = np.unique(r * cols + c)
+        r, c = cells // cols, cells % cols
+        unblocked = self.unblocked
+        factor = self.factor
+        here = unblocked[r, c]
+        unblocked_n = unblocked[(r-1) % rows, c] & here
+        unblocked_s = unblocked[(r+1) % rows, c] & here
+        unblocked_w = unblocked[r, (c-1) % cols] & here
+        unblocked_e = unblocked[r, (c+1) % cols] & here
+        adj_field = (unblocked_n.astype(np.int8) + unblocked_s +
+                     unblocked_w + unblocked_e)
+        self.loss[r, c] = 1 - (factor * adj_field)
+        self.diff_n[r, c] = factor * unblocked_n
+        self.diff_s[r, c] = factor * unblocked_s
+        self.diff_w[r, c] = factor * unblocked_w
+        self.diff_e[r, c] = factor * unblocked_e
+        self.gain[r, c] = factor * here
+        self.stencil_version += 1
+        self.stencil_dirty[r, c] = True
+
+    def step(self, n=1, tolerance=None, deadline=None):
+        """
+        Run up to n diffusion steps on self.scent. Clamped squares are
+        reset before each step; scaling is applied after it.
+
+        Every CHECK_EVERY steps, stops early once the residual is at most
+        tolerance or time.time() is past deadline. Sets self.ran and
+        self.residual.
+
+        Works in place on two preallocated buffers: nothing is allocated
+        inside the loop. Returns self.scent, which later steps overwrite.
+        """
+        stencil = (self.loss, self.diff_n, self.diff_s, 
+                   self.diff_w, self.diff_e)
+        self.ran = 0
+        self.residual = None
+        for diffusion in xrange(n):
+            scent_field = self.scent
+            new_field = self.new_scent
+            # source blocks
+            if self.open_clamps is not None:
+                clamp_index, clamp_values = self.open_clamps
+                scent_field.ravel().put(clamp_index, clamp_values)
+            # build new scents
+            if self.gain is not None:
+                gain_step(scent_field, new_field, self.term, self.loss,
+                          self.gain)
+            else:
+                stencil_step(scent_field, new_field, self.term, stencil)
+            if self.scaling is not None:
+                scale_index, scaled = self.scaling
+                flat = new_field.ravel()
+                flat.take(scale_index, out=scaled)
+                np.multiply(scaled, self.scale, out=scaled)
+                flat.put(scale_index, scaled)
+            self.scent, self.new_scent = new_field, scent_field
+            self.ran += 1
+            if self.ran % CHECK_EVERY == 0:
+                if tolerance is not None:
+                    self.residual = self.change()
+                    if self.residual <= tolerance:
+                        break
+                if deadline is not None and time.time() > deadline:
+                    break
+        if self.ran and (tolerance is None or self.ran % CHECK_EVERY):
+            self.residual = self.change()
+        self.set_blocked_clamps()
+        return self.scent
+
+    def set_blocked_clamps(self):
+        'set the clamped blocked squares, which take no part in steps'
+        if self.blocked_clamps is not None:
+            self.scent.ravel().put(*self.blocked_clamps)
+
+    def change(self):
+        'largest change of an unclamped square in the last step'
+        term = self.term
+        np.subtract(self.scent, self.new_scent, out=term)
+        np.abs(term, out=term)
+        if self.clamps is not None:
+            term.ravel().put(self.clamps[0], 0.0)
+        return float(term.max())
+
+    def update(self, sources, changed, clamps=None, iterations=1,
+               tolerance=1e-3, deadline=None):
+        """
+        Like run() without scaling, for a field carried over from the
+        last update: only the tiles still changing are stepped, each with
+        a halo of one tile. Tiles are bands of TILE rows across the map,
+        so the stepped rows are a few contiguous runs (see band_step).
+
+        A tile starts active if changed (a bool field: where sources
+        differ from the last result) holds in it, its clamps or stencil
+        changed since the last update, or it was still changing at the
+        end of it. Every CHECK_EVERY steps, tiles whose largest change in
+        the last step is at most tolerance rest and halo tiles that
+        changed more join; the run ends when every tile rests. Squares
+        outside the stepped tiles keep their values. Sets self.stepped
+        to the tile steps taken (a full run() is tiles.count per step).
+        """
+        if self.tiles is None:
+            self.tiles = TileGrid(self.dimensions, TILE)
+        tiles = self.tiles
+        self.prepare(sources, clamps, iterations, tolerance=tolerance)
+
+        # where things changed since the last update
+        clamped = np.zeros(self.dimensions, dtype=bool)
+        clamp_values = np.zeros(self.dimensions, dtype=self.dtype)
+        if self.clamps is not None:
+            clamp_index, values = self.clamps
+            clamped.ravel()[clamp_index] = True
+            clamp_values.ravel()[clamp_index] = values
+        changed = changed | self.stencil_dirty
+        if self.tile_clamps is not None:
+            old_clamped, old_values = self.tile_clamps
+            changed |= clamped != old_clamped
+            changed |= clamped & (clamp_values != old_values)
+        self.stencil_dirty.fill(False)
+        self.tile_clamps = (clamped, clamp_values)
+        active = tiles.any(changed)
+        if self.restless is not None:
+            active |= self.restless
+
+        # rows outside the stepped ones are the same in both buffers
+        if self.open_clamps is not None:
+            self.scent.ravel().put(*self.open_clamps)
+        self.new_scent[...] = self.scent
+        term = self.term
+        self.ran = 0
+        self.residual = None
+        self.stepped = 0
+        region = tiles.dilate(active)
+        while self.ran < iterations and active.any():
+            # stepped rows: runs of active tiles and their halo
+            runs = tiles.runs(region)
+            tiles_stepped = int(region.sum())
+            for check in xrange(min(CHECK_EVERY, iterations - self.ran)):
+                scent_field = self.scent
+                new_field = self.new_scent
+                # source blocks
+                if self.open_clamps is not None:
+                    scent_field.ravel().put(*self.open_clamps)
+                # build new scents
+                for top, bottom in runs:
+                    band_step(scent_field, new_field, term, self.loss,
+                              self.gain, top, bottom)
+                self.scent, self.new_scent = new_field, scent_field
+                self.ran += 1
+                self.stepped += tiles_stepped
+            # tiles still changing stay active
+            row_change = np.zeros(len(term))
+            for top, bottom in runs:
+                change = term[top:bottom]
+                np.subtract(self.scent[top:bottom], 
+                            self.new_scent[top:bottom], out=change)
+                np.abs(change, out=change)
+                change[clamped[top:bottom]] = 0.0
+                row_change[top:bottom] = change.max(axis=1)
+            tile_change = tiles.reduce(row_change)
+            self.residual = float(tile_change.max())
+            active = region & (tile_change > tolerance)
+            # rows leaving the stepped ones: the other buffer catches up
+            stepped = region
+            region = tiles.dilate(active)
+            for top, bottom in tiles.runs(stepped & ~region):
+                self.new_scent[top:bottom] = self.scent[top:bottom]
+            if deadline is not None and time.time() > deadline:
+                break
+        self.restless = active
+        self.set_blocked_clamps()
+        return self.scent.copy()
+
+    def cascade(self, sources, clamps=None, iterations=1, scaling=None,
+                levels=1):
+        """
+        Start field for a long-range run. The run (arguments as for
+        run()) is done levels grids down, where squares are 2**levels
+        wide: a coarse step spreads scent as far as 4 fine ones, so
+        iterations // 4**levels steps stand for iterations. The result
+        is prolonged back up with SMOOTH steps on each grid in between.
+
+        Returns a fine field with the long-range gradients but blocky
+        detail; a few run() steps from it restore the local shape. Blocks
+        are taken as open inside and clamps as covering their block, so
+        each level blurs narrow mazes and raises the scent further; one
+        level is usually enough.
+        """
+        coarse = self.coarsen()
+        coarse_sources = self.restrict(sources)
+        coarse_clamps = None
+        if clamps is not None:
+            coarse_clamps = self.restrict_index(*clamps)
+        coarse_scaling = None
+        if scaling is not None:
+            scale_index, scale = scaling
+            coarse_scaling = (self.restrict_index(scale_index)[0], scale)
+        if levels > 1:
+            coarse_sources = coarse.cascade(coarse_sources, coarse_clamps,
+                                            iterations // 4, coarse_scaling,
+                                            levels - 1)
+            steps = SMOOTH
+        else:
+            steps = max(iterations // 4, 1)
+        coarse_field = coarse.run(coarse_sources, coarse_clamps, steps,
+                                  coarse_scaling)
+        return self.prolong(coarse_field)
+
+    def coarsen(self):
+        """
+        The DiffusionField on the grid of 2x2 blocks (the last row or
+        column of blocks is 1 square high or wide on odd maps), brought
+        up to date with this stencil.
+
+        A block is unblocked if any square in it is. The coefficient
+        between two blocks is the mean of the fine coefficients across
+        their shared edge, so blocks only exchange scent where open
+        squares touch, and walls of any thickness stay closed.
+        """
+        rows, cols = self.dimensions
+        if self.coarse is None:
+            coarse_rows, coarse_cols = (rows + 1) // 2, (cols + 1) // 2
+            self.coarse = DiffusionField((coarse_rows, coarse_cols), 
+                                         self.factor, self.dtype)
+            self.coarse.gain = None
+            r, c = np.indices(self.dimensions)
+            self.coarse_index = ((r // 2) * coarse_cols + c // 2).ravel()
+        if self.coarse_version == self.stencil_version:
+            return self.coarse
+        self.coarse_version = self.stencil_version
+        coarse = self.coarse
+        coarse_rows, coarse_cols = coarse.dimensions
+        blocks = np.arange(coarse_rows)
+        top, bottom = 2 * blocks, np.minimum(2 * blocks + 1, rows - 1)
+        blocks = np.arange(coarse_cols)
+        left, right = 2 * blocks, np.minimum(2 * blocks + 1, cols - 1)
+        # mean over the (1 or 2) fine squares along each block edge
+        row_width = (bottom - top + 1).astype(float)
+        col_width = (right - left + 1).astype(float)
+        coarse.diff_n[...] = np.add.reduceat(self.diff_n[top], left, 
+                                             axis=1) / col_width
+        coarse.diff_s[...] = np.add.reduceat(self.diff_s[bottom], left,
+                                             axis=1) / col_width
+        coarse.diff_w[...] = np.add.reduceat(self.diff_w[:, left], top,
+                                             axis=0) / row_width[:, None]
+        coarse.diff_e[...] = np.add.reduceat(self.diff_e[:, right], top,
+                                             axis=0) / row_width[:, None]
+        coarse.loss[...] = 1 - (coarse.diff_n + coarse.diff_s + 
+                                coarse.diff_w + coarse.diff_e)
+        open_count = np.bincount(self.coarse_index, 
+                                 self.unblocked.ravel().astype(float),
+                                 minlength=coarse.scent.size)
+        coarse.unblocked = (open_count > 0).reshape(coarse.dimensions)
+        coarse.stencil_version += 1
+        return coarse
+
+    def restrict(self, field):
+        'mean of field over the unblocked squares of each block'
+        weights = self.unblocked.ravel().astype(float)
+        size = self.coarse.scent.size
+        sums = np.bincount(self.coarse_index, weights * np.ravel(field),
+                           minlength=size)
+        counts = np.bincount(self.coarse_index, weights, minlength=size)
+        counts[counts == 0] = 1.0
+        return (sums / counts).reshape(self.coarse.dimensions)
+
+    def restrict_index(self, index, values=None):
+        """
+        Blocks holding an unblocked square of index, and the mean of
+        values over those squares; index and values as for run() clamps.
+        """
+        index = self.flat_index(index)
+        keep = self.unblocked.ravel()[index]
+        blocks = self.coarse_index[index[keep]]
+        coarse_index = np.unique(blocks)
+        if values is None:
+            return coarse_index, None
+        flat_values = np.empty(len(index))
+        flat_values[...] = np.ravel(values)
+        size = self.coarse.scent.size
+        sums = np.bincount(blocks, flat_values[keep], minlength=size)
+        counts = np.bincount(blocks, minlength=size)
+        return coarse_index, sums[coarse_index] / counts[coarse_index]
+
+    def prolong(self, coarse_field):
+        'fine field taking the value of its block (blocked squares zeroed)'
+        field = coarse_field.ravel()[self.coarse_index].reshape(
+                                                          self.dimensions)
+        field[~self.unblocked] = 0.0
+        return field
+
+    def prepare(self, sources, clamps=None, iterations=1, scaling=None,
+                tolerance=None):
+        """
+        Set up a run without stepping: scent = sources (blocked squares
+        zeroed), the rest as for run(). Used by DiffusionStack.
+        """
+        self.scent[...] = sources
+        self.scent[~self.unblocked] = 0.0
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.clamps = self.open_clamps = self.blocked_clamps = None
+        if clamps is not None:
+            clamp_index, values = clamps
+            clamp_index = self.flat_index(clamp_index)
+            clamp_values = np.empty(len(clamp_index), dtype=self.dtype)
+            clamp_values[...] = np.ravel(values)
+            self.clamps = (clamp_index, clamp_values)
+            blocked = ~self.unblocked.ravel()[clamp_index]
+            self.open_clamps = (clamp_index[~blocked], clamp_values[~blocked])
+            if blocked.any():
+                self.blocked_clamps = (clamp_index[blocked], 
+                                       clamp_values[blocked])
+        self.scaling = None
+        self.scale = 1.0
+        if scaling is not None:
+            scale_index, self.scale = scaling
+            scale_index = self.flat_index(scale_index)
+            self.scaling = (scale_index, 
+                            np.empty(len(scale_index), dtype=self.dtype))
+
+    def restart(self, result, previous, gain):
+        """
+        Correct a prepared start field made from the field previous
+        (scaled by gain, a number or a field, plus new sources) for the
+        better estimate result of that field; clamps, scaling and
+        iterations stay.
+        """
+        self.scent += gain * (result - previous)
+        self.scent[~self.unblocked] = 0.0
+
+    def run(self, sources, clamps=None, iterations=1, scaling=None,
+            tolerance=None, deadline=None):
+        """
+        Diffuse from the scent field sources (blocked squares zeroed).
+
+        clamps is (index, values): scent[index] = values before every
+        step. scaling is (index, factor): scent[index] *= factor after
+        every step. An index is a bool field, a (rows, cols) pair of
+        sequences, as made by zip(*locations), or a 1d array of flat
+        indices. At most iterations steps are run; see step() for
+        tolerance and deadline. Returns the new scent field (a copy).
+        """
+        self.prepare(sources, clamps, iterations, scaling, tolerance)
+        return self.step(iterations, tolerance, deadline).copy()
+
+    def flat_index(self, index):
+        'flat indices of a bool field, a (rows, cols) index or flat indices'
+        if isinstance(index, np.ndarray):
+            if index.dtype == bool:
+                return np.flatnonzero(index)
+            if index.ndim == 1:
+                return index
+        if len(index) == 0:
+            return np.empty(0, dtype=int)
+        rows, cols = index
+        return (np.asarray(rows, dtype=int) * self.dimensions[1] + 
+                np.asarray(cols, dtype=int))
+
+class DiffusionStack(object):
+    """
+    Steps several prepared DiffusionFields (channels) together in one
+    (k, rows, cols) array, each with its own stencil, clamps, scaling
+    and iteration count. Channels are ordered by iterations, longest
+    first, so the channels still running are always a leading slice.
+    Channels are stacked in groups whose arrays fit in STACK_CACHE; on
+    large maps that is one channel per group (plain step()).
+
+    All fields must have the stack's dtype and a gain (not coarse grids).
+
+    Usage:
+        stack = DiffusionStack(ants.dimensions)
+        u_field.prepare(sources, clamps, 60)
+        e_field.prepare(sources, clamps, 90)
+        u_scent, e_scent = stack.run([u_field, e_field])
+    """
+    def __init__(self, dimensions, dtype=np.float64):
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.channels = 0
+        self.stencil_ids = [] # (field id, stencil_version) per slot
+
+    def allocate(self, k):
+        shape = (k,) + tuple(self.dimensions)
+        self.loss = np.zeros(shape, dtype=self.dtype)
+        self.gain = np.zeros(shape, dtype=self.dtype)
+        self.scent = np.zeros(shape, dtype=self.dtype)
+        self.new_scent = np.zeros(shape, dtype=self.dtype)
+        self.term = np.zeros(shape, dtype=self.dtype)
+        self.channels = k
+        self.stencil_ids = [None] * k
+
+    def run(self, fields, deadline=None):
+        """
+        Diffuse all fields (set up with DiffusionField.prepare), each
+        until its iterations run out or its residual reaches its
+        tolerance; everything stops once time.time() passes deadline.
+        Returns their new scent fields (copies), in the order given.
+        """
+        if not fields:
+            return []
+        order = sorted(fields, key=lambda f: -f.iterations)
+        field_bytes = STACK_ARRAYS * fields[0].scent.nbytes
+        group = max(1, STACK_CACHE // field_bytes)
+        for start in xrange(0, len(order), group):
+            channels = order[start:start+group]
+            if len(channels) == 1:
+                field = channels[0]
+                field.step(field.iterations, field.tolerance, deadline)
+            else:
+                self.run_stacked(channels, deadline)
+        return [field.scent.copy() for field in fields]
+
+    def run_stacked(self, order, deadline=None):
+        """Step the fields of order (longest run first) together; each
+        result is left in its field.scent."""
+        k = len(order)
+        if k > self.channels:
+            self.allocate(k)
+        size = self.scent[0].size
+        clamp_index, clamp_values, clamp_ends = [], [], []
+        scale_index, scale_factors, scale_ends = [], [], []
+        clamp_end = scale_end = 0
+        for slot, field in enumerate(order):
+            stencil_id = (id(field), field.stencil_version)
+            if self.stencil_ids[slot] != stencil_id:
+                self.loss[slot] = field.loss
+                self.gain[slot] = field.gain
+                self.stencil_ids[slot] = stencil_id
+            self.scent[slot] = field.scent
+            if field.open_clamps is not None:
+                index, values = field.open_clamps
+                clamp_index.append(index + slot * size)
+                clamp_values.append(values)
+                clamp_end += len(index)
+            clamp_ends.append(clamp_end)
+            if field.scaling is not None:
+                index, scaled = field.scaling
+                scale_index.append(index + slot * size)
+                scale_factors.append(np.repeat(field.scale, len(index)))
+                scale_end += len(index)
+            scale_ends.append(scale_end)
+            field.residual = None
+        clamp_index = np.concatenate(clamp_index or [[]]).astype(int)
+        clamp_values = np.concatenate(clamp_values or [[]]).astype(self.dtype)
+        scale_index = np.concatenate(scale_index or [[]]).astype(int)
+        scale_factors = np.concatenate(scale_factors or [[]]).astype(
+                                                                self.dtype)
+        scaled = np.empty(len(scale_index), dtype=self.dtype)
+        tolerances = [field.tolerance for field in order]
+        checked = any(tolerance is not None for tolerance in tolerances)
+
+        buffers = (self.scent, self.new_scent)
+        result_buffer = [None] * k # buffer holding each result
+        ran = [None] * k # steps of each channel, once it stopped
+        converged = [False] * k # result already copied out
+        current = 0
+        active = k
+        steps = 0
+        for diffusion in xrange(order[0].iterations):
+            if (order[active-1].iterations <= diffusion or 
+                    converged[active-1]):
+                while (active and (order[active-1].iterations <= diffusion
+                                   or converged[active-1])):
+                    active -= 1
+                    if not converged[active]:
+                        result_buffer[active] = current
+                        ran[active] = diffusion
+                if not active:
+                    break
+            scent_field = buffers[current][:active]
+            new_field = buffers[1-current][:active]
+            # source blocks
+            end = clamp_ends[active-1]
+            scent_field.ravel().put(clamp_index[:end], clamp_values[:end])
+            # build new scents
+            gain_step(scent_field, new_field, self.term[:active],
+                      self.loss[:active], self.gain[:active])
+            end = scale_ends[active-1]
+            if end:
+                flat = new_field.ravel()
+                flat.take(scale_index[:end], out=scaled[:end])
+                np.multiply(scaled[:end], scale_factors[:end], 
+                            out=scaled[:end])
+                flat.put(scale_index[:end], scaled[:end])
+            current = 1 - current
+            steps = diffusion + 1
+            if steps % CHECK_EVERY == 0:
+                if checked:
+                    residuals = self.change(active, new_field, scent_field,
+                                            clamp_index[:clamp_ends[active-1]])
+                    for slot in xrange(active):
+                        field = order[slot]
+                        if converged[slot]:
+                            continue
+                        field.residual = residuals[slot]
+                        if (tolerances[slot] is not None and 
+                                residuals[slot] <= tolerances[slot]):
+                            converged[slot] = True
+                            ran[slot] = steps
+                            field.scent[...] = new_field[slot]
+                if deadline is not None and time.time() > deadline:
+                    break
+        for slot in xrange(active):
+            if not converged[slot]:
+                result_buffer[slot] = current
+                ran[slot] = steps
+
+        for slot, field in enumerate(order):
+            field.ran = ran[slot]
+            if not converged[slot]:
+                result = buffers[result_buffer[slot]][slot]
+                field.scent[...] = result
+                if field.ran and (not checked or field.ran % CHECK_EVERY):
+                    previous = buffers[1-result_buffer[slot]][slot:slot+1]
+                    field.residual = self.change(1, result[np.newaxis], 
+                        previous, field.clamps[0] if field.clamps else [])[0]
+            field.set_blocked_clamps()
+
+    def change(self, active, new_field, scent_field, clamp_index):
+        """largest change of an unclamped square in the last step, for
+        each of the first active channels"""
+        term = self.term[:active]
+        np.subtract(new_field, scent_field, out=term)
+        np.abs(term, out=term)
+        term.ravel().put(clamp_index, 0.0)
+        return term.reshape(active, -1).max(axis=1).tolist()
+
+class TileGrid(object):
+    """
+    Split of a wrapped (rows, cols) grid into bands of size rows (the
+    last one may be lower), for DiffusionField.update.
+    """
+    def __init__(self, dimensions, size):
+        rows, cols = dimensions
+        self.rows = rows
+        self.size = size
+        self.count = -(-rows // size)
+        self.starts = np.arange(0, rows, size)
+
+    def any(self, field):
+        'bool per tile: field is True somewhere in the tile'
+        return np.logical_or.reduceat(field.any(axis=1), self.starts)
+
+    def reduce(self, row_values):
+        'largest of row_values (one per row) in each tile'
+        return np.maximum.reduceat(row_values, self.starts)
+
+    def dilate(self, active):
+        'active tiles and their neighbours (wrapped)'
+        return active | np.roll(active, 1) | np.roll(active, -1)
+
+    def runs(self, active):
+        'the (top, bottom) rows of each run of consecutive active tiles'
+        edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1) * self.size
+        ends = np.minimum(np.flatnonzero(edges == -1) * self.size, self.rows)
+        return zip(starts.tolist(), ends.tolist())
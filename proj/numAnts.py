@@ -1,6 +1,37 @@
 #!/usr/bin/env python
 
 """proj/numAnts.py
+v2.15
+- passable_version: bumped when water is revealed, so passable_field
+  consumers (diffusion stencils) can skip unchanged turns
+v2.14
+- vision and explored are FieldSet views over visible_field and
+  explored_field instead of per-turn Python sets
+v2.13
+- orders are buffered (protocol.OrderBuffer) and written with 'go' in one
+  write; duplicate orders for an ant are dropped; flush_orders() sends a
+  partial batch early
+v2.12
+- read input by frame (protocol.FrameReader); turn timer and alarm start
+  when the frame's first byte arrives
+v2.11
+- by_owner (OwnerIndex): per-owner ant/hill sets, coordinate arrays and
+  counts built once per update; my_ants() etc. return cached sets
+v2.10
+- reservations (numLocation.Reservations) replace the per-cell
+  unoccupied_next sweep; reset only touches changed cells
+v2.9
+- incremental vision: vision_count updated only by the stamp deltas of
+  ants that moved, were born or died; new_vision_field marks squares
+  that became visible this turn
+v2.8
+- neighbours (numLocation.NeighbourTable) blocked in bulk for new water
+v2.7
+- cell state in self.cells (numLocation.CellStore) instead of Location
+  attributes; flyweight Locations make setup ~10x faster
+v2.6
+- bulk frame parser (parse_frame) builds NumPy arrays per record kind
+  - old line-by-line parser kept as reference: update(data, bulk=False)
 v2.5
 - implement cell.moves
 - attack_stamp
@@ -33,9 +64,13 @@ import numpy as np
 
 import numLocation as location
 from constants import *
+from protocol import FrameReader, OrderBuffer
 
 log = logging.getLogger(__name__)
 
+# record letter, numbers after letter
+FRAME_RECORDS = (('w', 2), ('f', 2), ('a', 3), ('d', 3), ('h', 3))
+
 class Ants():
 
     # Control Flow functions
@@ -46,12 +81,26 @@ class Ants():
         self.dimensions = None
         self.loc = None
         self.world_list = None
+        self.cells = None
+        self.neighbours = None
+        self.reservations = None
+        self.by_owner = OwnerIndex()
 
         self.passable_field = None
+        self.passable_version = 0 # changes whenever water is revealed
         self.ant_field = None
         self.explored_field = None
         self.visible_field = None
         self.vision_stamp = None
+        self.vision_count = None
+        self.new_vision_field = None
+        self.new_vision_index = np.empty(0, dtype=int)
+        self.vision_offsets = None
+        self.vision_deltas = None
+        self.vision_ants = set() # my ants counted in vision_count
+        self.orders = [] # issued since last update
+        self.order_buffer = OrderBuffer()
+        self.frame = None
 
         self.hill_set = set()
         self.ant_set = set()
@@ -70,11 +119,13 @@ class Ants():
         self.spawnradius2 = 0
         self.turns = 0
 
-    def setup(self, data):
+    def setup(self, data, start_time=None):
         'parse initial input and setup starting game state'
 
-        # start timer
-        self.turn_start_time = time.time()
+        # start timer (from arrival of input, if known)
+        if start_time is None:
+            start_time = time.time()
+        self.turn_start_time = start_time
 
         log.info("== SETUP BEGINS == ")
 
@@ -106,57 +157,144 @@ class Ants():
 
         log.info("Dimensions: %s", self.dimensions)
 
+        self.cells = location.CellStore(self)
+        self.neighbours = location.NeighbourTable(self.dimensions)
+        self.reservations = location.Reservations(self.cells)
         self.passable_field = np.ones(self.dimensions, dtype=bool)
         self.ant_field = np.zeros(self.dimensions, dtype=bool)
         self.explored_field = np.zeros(self.dimensions, dtype=bool)
-        self.visible_field = np.zeros(self.dimensions, dtype=bool)
+        self.visible_field = self.cells.visible
         self.vision_stamp = location.gen_stamp(self.viewradius2)
+        self.vision_count = np.zeros(self.dimensions, dtype=np.int16)
+        self.new_vision_field = np.zeros(self.dimensions, dtype=bool)
+        self.vision_offsets = location.mask_offsets(self.vision_stamp)
+        self.vision_deltas = location.gen_vision_deltas(self.vision_stamp)
         self.attack_stamp = location.gen_stamp(self.attackradius2)
 
         time_before_loc = time.time()
-        self.loc = [[location.Location(r,c,self) for c in xrange(self.cols)]
+        Location = self.cells.Location
+        self.loc = [[Location(r,c) for c in xrange(self.cols)]
                     for r in xrange(self.rows)]
         self.world_list = list(itertools.chain.from_iterable(self.loc))
+        self.vision = location.FieldSet(self.visible_field, self.world_list)
+        self.explored = location.FieldSet(self.explored_field,
+                                          self.world_list)
         loc_time = time.time() - time_before_loc
         log.debug('Used on Locations = {0} seconds'.format(loc_time))
 
-        # preset ranges
-        time_before_range = time.time()
-        do_rows = self.rows
-        for cell in self.world_list:
-            cell.gen_adj()
-        range_time = time.time() - time_before_range
-        done_cells = do_rows*self.cols
-        self.cell_time = 1000 * range_time / done_cells # milliseconds
-        log.debug('Used on gen_ranges p1 = %f seconds', range_time)
-        log.debug('Per cell: %f milliseconds', self.cell_time)
-        time_before_range = time.time()
-
         log.debug('remaining in setup = {0} milliseconds'.format(self.setup_time_remaining()))
 
 
-    def update(self, data):
+    def update(self, data, start_time=None, bulk=True):
         'parse engine input and update the game state'
-        # start timer
-        self.turn_start_time = time.time()
+        # start timer (from arrival of input, if known)
+        if start_time is None:
+            start_time = time.time()
+        self.turn_start_time = start_time
 
         #increment turn
         self.cur_turn += 1
         log.info("\n== TURN %s - Update - BEGINS ==", self.cur_turn)
 
-        new_hill_set = set()
-        new_food_set = set()
         # resetting ant/food/dead contents, sets
         #* can consider keeping record of food (but subpar? or equal?)
-        self.ant_field = np.zeros(self.dimensions, dtype=bool)
-        for obj_loc in self.ant_set:
-            obj_loc.contents = None
+        cells = self.cells
+        old_ants = [loc.index for loc in self.ant_set]
+        cells.contents.ravel()[old_ants] = location.EMPTY
+        self.ant_field.ravel()[old_ants] = False
         self.ant_set.clear()
-        for death_loc in self.dead_set:
-            death_loc.recent_deaths = []
+        cells.recent_deaths.clear()
         self.dead_set.clear()
 
         # update map and create new ant and food lists
+        if bulk:
+            self.frame = parse_frame(data)
+            new_hill_set, new_food_set = self.apply_frame(self.frame)
+        else:
+            self.frame = None
+            new_hill_set, new_food_set = self.apply_lines(data)
+        self.by_owner = OwnerIndex(self.ant_set)
+
+        # update vision (must come after my_ants generated)
+        self.gen_vision_field()
+        self.orders = []
+
+        # update razed hills using vision
+        razed_hills = self.vision & (self.hill_set - new_hill_set)
+        for razed in razed_hills:
+            razed.hill = None # razed
+        self.hill_set.difference_update(razed_hills)
+        self.hill_set.update(new_hill_set)
+        self.by_owner.index_hills(self.hill_set)
+        
+        # update eaten food
+        eaten_food = (self.food_set - new_food_set) & self.vision
+        eaten_food_only = eaten_food - self.ant_set
+        for eaten in eaten_food_only:
+            eaten.contents = None
+        self.food_set.difference_update(eaten_food)
+        self.food_set.update(new_food_set)
+        
+        # updating seen but unexplored terrain as LAND
+        # (new water is already marked in explored_field)
+        new_land = self.vision - self.explored
+        cells.terrain[new_land.field] = LAND.value
+        self.explored_field |= self.visible_field
+        
+        # mark occupied status where it may have changed
+        self.reservations.reset([old_ants, 
+                                 [loc.index for loc in self.ant_set],
+                                 [loc.index for loc in eaten_food_only],
+                                 [loc.index for loc in new_food_set],
+                                 new_land.index()])
+        
+        self.log_time()
+
+    def apply_frame(self, frame):
+        """Update map state from the arrays built by parse_frame.
+
+        Returns (new_hill_set, new_food_set).
+        """
+        loc = self.loc
+        cells = self.cells
+        water = frame['w']
+        if len(water):
+            self.passable_field[water[:,0], water[:,1]] = False
+            self.passable_version += 1
+            cells.terrain[water[:,0], water[:,1]] = WATER.value
+            self.neighbours.block(water[:,0] * self.cols + water[:,1])
+            self.explored_field[water[:,0], water[:,1]] = True # know terrain
+
+        food = frame['f']
+        if len(food):
+            cells.contents[food[:,0], food[:,1]] = FOOD
+        new_food_set = set([loc[r][c] for r, c in food.tolist()])
+
+        ants = frame['a']
+        if len(ants):
+            self.ant_field[ants[:,0], ants[:,1]] = True
+            cells.contents[ants[:,0], ants[:,1]] = ants[:,2]
+        self.ant_set.update([loc[r][c] for r, c, owner in ants.tolist()])
+
+        for row, col, owner in frame['d'].tolist():
+            # no restriction on what else is on square
+            cur_loc = loc[row][col]
+            cells.recent_deaths.setdefault(cur_loc, []).append(owner)
+            self.dead_set.add(cur_loc)
+
+        hills = frame['h']
+        if len(hills):
+            cells.hill[hills[:,0], hills[:,1]] = hills[:,2]
+        new_hill_set = set([loc[r][c] for r, c, owner in hills.tolist()])
+        return new_hill_set, new_food_set
+
+    def apply_lines(self, data):
+        """Reference line-by-line version of apply_frame.
+
+        Slower, but kept to check the bulk parser against.
+        """
+        new_hill_set = set()
+        new_food_set = set()
         for line in data.split('\n'):
             line = line.strip().lower()
             if len(line) > 0:
@@ -168,13 +306,10 @@ class Ants():
                     cur_loc = self.loc[row][col]
                     if letter == 'w':
                         cur_loc.terrain = WATER
-                        self.explored.add(cur_loc) # know terrain
-                        for neighbor in cur_loc.adj:
-                            neighbor.adj.remove(cur_loc)
-                            neighbor.moves.remove(cur_loc)
-                        cur_loc.adj = []
-                        cur_loc.moves = []
+                        self.explored_field[cur_loc] = True # know terrain
                         self.passable_field[cur_loc] = False
+                        self.passable_version += 1
+                        self.neighbours.block([cur_loc.index])
                     elif letter == 'f':
                         cur_loc.contents = FOOD
                         new_food_set.add(cur_loc)
@@ -186,46 +321,14 @@ class Ants():
                             self.ant_field[cur_loc] = True
                         elif tokens[0] == 'd':
                             # no restriction on what else is on square
-                            cur_loc.recent_deaths.append(owner)
+                            cur_loc.recent_deaths = (
+                                cur_loc.recent_deaths + [owner])
                             self.dead_set.add(cur_loc)
                         elif tokens[0] == 'h':
                             cur_loc.hill = owner
                             new_hill_set.add(cur_loc)
                             # add to Player info
-
-        # reset vision (must come after my_ants generated)
-        self.gen_vision_field()
-
-        self.vision = set([self.loc[r][c] 
-                      for r,c in zip(*self.visible_field.nonzero())])
-        # update razed hills using vision
-        razed_hills = self.vision & (self.hill_set - new_hill_set)
-        for razed in razed_hills:
-            razed.hill = None # razed
-        self.hill_set.difference_update(razed_hills)
-        self.hill_set.update(new_hill_set)
-        
-        # update eaten food
-        eaten_food = (self.food_set - new_food_set) & self.vision
-        for eaten in (eaten_food - self.ant_set):
-            eaten.contents = None
-        self.food_set.difference_update(eaten_food)
-        self.food_set.update(new_food_set)
-        
-        # updating seen but unexplored terrain as LAND
-        # new water is not marked in explored_field yet
-        for land_loc in (self.vision - self.explored):
-            land_loc.terrain = LAND
-        self.explored_field |= self.visible_field
-        #self.explored = set([self.loc[r][c] 
-                      #for r,c in zip(*self.visible_field.nonzero())])
-        self.explored.update(self.vision)              
-        
-        # mark occupied status
-        for cell in self.world_list:
-            cell.unoccupied_next = cell.unoccupied
-        
-        self.log_time()
+        return new_hill_set, new_food_set
 
     def time_remaining(self):
         return self.turntime - int(1000 * (time.time() - self.turn_start_time))
@@ -239,47 +342,95 @@ class Ants():
 
 
     def issue_order(self, order):
-        'issue an order by writing the proper ant location and direction'
+        'queue an order for the proper ant location and direction'
         (row, col), direction = order
-        sys.stdout.write('o %s %s %s\n' % (row, col, direction))
-        sys.stdout.flush()
+        if self.order_buffer.add(row, col, direction):
+            self.orders.append(order)
+
+    def flush_orders(self):
+        'send the orders issued so far now, without ending the turn'
+        self.order_buffer.flush()
 
     def finish_turn(self):
-        'finish the turn by writing the go line'
-        sys.stdout.write('go\n')
-        sys.stdout.flush()
+        'finish the turn by writing the buffered orders and the go line'
+        self.order_buffer.finish()
 
     # Utility Functions
 
     # a) Precalculation
     def gen_vision_field(self):
-        
-        vision = np.zeros(self.dimensions, dtype=bool)
-        for ant in self.my_ants():
-            vision = location.or_stamp(vision, self.vision_stamp, 
-                                       centre=ant)
-        self.visible_field = vision
-        for cell in self.world_list:
-            cell.visible = vision[cell]
+        """
+        Incrementally update visible_field (vision) and new_vision_field.
+
+        vision_count holds the number of my ants seeing each square; only
+        the stamp deltas of ants that moved, were born or died are
+        applied, so the cost follows ant movement rather than map area.
+        """
+        my_ants = self.my_ants()
+        gone = self.vision_ants - my_ants
+        born = my_ants - self.vision_ants
+        # pair up last turn's orders; any unpaired change is a birth/death
+        moved = dict((direction, []) for direction in location.AIM)
+        for (row, col), direction in self.orders:
+            source = self.loc[row][col]
+            target = source.aim(direction)
+            if source in gone and target in born:
+                gone.remove(source)
+                born.remove(target)
+                moved[direction].append(target)
+        touched = []
+        for direction, centres in moved.items():
+            if centres:
+                enter, leave = self.vision_deltas[direction]
+                touched.append(self.stamp_vision(centres, enter, 1))
+                touched.append(self.stamp_vision(centres, leave, -1))
+        if born:
+            touched.append(self.stamp_vision(born, self.vision_offsets, 1))
+        if gone:
+            touched.append(self.stamp_vision(gone, self.vision_offsets, -1))
+        self.vision_ants = my_ants
+
+        # refresh visibility only where the count changed
+        visible = self.visible_field.ravel()
+        new_vision = self.new_vision_field.ravel()
+        new_vision[self.new_vision_index] = False
+        if touched:
+            touched = np.unique(np.concatenate(touched))
+            was_visible = visible[touched]
+            now_visible = self.vision_count.ravel()[touched] > 0
+            visible[touched] = now_visible
+            self.new_vision_index = touched[now_visible & ~was_visible]
+        else:
+            self.new_vision_index = np.empty(0, dtype=int)
+        new_vision[self.new_vision_index] = True
+
+    def stamp_vision(self, centres, offsets, delta):
+        """Add delta to vision_count at offsets around each centre.
+        Returns flat indices of the changed squares."""
+        r, c = location.stamp_cells(self.dimensions, offsets, centres)
+        index = r * self.cols + c
+        np.add.at(self.vision_count.ravel(), index, delta)
+        return index
 
     # b) Location sets
 
+    # cached in by_owner until the next update: do not modify
+
     def my_hills(self):
-        return set(loc for loc in self.hill_set if loc.hill == ME)
+        return self.by_owner.my_hills
 
     def enemy_hills(self):
         """Return a set of all enemy hills last seen standing."""
         # previously returned tuple w/ owner, now only location
-        return set(loc for loc in self.hill_set if loc.hill != ME)
+        return self.by_owner.enemy_hills
 
     def my_ants(self):
         """Return a set of all my ant Locations."""
-        # consider cache
-        return set(loc for loc in self.ant_set if loc.contents == ME)
+        return self.by_owner.ants[ME]
 
     def enemy_ants(self):
         """Return a set of all visible enemy ants."""
-        return set(loc for loc in self.ant_set if loc.contents != ME)
+        return self.by_owner.enemy_ants
 
     @property
     def food(self):
@@ -310,7 +461,7 @@ class Ants():
         'parse input, update game state and call the bot classes do_turn method'
         log.info("\n\n======= GAME BEGINS ======= ")
         ants = Ants()
-        map_data = ''
+        reader = FrameReader()
         if os.name == 'posix':
             bot.timer_cutoff = True
             signal.signal(signal.SIGALRM, timeout_handler)
@@ -318,30 +469,27 @@ class Ants():
             bot.timer_cutoff = False
         while(True):
             try:
-                current_line = sys.stdin.readline().rstrip('\r\n') # string new line char
-                if current_line.lower() == 'ready':
+                frame = reader.read_frame()
+                if frame is None: # EOF
+                    break
+                terminator, map_data, start_time = frame
+                if terminator == 'ready':
                     if bot.timer_cutoff:
-                        signal.setitimer(signal.ITIMER_REAL, 
-                                         (ants.loadtime-100)/1000.0)
-                    ants.setup(map_data)
+                        set_alarm(start_time, ants.loadtime-100)
+                    ants.setup(map_data, start_time)
                     bot.do_setup(ants)
                     signal.setitimer(signal.ITIMER_REAL, 0)
                     ants.finish_turn()
-                    map_data = ''
-                elif current_line.lower() == 'end':
+                elif terminator == 'end':
                     break
-                elif current_line.lower() == 'go':
+                elif terminator == 'go':
                     if bot.timer_cutoff:
-                        signal.setitimer(signal.ITIMER_REAL,
-                                         (ants.turntime-10)/1000.0)
-                    ants.update(map_data)
+                        set_alarm(start_time, ants.turntime-10)
+                    ants.update(map_data, start_time)
                     # call the do_turn method of the class passed in
                     bot.do_turn(ants)
                     signal.setitimer(signal.ITIMER_REAL, 0)
                     ants.finish_turn()
-                    map_data = ''
-                else:
-                    map_data += current_line + '\n'
             except EOFError:
                 break
             except KeyboardInterrupt:
@@ -354,7 +502,68 @@ class Ants():
                 log.error("There was an ERROR!")
                 print 'error' # would crash only in strict
                 ants.finish_turn()
-                map_data = ''
+
+class OwnerIndex(object):
+    """
+    Visible ants and known hills partitioned by owner.
+
+    Built once per update (Ants.by_owner) and replaced by the next one,
+    so repeated my_ants()/enemy_ants() calls in a turn do not rescan
+    ant_set. Sets are shared: callers must not modify them.
+    """
+    PLAYERS = 10
+
+    def __init__(self, ant_set=()):
+        self.ants = [set() for owner in xrange(self.PLAYERS)]
+        self.enemy_ants = set()
+        for loc in ant_set:
+            owner = loc.contents
+            self.ants[owner].add(loc)
+            if owner != ME:
+                self.enemy_ants.add(loc)
+        self.counts = [len(ants) for ants in self.ants]
+        # owners with visible ants, so player loops can skip the rest
+        self.present = [owner for owner in xrange(self.PLAYERS)
+                            if self.counts[owner]]
+        # (n, 2) arrays of (row, col)
+        self.coords = [np.array(list(ants), dtype=int).reshape(-1, 2)
+                       for ants in self.ants]
+        self.index_hills(())
+
+    def index_hills(self, hill_set):
+        self.hills = [set() for owner in xrange(self.PLAYERS)]
+        self.my_hills = set()
+        self.enemy_hills = set()
+        for loc in hill_set:
+            owner = loc.hill
+            self.hills[owner].add(loc)
+            if owner == ME:
+                self.my_hills.add(loc)
+            else:
+                self.enemy_hills.add(loc)
+
+def parse_frame(data):
+    """
+    Bulk parse the records of an update frame.
+
+    Returns dict of record letter -> int array, one row per record:
+    (row, col) for 'w' and 'f'; (row, col, owner) for 'a', 'd' and 'h'.
+    Each kind is converted in one np.fromstring call instead of
+    int() on every token.
+    """
+    lines = data.lower().split('\n')
+    frame = {}
+    for letter, width in FRAME_RECORDS:
+        prefix = letter + ' '
+        body = ' '.join([line[2:] for line in lines if line[:2] == prefix])
+        frame[letter] = np.fromstring(body, dtype=int, 
+                                      sep=' ').reshape(-1, width)
+    return frame
+
+def set_alarm(start_time, limit):
+    """Raise Timeout limit milliseconds after start_time."""
+    seconds = limit/1000.0 - (time.time() - start_time)
+    signal.setitimer(signal.ITIMER_REAL, max(seconds, 0.001))
 
 def timeout_handler(signum, frame):
     signal.setitimer(signal.ITIMER_REAL, 0)
@@ -1,6 +1,36 @@
 #!/usr/bin/env python
 
 """proj/numLocation.py
+v2.12
+- stamp_covers dropped: CombatBot.small_safety, its only user, is gone
+v2.11
+- min_stamp_many: smallest value per cell from a lexsort, not from the
+  order of a fancy assignment (min_stamp_cells)
+- stamp_covers: which stamps cover which squares
+v2.10
+- NeighbourTable.spread: wavefront BFS distances over the table (shared
+  by DistanceField and CombatBot.hilldist_calc); open_into: edges into
+  the squares of a passability mask
+v2.9
+- min_stamp_many: sorted fancy assignment instead of np.minimum.at
+v2.8
+- stamp offsets cached per mask (mask_offsets)
+- or_stamp_many, increment_stamp_many, min_stamp_many: all centres in
+  one scatter; stamp_cells gives the wrapped index arrays
+v2.7
+- FieldSet: read-only set view over a bool field (vision, explored)
+v2.6
+- Reservations: unoccupied_next with bulk reserve/release/free and an
+  O(changed cells) reset
+v2.5
+- stamp_offsets, gen_vision_deltas for incremental vision
+v2.4
+- NeighbourTable: flat (rows*cols, 4) neighbour indices + open mask
+  - adj/moves read from the table
+v2.3
+- CellStore: per-cell state held in NumPy columns
+- Location is now a flyweight (r, c) view with no per-cell attributes
+  - adj/moves computed on demand
 v2.2
 - much much simpler & more efficient or_stamp using modulus
 - increment_stamp; min_stamp
@@ -70,37 +100,90 @@ def stamp_func(field, mask, centre, f):
 
 def or_stamp(field, mask, centre):
     """mask must be square with odd-length sides."""
-    rows_m, cols_m = mask.shape
-    rows_f, cols_f = field.shape
-    centre_r, centre_c = centre
-    if (rows_m != cols_m or rows_m % 2 == 0):
-        raise ValueError
-    radius = rows_m//2
-    r, c = mask.nonzero()
-    r = (r - radius + centre_r) % rows_f
-    c = (c - radius + centre_c) % cols_f
-    field[r,c] = True
+    field[stamp_cells(field.shape, mask_offsets(mask), [centre])] = True
     return field
 def increment_stamp(field, mask, centre):
+    np.add.at(field, stamp_cells(field.shape, mask_offsets(mask), [centre]), 1)
+def min_stamp(field, (bool_mask, mask_value), centre):
+    min_stamp_many(field, bool_mask, [centre], [mask_value])
+
+# batch stamps: every centre in one scatter
+def or_stamp_many(field, mask, centres):
+    """Set field True under mask around each of centres."""
+    field[stamp_cells(field.shape, mask_offsets(mask), centres)] = True
+    return field
+def increment_stamp_many(field, mask, centres, value=1):
+    """Add value under mask around each centre; overlaps accumulate."""
+    np.add.at(field, stamp_cells(field.shape, mask_offsets(mask), centres),
+              value)
+    return field
+def min_stamp_many(field, mask, centres, values):
+    """Lower field to values[i] under mask around centres[i]."""
+    rows, cols, values = min_stamp_cells(field.shape, mask, centres, values)
+    field[rows, cols] = np.minimum(field[rows, cols], values)
+    return field
+def min_stamp_cells(shape, mask, centres, values):
+    """
+    Return (rows, cols, values): each cell under mask around any of 
+    centres once, with the smallest values[i] stamped on it.
+    """
+    d_r, d_c = mask_offsets(mask)
+    rows, cols = stamp_cells(shape, (d_r, d_c), centres)
+    cells = rows * shape[1] + cols
+    values = np.repeat(np.asarray(values), len(d_r))
+    # by cell, then value: the first of each cell is its smallest
+    order = np.lexsort((values, cells))
+    cells, first = np.unique(cells[order], return_index=True)
+    return cells // shape[1], cells % shape[1], values[order][first]
+
+def stamp_cells(shape, offsets, centres):
+    """
+    Return (rows, cols) index arrays of offsets around every centre,
+    wrapped to shape. centres is an (n, 2) array or a sequence of (r, c).
+    """
+    rows_f, cols_f = shape
+    if not isinstance(centres, np.ndarray):
+        centres = list(centres)
+    centres = np.asarray(centres, dtype=int).reshape(-1, 2)
+    d_r, d_c = offsets
+    r = (centres[:,0,np.newaxis] + d_r) % rows_f
+    c = (centres[:,1,np.newaxis] + d_c) % cols_f
+    return r.ravel(), c.ravel()
+
+_offset_cache = {}
+def mask_offsets(mask):
+    """stamp_offsets(mask), computed once per distinct mask."""
+    key = (mask.shape, mask.tostring())
+    offsets = _offset_cache.get(key)
+    if offsets is None:
+        offsets = _offset_cache[key] = stamp_offsets(mask)
+    return offsets
+
+def stamp_offsets(mask):
+    """Return (d_r, d_c) arrays of the True cells of mask, relative to 
+    its centre. mask must be square with odd-length sides."""
     rows_m, cols_m = mask.shape
-    rows_f, cols_f = field.shape
-    centre_r, centre_c = centre
     if (rows_m != cols_m or rows_m % 2 == 0):
         raise ValueError
     radius = rows_m//2
     r, c = mask.nonzero()
-    r = (r - radius + centre_r) % rows_f
-    c = (c - radius + centre_c) % cols_f
-    field[r,c] += 1
-def min_stamp(field, (bool_mask, mask_value), centre):
-    rows_m, cols_m = bool_mask.shape
-    rows_f, cols_f = field.shape
-    centre_r, centre_c = centre
-    radius = rows_m//2
-    r, c = bool_mask.nonzero()
-    r_new = (r - radius + centre_r) % rows_f
-    c_new = (c - radius + centre_c) % cols_f
-    field[r_new, c_new] = np.minimum(field[r_new, c_new], mask_value)
+    return (r - radius, c - radius)
+
+def gen_vision_deltas(mask):
+    """
+    Returns dict of direction -> (enter, leave) offsets, relative to the
+    new position of an ant that moved one step in that direction.
+    Adapted from vision_offsets_cache in the engine (tools/ants.py).
+    """
+    locs = set(zip(*stamp_offsets(mask)))
+    deltas = {}
+    for direction, (d_r, d_c) in AIM.items():
+        # the previous view, relative to the new position
+        p_locs = set((r - d_r, c - d_c) for r, c in locs)
+        enter = np.array(sorted(locs - p_locs), dtype=int).reshape(-1, 2)
+        leave = np.array(sorted(p_locs - locs), dtype=int).reshape(-1, 2)
+        deltas[direction] = (tuple(enter.T), tuple(leave.T))
+    return deltas
 
 def gen_stamp(radius2):
     """
@@ -148,32 +231,226 @@ class Offset(LocTuple):
     def __add__(self, other):
         return Offset(self.r+other.r, self.c+other.c, dimensions)
 
+# module-level aim offsets (replaces per-cell AIM dict)
+AIM = {'n': (-1, 0),
+       'e': (0, 1),
+       's': (1, 0),
+       'w': (0, -1)}
+
+EMPTY = -6 # contents/hill column value for None
+TERRAINS = dict((t.value, t) for t in (LAND, WATER, UNKNOWN))
+
+class CellStore(object):
+    """
+    Per-cell state kept as NumPy columns, shared by all Locations.
+
+    Columns are (rows, cols) arrays; column.ravel() is indexed by the
+    flat index r*cols + c (Location.index).
+    """
+    def __init__(self, game):
+        dimensions = game.dimensions
+        self.terrain = np.empty(dimensions, dtype=np.int8)
+        self.terrain.fill(UNKNOWN.value)
+        self.contents = np.empty(dimensions, dtype=np.int8)
+        self.contents.fill(EMPTY)
+        self.hill = np.empty(dimensions, dtype=np.int8)
+        self.hill.fill(EMPTY)
+        self.visible = np.zeros(dimensions, dtype=bool)
+        self.hilldist = np.empty(dimensions, dtype=int)
+        self.hilldist.fill(INF)
+        self.unoccupied_next = np.zeros(dimensions, dtype=bool)
+        self.recent_deaths = {} # Location -> list of owners
+        # flyweight class bound to this game
+        self.Location = type('Location', (Location,), 
+                             {'__slots__': (), 'game': game})
+
+    @property
+    def unoccupied(self):
+        """Return bool field of empty land or hill."""
+        return (self.terrain == LAND.value) & (self.contents == EMPTY)
+
+class FieldSet(object):
+    """
+    Set-like view of the Locations where a bool field is True.
+
+    Membership and len read the field directly; Locations are only made
+    when iterating. Operations with another FieldSet combine masks and
+    return a new FieldSet; operations with a plain set return a set.
+    Use .field / index() when only the mask is needed.
+
+    The view follows later changes to the field; results of operations
+    are snapshots.
+    """
+    def __init__(self, field, world):
+        self.field = field
+        self.world = world # Locations in flat index order
+
+    def index(self):
+        return np.flatnonzero(self.field)
+
+    def __contains__(self, loc):
+        return bool(self.field[loc])
+
+    def __iter__(self):
+        world = self.world
+        return (world[i] for i in self.index().tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.field))
+
+    def __nonzero__(self):
+        return bool(self.field.any())
+
+    def __sub__(self, other):
+        if isinstance(other, FieldSet):
+            return FieldSet(self.field & ~other.field, self.world)
+        return set(self) - other
+
+    def __rsub__(self, other):
+        field = self.field
+        return set(loc for loc in other if not field[loc])
+
+    def __and__(self, other):
+        if isinstance(other, FieldSet):
+            return FieldSet(self.field & other.field, self.world)
+        field = self.field
+        return set(loc for loc in other if field[loc])
+    __rand__ = __and__
+
+    def __or__(self, other):
+        if isinstance(other, FieldSet):
+            return FieldSet(self.field | other.field, self.world)
+        return set(self) | other
+    __ror__ = __or__
+
+class Reservations(object):
+    """
+    Move reservations kept in CellStore.unoccupied_next.
+
+    Only cells that were reserved/released, or whose unoccupied state
+    may have changed, are reset each turn. Cells can be given as 
+    Locations or flat indices.
+    """
+    def __init__(self, cells):
+        self.cells = cells
+        self.free_flat = cells.unoccupied_next.ravel() # view
+        self.dirty = []
+
+    def index(self, cells):
+        if isinstance(cells, np.ndarray):
+            return cells
+        elif isinstance(cells, Location):
+            return np.array([cells.index])
+        return np.array([loc.index for loc in cells], dtype=int)
+
+    def reserve(self, targets):
+        """Mark targets as occupied next turn."""
+        targets = self.index(targets)
+        self.free_flat[targets] = False
+        self.dirty.append(targets)
+
+    def release(self, sources):
+        """Mark sources as free next turn."""
+        sources = self.index(sources)
+        self.free_flat[sources] = True
+        self.dirty.append(sources)
+
+    def move(self, sources, targets):
+        self.release(sources)
+        self.reserve(targets)
+
+    def free(self, candidates):
+        """Return bool array: is each candidate free next turn?"""
+        return self.free_flat[self.index(candidates)]
+
+    def reset(self, changed):
+        """Reset dirty and changed cells to their current unoccupied
+        state (empty land or hill)."""
+        index = np.concatenate([np.asarray(i, dtype=int) 
+                                for i in self.dirty + changed])
+        terrain = self.cells.terrain.ravel()[index]
+        contents = self.cells.contents.ravel()[index]
+        self.free_flat[index] = (terrain == LAND.value) & (contents == EMPTY)
+        self.dirty = []
+
+class NeighbourTable(object):
+    """
+    Flat neighbour indices of every cell, one column per AIM direction,
+    with an open mask that is False towards (and from) known WATER.
+    """
+    def __init__(self, dimensions):
+        rows, cols = dimensions
+        self.directions = list(AIM)
+        r, c = np.indices(dimensions)
+        self.table = np.empty((rows*cols, len(AIM)), dtype=np.int32)
+        for k, direction in enumerate(self.directions):
+            d_r, d_c = AIM[direction]
+            self.table[:,k] = (((r + d_r) % rows) * cols + 
+                               (c + d_c) % cols).ravel()
+        self.open = np.ones(self.table.shape, dtype=bool)
+        self.behind = [self.directions.index(BEHIND[d]) 
+                       for d in self.directions]
+        # scratch for dropping repeats from a wave without sorting
+        self.order = np.empty(rows*cols, dtype=np.int32)
+
+    def block(self, cells):
+        """Close all edges into and out of cells (flat indices)."""
+        cells = np.asarray(cells, dtype=np.int32)
+        self.open[cells] = False
+        for k, back in enumerate(self.behind):
+            self.open[self.table[cells,k], back] = False
+
+    def neighbours(self, cell):
+        """Return array of passable neighbours of one cell."""
+        return self.table[cell][self.open[cell]]
+
+    def expand(self, cells):
+        """Return passable neighbours of many cells (may repeat)."""
+        return self.table[cells][self.open[cells]]
+
+    def open_into(self, unblocked, out=None):
+        """Edges into the squares of a bool field (rows, cols), as an open
+        mask like self.open; the squares they leave may be blocked."""
+        return unblocked.ravel().take(self.table, out=out)
+
+    def spread(self, distance, sources, limit=None, open=None, 
+               unreached=INF):
+        """
+        Breadth-first distances: fills distance (flat, one per cell) with
+        the steps from the nearest of sources (flat indices) along open
+        edges (self.open unless given), and unreached further than limit
+        steps or out of reach. One batch of NumPy operations per step.
+        Returns the number of steps taken.
+        """
+        if open is None:
+            open = self.open
+        distance.fill(unreached)
+        wave = np.unique(sources)
+        steps = 0
+        while len(wave):
+            distance[wave] = steps
+            if steps == limit:
+                break
+            wave = self.table[wave][open[wave]]
+            wave = wave[distance[wave] == unreached]
+            # one copy of each repeated cell keeps its position, whichever
+            # of the repeated assignments lands
+            self.order[wave] = np.arange(len(wave), dtype=np.int32)
+            wave = wave[self.order[wave] == np.arange(len(wave))]
+            steps += 1
+        return steps
+
 class Location(LocTuple):
-    def __new__(cls, r, c, game=None):
-        return LocTuple.__new__(cls, r, c)
+    """
+    (r, c) view of a cell; state lives in game.cells (a CellStore).
 
-    def __init__(self, r, c, game=None):
-        if game is not None:
-            self.game = game
-        else:
-            self.game = DEFAULT_GAME
-
-        self.AIM = {
-        'n': Offset(-1, 0, game.dimensions),
-        'e': Offset(0, 1, game.dimensions),
-        's': Offset(1, 0, game.dimensions),
-        'w': Offset(0, -1, game.dimensions)}
-        self.adj = []
-        self.moves = [self] # adj + [self]
-
-        self.visible = False # None?
-        self.terrain = UNKNOWN
-        # others can only exist on LAND
-        self.contents = None # player -> ant, FOOD
-        self.recent_deaths = []
-        self.hill = None # player, consider showing razed
-        self.hilldist = INF
-        #self.ghost = None # previous contents if invisible, maybe timed
+    Use CellStore.Location, which knows its game, to make instances.
+    """
+    __slots__ = ()
+    game = None
+
+    def __new__(cls, r, c, game=None):
+        return tuple.__new__(cls, (r, c))
 
     def __repr__(self):
         return "<Location ({0.r}, {0.c})>".format(self)
@@ -206,16 +483,95 @@ class Location(LocTuple):
             new_c = (self.c + other.c) % self.game.cols
             return self.game.loc[new_r][new_c]
 
-    def gen_adj(self):
-        # only do once
-        for offset in self.AIM.values():
-            self.adj.append(self + offset)
-        self.moves.extend(self.adj)
+    @property
+    def index(self):
+        """Flat index into CellStore columns."""
+        return self.r * self.game.cols + self.c
+
+    # per-cell state, stored in game.cells columns
+
+    @property
+    def terrain(self):
+        return TERRAINS[self.game.cells.terrain[self]]
+    @terrain.setter
+    def terrain(self, value):
+        self.game.cells.terrain[self] = value.value
+
+    @property
+    def contents(self):
+        """player -> ant, FOOD, or None"""
+        value = self.game.cells.contents[self]
+        if value == EMPTY:
+            return None
+        return int(value)
+    @contents.setter
+    def contents(self, value):
+        self.game.cells.contents[self] = EMPTY if value is None else value
+
+    @property
+    def hill(self):
+        """player, or None (consider showing razed)"""
+        value = self.game.cells.hill[self]
+        if value == EMPTY:
+            return None
+        return int(value)
+    @hill.setter
+    def hill(self, value):
+        self.game.cells.hill[self] = EMPTY if value is None else value
+
+    @property
+    def visible(self):
+        return bool(self.game.cells.visible[self])
+    @visible.setter
+    def visible(self, value):
+        self.game.cells.visible[self] = value
+
+    @property
+    def hilldist(self):
+        return int(self.game.cells.hilldist[self])
+    @hilldist.setter
+    def hilldist(self, value):
+        self.game.cells.hilldist[self] = value
+
+    @property
+    def unoccupied_next(self):
+        return bool(self.game.cells.unoccupied_next[self])
+    @unoccupied_next.setter
+    def unoccupied_next(self, value):
+        if value:
+            self.game.reservations.release(self)
+        else:
+            self.game.reservations.reserve(self)
+
+    @property
+    def recent_deaths(self):
+        return self.game.cells.recent_deaths.get(self, [])
+    @recent_deaths.setter
+    def recent_deaths(self, value):
+        if value:
+            self.game.cells.recent_deaths[self] = value
+        else:
+            self.game.cells.recent_deaths.pop(self, None)
+
+    @property
+    def adj(self):
+        """Passable neighbours; empty if self is WATER."""
+        world = self.game.world_list
+        neighbours = self.game.neighbours.neighbours(self.index)
+        return [world[i] for i in neighbours.tolist()]
+
+    @property
+    def moves(self):
+        """adj + [self]; empty if self is WATER."""
+        if not self.game.passable_field[self]:
+            return []
+        return [self] + self.adj
 
     @property
     def ant(self):
-        if self.contents is not FOOD:
-            return self.contents
+        contents = self.contents
+        if contents != FOOD:
+            return contents
         else:
             return None
 
@@ -229,12 +585,15 @@ class Location(LocTuple):
     def unoccupied(self):
         """Return True if location is empty land or hill."""
         # may be just invisible
-        return (self.terrain is LAND) and (self.contents is None)
-        #return self.game.map[self.r][self.c] in (LAND, DEAD)
+        cells = self.game.cells
+        return bool(cells.terrain[self] == LAND.value and 
+                    cells.contents[self] == EMPTY)
 
     def aim(self, direction): # previously called destination
         """Calculate new Location given the direction"""
-        return (self + self.AIM[direction])
+        d_r, d_c = AIM[direction]
+        game = self.game
+        return game.loc[(self.r + d_r) % game.rows][(self.c + d_c) % game.cols]
     
     def manhattan(self, target):
         """Calculate closest Manhattan distance to target."""
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""proj/predict.py
+v1.1
+- observe keeps last turn's visibility only within two steps of its
+  ants (all a match reads), not a copy of the map
+- occupancy adds into a given field (np.add.at at the destinations)
+  instead of a map-sized bincount
+v1.0
+- MovePredictor: how each player's ants move (stay, or a step in each
+  AIM direction), learnt online from ants matched between consecutive
+  turns; next turn's move probabilities and expected occupancy of
+  their ants, at a cost linear in the ants seen
+"""
+
+import numpy as np
+
+from proj.numLocation import AIM
+
+# moves: stay, then a step in each direction in AIM order (as in
+# NeighbourTable)
+MOVES = len(AIM) + 1
+PLAYERS = 10
+
+class MovePredictor(object):
+    """
+    Move tendencies of every player, and where their ants will be.
+
+    Each turn observe() matches the ants seen to those seen the turn
+    before: an ant counts if exactly one ant of its owner was on its
+    square or next to it, that ant has no other ant of the owner
+    around it now, and all those squares were in sight both turns. The
+    move it made is counted for its owner; counts fade by decay every
+    turn, so a bot that changes its ways is followed.
+
+    predict() shares each ant out over its open moves in proportion to
+    its owner's counts (plus prior, so a player never seen to move may
+    still make any move); occupancy() adds the shares up on the map.
+
+    Usage:
+        predictor = MovePredictor(ants.dimensions, ants.neighbours)
+        predictor.observe(cells, owners, ants.visible_field) # each turn
+        probabilities = predictor.predict(cells, owners, open_moves)
+        predictor.occupancy(cells, probabilities, field, weight)
+    """
+    def __init__(self, dimensions, neighbours, decay=0.98, prior=1.0):
+        rows, cols = dimensions
+        self.dimensions = dimensions
+        self.neighbours = neighbours
+        self.decay = decay
+        self.prior = prior
+        self.counts = np.zeros((PLAYERS, MOVES))
+        # owner of the ant on each square, -1 elsewhere: last turn's and
+        # a spare one; only the ants' squares are ever reset
+        self.grid = np.empty(rows*cols, dtype=np.int8)
+        self.grid.fill(-1)
+        self.spare = self.grid.copy()
+        self.cells = np.empty(0, dtype=int) # last turn's ants
+        # last turn's visibility, only kept up to date near its ants
+        # (near()): elsewhere it is never read
+        self.visible = np.zeros(rows*cols, dtype=bool)
+        self.matched = 0 # moves counted by the last observe
+
+    def around(self, cells):
+        'each square (flat index), then its neighbours, one row per square'
+        return np.column_stack((cells, self.neighbours.table[cells]))
+
+    def near(self, cells):
+        """
+        The squares (flat) one or two steps from cells, cells included
+        (two steps back): around() an ant that moved at most one step
+        from one of them. Squares repeat.
+        """
+        ring = self.neighbours.table[cells]
+        return np.concatenate((ring, self.neighbours.table[ring]),
+                              axis=None)
+
+    def observe(self, cells, owners, visible):
+        """
+        Learn from the ants seen this turn, as flat cells and owners,
+        with the visible field of this turn.
+        """
+        cells = np.asarray(cells, dtype=int)
+        owners = np.asarray(owners, dtype=int)
+        visible = visible.ravel()
+        last, now = self.grid, self.spare
+        now[cells] = owners
+
+        # where each ant may have come from
+        origins = self.around(cells)
+        came = last[origins] == owners[:,np.newaxis]
+        single = ((came.sum(axis=1) == 1) &
+                  self.visible[origins].all(axis=1))
+        ant = np.flatnonzero(single)
+        origin = came[ant].argmax(axis=1)
+        source = origins[ant, origin]
+        # where that ant may have gone to
+        goals = self.around(source)
+        went = now[goals] == owners[ant,np.newaxis]
+        single = (went.sum(axis=1) == 1) & visible[goals].all(axis=1)
+        ant, origin = ant[single], origin[single]
+        # it came from the neighbour in direction k: it moved the other way
+        behind = np.array([0] + [k + 1 for k in self.neighbours.behind])
+        moves = behind[origin]
+
+        self.counts *= self.decay
+        self.counts += np.bincount(owners[ant] * MOVES + moves,
+                                   minlength=PLAYERS * MOVES
+                                   ).reshape(PLAYERS, MOVES)
+        self.matched = len(ant)
+
+        last[self.cells] = -1
+        self.grid, self.spare = now, last
+        self.cells = cells
+        # the squares around an ant next turn are near() the one ant it
+        # can be matched to
+        near = self.near(cells)
+        self.visible[near] = visible[near]
+
+    def tendencies(self, owner):
+        'the share of each move in what owner was seen to do'
+        counts = self.counts[owner] + self.prior
+        return counts / counts.sum()
+
+    def predict(self, cells, owners, open_moves):
+        """
+        Probability of each move (n, MOVES) of the ants on cells, of
+        owners; moves not open_moves are never made.
+        """
+        weights = np.where(open_moves,
+                           self.counts[np.asarray(owners)] + self.prior, 0.0)
+        return weights / weights.sum(axis=1)[:,np.newaxis]
+
+    def occupancy(self, cells, probabilities, field=None, weight=1.0):
+        """
+        Add weight times the expected number of these ants on each
+        square next turn to field (a contiguous map; new if None), at
+        just the squares they may move to. Returns field.
+        """
+        if field is None:
+            field = np.zeros(self.dimensions)
+        destinations = self.around(np.asarray(cells, dtype=int))
+        np.add.at(field.reshape(-1), destinations.ravel(),
+                  weight * probabilities.ravel())
+        return field
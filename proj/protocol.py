@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""proj/protocol.py
+v1.0
+- FrameReader: chunked stdin reader that splits input into frames
+  ending at 'ready', 'go' or 'end' and timestamps each frame's first byte
+v1.1
+- OrderBuffer: collects a turn's orders, drops duplicate orders for the
+  same ant and writes them with 'go' in a single write
+"""
+
+import sys
+import os
+import re
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+# a terminator is a whole line; searched from the start of a line
+TERMINATOR = re.compile(r'^(ready|go|end)\r?\n', re.M | re.I)
+
+class FrameReader(object):
+    """
+    Reads engine input with large os.read calls instead of one readline
+    per line, and hands out complete frames.
+
+    Usage:
+        reader = FrameReader()
+        frame = reader.read_frame() # None at EOF
+        terminator, data, start_time = frame
+    """
+    def __init__(self, fd=None, chunk_size=65536):
+        if fd is None:
+            fd = sys.stdin.fileno()
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.searched = 0 # start of the first line not yet searched
+        self.frame_start = None # arrival time of the frame's first byte
+        self.read_time = None
+
+    def read_frame(self):
+        """
+        Return (terminator, data, start_time) for the next frame, or None
+        at EOF. terminator is lowercase 'ready', 'go' or 'end'; data is
+        the frame text before the terminator line; start_time is when
+        its first byte was read (time.time()).
+        """
+        while True:
+            match = TERMINATOR.search(self.buffer, self.searched)
+            if match is not None:
+                data = self.buffer[:match.start()]
+                if '\r' in data:
+                    data = data.replace('\r', '')
+                start_time = self.frame_start
+                if start_time is None:
+                    start_time = time.time()
+                self.buffer = self.buffer[match.end():]
+                self.searched = 0
+                # rest of the chunk already belongs to the next frame
+                self.frame_start = self.read_time if self.buffer else None
+                return (match.group(1).lower(), data, start_time)
+            # a partial last line may still become a terminator
+            self.searched = self.buffer.rfind('\n') + 1
+            chunk = os.read(self.fd, self.chunk_size)
+            self.read_time = time.time()
+            if not chunk:
+                return None
+            if not self.buffer:
+                self.frame_start = self.read_time
+            self.buffer += chunk
+
+class OrderBuffer(object):
+    """
+    Collects the orders of one turn and writes them in one block.
+
+    The engine only accepts the first order for an ant and rejects the
+    rest, so later orders for an already ordered ant are dropped here.
+    flush() writes the orders collected so far without ending the turn
+    (for bots that want to commit early orders before a long search);
+    finish() writes whatever is left plus 'go'.
+
+    Usage:
+        buffer = OrderBuffer()
+        buffer.add(row, col, 'n') # False if (row, col) already ordered
+        buffer.flush() # optional, partial batch
+        buffer.finish()
+    """
+    def __init__(self, out=None):
+        self.out = out # None: sys.stdout at write time
+        self.pending = []
+        self.ordered = set() # (row, col) ordered this turn
+
+    def add(self, row, col, direction):
+        'queue an order; return False if this ant already has one'
+        if (row, col) in self.ordered:
+            log.warning('dropped duplicate order %s %s %s',
+                        row, col, direction)
+            return False
+        self.ordered.add((row, col))
+        self.pending.append('o %s %s %s\n' % (row, col, direction))
+        return True
+
+    def write(self, text):
+        out = self.out if self.out is not None else sys.stdout
+        out.write(text)
+        out.flush()
+
+    def flush(self):
+        'write the orders queued so far; the turn stays open'
+        if self.pending:
+            self.write(''.join(self.pending))
+            self.pending = []
+
+    def finish(self):
+        'write the remaining orders and go, and start a new turn'
+        self.pending.append('go\n')
+        self.write(''.join(self.pending))
+        self.pending = []
+        self.ordered.clear()
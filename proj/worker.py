@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""proj/worker.py
+v1.1
+- submit() takes None for a slot not diffused this turn; collect()
+  gives None for it
+v1.0
+- DiffusionWorker: runs diffusion channels in a separate process
+  - masks, sources and results live in shared memory; only clamps,
+    scaling and iteration counts go through the pipe
+  - submit() returns at once; collect(deadline) gives up at the
+    deadline and leaves the job running
+"""
+
+import time
+import logging
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from proj.diffusion import DiffusionField, DiffusionStack
+
+log = logging.getLogger(__name__)
+
+class DiffusionWorker(object):
+    """
+    A worker process holding one DiffusionField per channel (slot), fed
+    with fields prepared in the main process.
+
+    The worker keeps its own stencils, patched from the masks it is
+    sent, and steps the channels together with a DiffusionStack. At
+    most one job is out at a time.
+
+    Usage:
+        worker = DiffusionWorker(ants.dimensions, [0.2, 0.15])
+        worker.start()
+        # each turn, with food and explore prepared:
+        results = worker.collect(deadline) # last job's fields, or None
+        worker.submit([food, explore])     # if the last job is done
+    """
+    def __init__(self, dimensions, factors, dtype=np.float64):
+        self.dimensions = dimensions
+        self.factors = factors
+        self.dtype = dtype
+        size = dimensions[0] * dimensions[1]
+        code = np.dtype(dtype).char
+        # one mask, source and result buffer per slot
+        self.buffers = [(RawArray('b', size), RawArray(code, size),
+                         RawArray(code, size)) for factor in factors]
+        self.masks, self.sources, self.results = [
+            [self.view(buffers[i], dt) for buffers in self.buffers]
+            for i, dt in enumerate((np.bool_, dtype, dtype))]
+        self.connection = None
+        self.process = None
+        self.pending = None # turn of the job out, if any
+        self.collected = 0 # jobs collected so far
+
+    def view(self, buffer, dtype):
+        return np.frombuffer(buffer, dtype=dtype).reshape(self.dimensions)
+
+    def start(self):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=self.serve,
+                                               args=(child,))
+        self.process.daemon = True # dies with the bot
+        self.process.start()
+
+    def close(self):
+        if self.process is not None:
+            self.connection.send(None)
+            self.process.join(1.0)
+            self.process = None
+
+    def submit(self, fields, turn=None):
+        """
+        Send prepared fields (slot i is fields[i], None to skip it) to the
+        worker. Returns False, sending nothing, while the last job is
+        still out.
+        """
+        if self.pending is not None:
+            return False
+        channels = []
+        for slot, field in enumerate(fields):
+            if field is None:
+                channels.append(None)
+                continue
+            self.masks[slot][...] = field.unblocked
+            self.sources[slot][...] = field.scent
+            channels.append((field.stencil_version, field.clamps,
+                             field.scaling and field.scaling[0], field.scale,
+                             field.iterations, field.tolerance))
+        self.connection.send((turn, channels))
+        self.pending = turn
+        return True
+
+    def collect(self, deadline):
+        """
+        Wait until time.time() passes deadline for the job out. Returns a
+        list of result fields (copies, one per slot of the job; None for
+        skipped slots), or None if there is no job or it is not done yet.
+        """
+        if self.pending is None:
+            return None
+        if not self.connection.poll(max(deadline - time.time(), 0.0)):
+            log.info("diffusion worker late for turn %s", self.pending)
+            return None
+        turn, stats = self.connection.recv()
+        self.pending = None
+        self.collected += 1
+        log.info("diffusion worker turn %s: (ran, residual) %s", turn, stats)
+        return [stat and self.results[slot].copy()
+                for slot, stat in enumerate(stats)]
+
+    def serve(self, connection):
+        'worker process main loop'
+        fields = [DiffusionField(self.dimensions, factor, self.dtype)
+                  for factor in self.factors]
+        stack = DiffusionStack(self.dimensions, self.dtype)
+        while True:
+            job = connection.recv()
+            if job is None:
+                break
+            turn, channels = job
+            running = []
+            slots = []
+            for slot, channel in enumerate(channels):
+                if channel is None:
+                    continue
+                (version, clamps, scale_index, scale,
+                 iterations, tolerance) = channel
+                field = fields[slot]
+                field.set_unblocked(self.masks[slot], version)
+                scaling = None
+                if scale_index is not None:
+                    scaling = (scale_index, scale)
+                field.prepare(self.sources[slot], clamps, iterations,
+                              scaling, tolerance)
+                running.append(field)
+                slots.append(slot)
+            for slot, result in zip(slots, stack.run(running)):
+                self.results[slot][...] = result
+            stats = [None] * len(channels)
+            for slot, field in zip(slots, running):
+                stats[slot] = (field.ran, field.residual)
+            connection.send((turn, stats))